@@ -10,6 +10,8 @@ import boto3
 from dotenv import find_dotenv, load_dotenv
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from app.services.embedding_dispatcher import EmbeddingCoalescer, EmbeddingDispatcher
+from app.services.tracing import current_span
 from app.services.vector_store.factory import get_vector_store
 
 load_dotenv(find_dotenv())
@@ -47,9 +49,21 @@ RAG_PORT = int(os.getenv("RAG_PORT", 8000))
 RAG_UPLOAD_TIMEOUT = int(get_env_variable("RAG_UPLOAD_TIMEOUT", "300"))  # 5 minutes default
 RAG_PROCESSING_TIMEOUT = int(get_env_variable("RAG_PROCESSING_TIMEOUT", "600"))  # 10 minutes default
 
+# Background ingestion jobs (`/embed?async=true`)
+RAG_JOB_STORE = get_env_variable("RAG_JOB_STORE", "memory").lower()  # "memory" or "postgres"
+RAG_JOB_WORKERS = int(get_env_variable("RAG_JOB_WORKERS", "2"))
+RAG_JOB_LEASE_SECONDS = int(get_env_variable("RAG_JOB_LEASE_SECONDS", "300"))
+# How long completed and failed jobs stay queryable before they are deleted
+RAG_JOB_RETENTION_SECONDS = int(get_env_variable("RAG_JOB_RETENTION_SECONDS", "86400"))
+
 RAG_UPLOAD_DIR = get_env_variable("RAG_UPLOAD_DIR", "./uploads/")
 if not os.path.exists(RAG_UPLOAD_DIR):
     os.makedirs(RAG_UPLOAD_DIR, exist_ok=True)
+# Uploads up to this size stay in memory; larger ones are spooled to a uniquely named file in RAG_UPLOAD_DIR
+RAG_UPLOAD_MEMORY_MAX_KB = int(get_env_variable("RAG_UPLOAD_MEMORY_MAX_KB", "1024"))
+# Memory and disk taken by the uploads being processed at once, per worker; uploads beyond them get a 503
+RAG_UPLOAD_MEMORY_BUDGET_MB = int(get_env_variable("RAG_UPLOAD_MEMORY_BUDGET_MB", "64"))
+RAG_UPLOAD_DISK_BUDGET_MB = int(get_env_variable("RAG_UPLOAD_DISK_BUDGET_MB", "4096"))
 
 VECTOR_DB_TYPE = VectorDBType(get_env_variable("VECTOR_DB_TYPE", VectorDBType.PGVECTOR.value))
 POSTGRES_USE_UNIX_SOCKET = get_env_variable("POSTGRES_USE_UNIX_SOCKET", "False").lower() == "true"
@@ -64,6 +78,87 @@ ATLAS_SEARCH_INDEX = get_env_variable("ATLAS_SEARCH_INDEX", "vector_index")
 MONGO_VECTOR_COLLECTION = get_env_variable("MONGO_VECTOR_COLLECTION", None)  # Deprecated, backwards compatability
 CHUNK_SIZE = int(get_env_variable("CHUNK_SIZE", "1500"))
 CHUNK_OVERLAP = int(get_env_variable("CHUNK_OVERLAP", "100"))
+# Number of chunks sent to the embeddings provider per call by the ingestion pipeline
+RAG_EMBED_BATCH_SIZE = int(get_env_variable("RAG_EMBED_BATCH_SIZE", "64"))
+# Number of embedding batches buffered between pipeline stages (bounds memory per upload)
+RAG_PIPELINE_QUEUE_SIZE = int(get_env_variable("RAG_PIPELINE_QUEUE_SIZE", "4"))
+# Processes extracting text from large PDFs in parallel; "1" keeps the single-threaded pypdf loader
+RAG_PDF_WORKERS = int(get_env_variable("RAG_PDF_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Pages extracted per task by the PDF workers
+RAG_PDF_PAGES_PER_SHARD = int(get_env_variable("RAG_PDF_PAGES_PER_SHARD", "16"))
+# PDFs with at least this many pages use the parallel loader
+RAG_PDF_PARALLEL_MIN_PAGES = int(get_env_variable("RAG_PDF_PARALLEL_MIN_PAGES", "50"))
+# Which pages of small PDFs go through the vision LLM conversion: "auto" (scanned and table-heavy pages), "always" or "never"
+RAG_PDF_VISION_POLICY = get_env_variable("RAG_PDF_VISION_POLICY", "auto").lower()
+# Pages with fewer extractable characters than this are treated as scanned when they contain images
+RAG_PDF_MIN_TEXT_CHARS = int(get_env_variable("RAG_PDF_MIN_TEXT_CHARS", "50"))
+# Fraction of the page covered by detected tables above which a page goes to the vision path
+RAG_PDF_TABLE_COVERAGE = float(get_env_variable("RAG_PDF_TABLE_COVERAGE", "0.3"))
+# Estimates used to report what the text path saved, for runs without vision pages to measure
+RAG_PDF_VISION_SECONDS_PER_PAGE = float(get_env_variable("RAG_PDF_VISION_SECONDS_PER_PAGE", "8"))
+RAG_PDF_VISION_COST_PER_PAGE = float(get_env_variable("RAG_PDF_VISION_COST_PER_PAGE", "0.01"))
+# Rows per Markdown table block when converting spreadsheets; each block repeats the header
+RAG_EXCEL_BLOCK_ROWS = int(get_env_variable("RAG_EXCEL_BLOCK_ROWS", "100"))
+# Text splitter used for ingestion: "auto" (by file type), "recursive", "token", "markdown", "code" or "table"
+RAG_TEXT_SPLITTER = get_env_variable("RAG_TEXT_SPLITTER", "auto").lower()
+# Unit of CHUNK_SIZE and CHUNK_OVERLAP: "characters" or "tokens"
+RAG_CHUNK_SIZE_UNIT = get_env_variable("RAG_CHUNK_SIZE_UNIT", "characters").lower()
+# tiktoken encoding used to count tokens
+RAG_TIKTOKEN_ENCODING = get_env_variable("RAG_TIKTOKEN_ENCODING", "cl100k_base")
+# Embedding batches sent to the provider at once, per worker
+RAG_EMBEDDING_CONCURRENCY = int(get_env_variable("RAG_EMBEDDING_CONCURRENCY", "4"))
+# Starting and largest token budget of one embeddings request; it shrinks on rate limits and grows back
+RAG_EMBEDDING_BATCH_TOKENS = int(get_env_variable("RAG_EMBEDDING_BATCH_TOKENS", "8000"))
+RAG_EMBEDDING_MAX_BATCH_TOKENS = int(get_env_variable("RAG_EMBEDDING_MAX_BATCH_TOKENS", "64000"))
+# Retries of a rate-limited embeddings request
+RAG_EMBEDDING_MAX_RETRIES = int(get_env_variable("RAG_EMBEDDING_MAX_RETRIES", "6"))
+# Milliseconds concurrent embedding calls wait to be merged into one; "0" sends every call as it comes
+RAG_EMBEDDING_COALESCE_MS = float(get_env_variable("RAG_EMBEDDING_COALESCE_MS", "5"))
+# Pending texts that send a merged call without waiting any longer
+RAG_EMBEDDING_COALESCE_MAX_BATCH = int(get_env_variable("RAG_EMBEDDING_COALESCE_MAX_BATCH", "256"))
+# Rows sent per COPY batch when bulk inserting embeddings
+RAG_COPY_BATCH_SIZE = int(get_env_variable("RAG_COPY_BATCH_SIZE", "1000"))
+# Pooled database connections ingestion may hold at once, per worker; the rest stay free for queries
+RAG_INGEST_DB_CONNECTIONS = int(get_env_variable("RAG_INGEST_DB_CONNECTIONS", "3"))
+# Approximate nearest neighbour index on the embeddings: "hnsw", "ivfflat" or "none" (exact search)
+RAG_ANN_INDEX = get_env_variable("RAG_ANN_INDEX", "none").lower()
+# Embedding size to index; 0 detects it from the stored embeddings
+RAG_ANN_DIMENSIONS = int(get_env_variable("RAG_ANN_DIMENSIONS", "0"))
+RAG_HNSW_M = int(get_env_variable("RAG_HNSW_M", "16"))
+RAG_HNSW_EF_CONSTRUCTION = int(get_env_variable("RAG_HNSW_EF_CONSTRUCTION", "64"))
+RAG_HNSW_EF_SEARCH = int(get_env_variable("RAG_HNSW_EF_SEARCH", "40"))
+# 0 picks the list count from the number of stored embeddings
+RAG_IVFFLAT_LISTS = int(get_env_variable("RAG_IVFFLAT_LISTS", "0"))
+RAG_IVFFLAT_PROBES = int(get_env_variable("RAG_IVFFLAT_PROBES", "1"))
+# How embeddings are stored and searched: "vector", "halfvec" (half precision) or "binary" (quantized index, re-ranked)
+RAG_EMBEDDING_STORAGE = get_env_variable("RAG_EMBEDDING_STORAGE", "vector").lower()
+# Candidates per requested result re-ranked by exact distance in "binary" storage
+RAG_BINARY_RERANK_FACTOR = int(get_env_variable("RAG_BINARY_RERANK_FACTOR", "10"))
+# Full-text column on the chunks, fused with vector search by /query and /query_multiple (pgvector only)
+RAG_HYBRID_SEARCH = get_env_variable("RAG_HYBRID_SEARCH", "False").lower() == "true"
+# Postgres text search configuration of the full-text column
+RAG_TEXT_SEARCH_CONFIG = get_env_variable("RAG_TEXT_SEARCH_CONFIG", "simple")
+# Candidates taken from each of the vector and full-text searches before fusion
+RAG_HYBRID_CANDIDATES = int(get_env_variable("RAG_HYBRID_CANDIDATES", "40"))
+# Reciprocal rank fusion constant: higher values flatten the advantage of top ranks
+RAG_HYBRID_RRF_K = int(get_env_variable("RAG_HYBRID_RRF_K", "60"))
+# In-process per-file embedding matrices for /query (opt-in)
+RAG_FILE_INDEX_CACHE = get_env_variable("RAG_FILE_INDEX_CACHE", "False").lower() == "true"
+RAG_FILE_INDEX_CACHE_MAX_MB = int(get_env_variable("RAG_FILE_INDEX_CACHE_MAX_MB", "256"))
+RAG_FILE_INDEX_CACHE_TTL = int(get_env_variable("RAG_FILE_INDEX_CACHE_TTL", "300"))
+
+# Chunk embedding cache keyed on (embeddings model, chunk digest), pgvector only.
+# Opt-in: every cached entry is a second REAL[] copy of the embedding
+RAG_EMBEDDING_CACHE = get_env_variable("RAG_EMBEDDING_CACHE", "False").lower() == "true"
+RAG_EMBEDDING_CACHE_MAX_ENTRIES = int(get_env_variable("RAG_EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+RAG_EMBEDDING_CACHE_TTL = int(get_env_variable("RAG_EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))  # 30 days
+
+# Query embedding cache: per-process LRU, optionally backed by a cache shared between workers
+RAG_QUERY_CACHE_SIZE = int(get_env_variable("RAG_QUERY_CACHE_SIZE", "1024"))
+RAG_QUERY_CACHE_TTL = int(get_env_variable("RAG_QUERY_CACHE_TTL", "3600"))
+RAG_QUERY_CACHE_BACKEND = get_env_variable("RAG_QUERY_CACHE_BACKEND", "").lower()  # "", "redis" or "postgres"
+REDIS_URI = get_env_variable("REDIS_URI", "redis://localhost:6379")
+RAG_REDIS_URI = get_env_variable("RAG_REDIS_URI", REDIS_URI)
 
 env_value = get_env_variable("PDF_EXTRACT_IMAGES", "False").lower()
 PDF_EXTRACT_IMAGES = True if env_value == "true" else False
@@ -92,6 +187,15 @@ debug_mode = os.getenv("DEBUG_RAG_API", "False").lower() in (
 )
 console_json = get_env_variable("CONSOLE_JSON", "False").lower() == "true"
 
+# Exporter of request tracing spans: "none" (trace ids only go to the JSON logs), "file" or "otlp"
+RAG_TRACE_EXPORTER = get_env_variable("RAG_TRACE_EXPORTER", "none").lower()
+# JSON lines file of the "file" exporter, one OTLP/JSON export request per line
+RAG_TRACE_FILE = get_env_variable("RAG_TRACE_FILE", "./traces.jsonl")
+# OTLP/HTTP traces endpoint of the "otlp" exporter
+RAG_TRACE_OTLP_ENDPOINT = get_env_variable("RAG_TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+# Serve GET /metrics without a JWT, for scrapers that can't send one
+RAG_METRICS_PUBLIC = get_env_variable("RAG_METRICS_PUBLIC", "False").lower() == "true"
+
 if debug_mode:
     logger.setLevel(logging.DEBUG)
 else:
@@ -114,6 +218,11 @@ if console_json:
             if HTTP_RES in record.__dict__:
                 json_record[HTTP_RES] = record.__dict__[HTTP_RES]
 
+            span = current_span()
+            if span is not None:
+                json_record["trace_id"] = span.trace_id
+                json_record["span_id"] = span.span_id
+
             if record.levelno == logging.ERROR and record.exc_info:
                 json_record["exception"] = self.formatException(record.exc_info)
 
@@ -281,9 +390,28 @@ elif EMBEDDINGS_PROVIDER == EmbeddingsProvider.BEDROCK:
 else:
     raise ValueError(f"Unsupported embeddings provider: {EMBEDDINGS_PROVIDER}")
 
-embeddings = init_embeddings(EMBEDDINGS_PROVIDER, EMBEDDINGS_MODEL)
+embeddings_client = init_embeddings(EMBEDDINGS_PROVIDER, EMBEDDINGS_MODEL)
+embeddings = EmbeddingDispatcher(
+    embeddings_client,
+    provider=EMBEDDINGS_PROVIDER.value,
+    concurrency=RAG_EMBEDDING_CONCURRENCY,
+    batch_tokens=RAG_EMBEDDING_BATCH_TOKENS,
+    max_batch_tokens=RAG_EMBEDDING_MAX_BATCH_TOKENS,
+    # The OpenAI and Azure clients split larger calls into sequential requests of EMBEDDINGS_CHUNK_SIZE texts
+    max_batch_size=(
+        int(EMBEDDINGS_CHUNK_SIZE) if EMBEDDINGS_PROVIDER in (EmbeddingsProvider.OPENAI, EmbeddingsProvider.AZURE) else None
+    ),
+    max_retries=RAG_EMBEDDING_MAX_RETRIES,
+)
+if RAG_EMBEDDING_COALESCE_MS > 0:
+    embeddings = EmbeddingCoalescer(
+        embeddings,
+        max_wait_ms=RAG_EMBEDDING_COALESCE_MS,
+        max_batch_size=RAG_EMBEDDING_COALESCE_MAX_BATCH,
+        max_batch_tokens=RAG_EMBEDDING_BATCH_TOKENS,
+    )
 
-logger.info(f"Initialized embeddings of type: {type(embeddings)}")
+logger.info(f"Initialized embeddings of type: {type(embeddings_client)}")
 
 # Vector store
 if VECTOR_DB_TYPE == VectorDBType.PGVECTOR:
@@ -292,6 +420,7 @@ if VECTOR_DB_TYPE == VectorDBType.PGVECTOR:
         embeddings=embeddings,
         collection_name=COLLECTION_NAME,
         mode="async",
+        copy_batch_size=RAG_COPY_BATCH_SIZE,
     )
 elif VECTOR_DB_TYPE == VectorDBType.ATLAS_MONGO:
     # Backward compatability check
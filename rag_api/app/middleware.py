@@ -1,6 +1,7 @@
 # app/middleware.py
 import asyncio
 import os
+import time
 from datetime import datetime, timezone
 
 import jwt
@@ -8,7 +9,9 @@ from fastapi import Request
 from fastapi.responses import JSONResponse
 from jwt import PyJWTError
 
-from app.config import RAG_PROCESSING_TIMEOUT, RAG_UPLOAD_TIMEOUT, logger
+from app.config import RAG_METRICS_PUBLIC, RAG_PROCESSING_TIMEOUT, RAG_UPLOAD_TIMEOUT, logger
+from app.services.metrics import request_seconds
+from app.services.tracing import SPAN_KIND_SERVER, parse_trace_header, span
 
 
 async def security_middleware(request: Request, call_next):
@@ -17,6 +20,8 @@ async def security_middleware(request: Request, call_next):
 
     if request.url.path in {"/docs", "/openapi.json", "/health"}:
         return await next_middleware_call()
+    if request.url.path == "/metrics" and RAG_METRICS_PUBLIC:
+        return await next_middleware_call()
 
     jwt_secret = os.getenv("JWT_SECRET")
     if not jwt_secret:
@@ -68,3 +73,42 @@ async def timeout_middleware(request: Request, call_next):
     except Exception as e:
         logger.error(f"Unexpected error in timeout middleware: {str(e)}")
         return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+
+async def metrics_middleware(request: Request, call_next):
+    """Record request latency by route template, so paths with ids don't create a series each."""
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Set by the router once a route matched; requests rejected before routing have none
+        route = request.scope.get("route")
+        request_seconds.labels(
+            request.method, getattr(route, "path", "unmatched"), str(status_code)
+        ).observe(time.perf_counter() - started)
+
+
+async def tracing_middleware(request: Request, call_next):
+    """
+    Run the request in a root span, continuing the trace of an incoming `traceparent` or
+    `X-Trace-Id` header, and return the trace in the response's `traceparent` header.
+    """
+    trace_id, parent_id = parse_trace_header(request.headers.get("traceparent"), request.headers.get("x-trace-id"))
+    with span(
+        f"{request.method} {request.url.path}",
+        trace_id=trace_id,
+        parent_id=parent_id,
+        kind=SPAN_KIND_SERVER,
+        **{"http.method": request.method, "http.target": request.url.path},
+    ) as request_span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            request_span.name = f"{request.method} {route.path}"
+            request_span.attributes["http.route"] = route.path
+        request_span.attributes["http.status_code"] = response.status_code
+        response.headers["traceparent"] = request_span.traceparent
+        return response
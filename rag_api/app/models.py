@@ -1,9 +1,10 @@
 # app/models.py
 import hashlib
+from datetime import datetime, timezone
 from enum import Enum
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class DocumentResponse(BaseModel):
@@ -32,6 +33,10 @@ class QueryRequestBody(BaseModel):
     file_id: str
     k: int = 4
     entity_id: Optional[str] = None
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+    # Fuse full-text and vector search; defaults to RAG_HYBRID_SEARCH
+    hybrid: Optional[bool] = None
 
 
 class CleanupMethod(str, Enum):
@@ -43,3 +48,42 @@ class QueryMultipleBody(BaseModel):
     query: str
     file_ids: List[str]
     k: int = 4
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+    hybrid: Optional[bool] = None
+
+
+class QueryBatchItem(BaseModel):
+    query: str
+    file_ids: List[str]
+    k: int = 4
+
+
+class QueryBatchBody(BaseModel):
+    queries: List[QueryBatchItem] = Field(..., min_length=1, max_length=100)
+    entity_id: Optional[str] = None
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+
+class IngestionJob(BaseModel):
+    job_id: str
+    file_id: str
+    user_id: str
+    filename: str
+    status: JobStatus = JobStatus.queued
+    stage: Optional[str] = None
+    progress: dict = Field(default_factory=dict)
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    # Everything a worker needs to process the job (upload path, content type, ...); not returned to clients
+    payload: dict = Field(default_factory=dict)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -1,14 +1,11 @@
 # app/routes/document_routes.py
-import hashlib
+import asyncio
+import json
 import os
 import traceback
-from functools import lru_cache
-from shutil import copyfileobj
-from typing import Iterable, List
+from typing import AsyncIterator, Iterable, List, Optional
 
-import aiofiles
 import aiofiles.os
-import tiktoken
 from fastapi import (
     APIRouter,
     Body,
@@ -22,20 +19,52 @@ from fastapi import (
 )
 from langchain_core.documents import Document
 from langchain_core.runnables import run_in_executor
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
-from app.config import CHUNK_OVERLAP, CHUNK_SIZE, RAG_UPLOAD_DIR, logger, vector_store
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from app.config import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    RAG_HYBRID_CANDIDATES,
+    RAG_HYBRID_RRF_K,
+    RAG_HYBRID_SEARCH,
+    embeddings,
+    logger,
+    vector_store,
+)
 from app.constants import ERROR_MESSAGES
 from app.models import (
+    CleanupMethod,
     DocumentResponse,
+    IngestionJob,
+    QueryBatchBody,
     QueryMultipleBody,
     QueryRequestBody,
     StoreDocument,
 )
+from app.services.embedding_cache import chunk_embedding_cache
+from app.services.file_index_cache import file_index_cache
+from app.services.ingestion import lazy_load_documents, store_documents, update_stats
+from app.services.jobs import new_job_id
+from app.services.metrics import timed_stage
+from app.services.query_cache import query_embedding_cache
+from app.services.tracing import current_span, parse_trace_header, span, tracer
+from app.services.uploads import SpooledUpload, UploadBudgetExceeded, upload_budget
 from app.services.vector_store.async_pg_vector import AsyncPgVector
-from app.utils.document_loader import clean_text, cleanup_temp_encoding_file, get_loader, process_documents
+from app.utils.document_loader import (
+    TEXT_LOADER_KINDS,
+    DocumentTextAssembler,
+    chunk_overlap,
+    clean_text,
+    cleanup_temp_encoding_file,
+    get_loader,
+    loader_kind,
+    process_documents,
+)
 from app.utils.health import is_health_ok
-from app.utils.preprocess_file import preprocess_excel, preprocess_pdf
+from app.utils.pdf_pages import page_count
+from app.utils.preprocess_file import pdf_policy_snapshot, preprocess_excel, preprocess_pdf
+from app.utils.text_splitters import TEXT_SPLITTERS, get_text_splitter, token_length
 
 router = APIRouter()
 
@@ -48,35 +77,21 @@ def get_user_id(request: Request, entity_id: str = None) -> str:
         return entity_id if entity_id else request.state.user.get("id")
 
 
-async def save_upload_file_async(file: UploadFile, temp_file_path: str) -> None:
-    """Save uploaded file asynchronously."""
+async def receive_upload(file: UploadFile, upload: SpooledUpload) -> None:
+    """Read the uploaded file into its spool, in memory or on disk."""
     try:
-        async with aiofiles.open(temp_file_path, "wb") as temp_file:
-            chunk_size = 64 * 1024  # 64 KB
-            while content := await file.read(chunk_size):
-                await temp_file.write(content)
-    except Exception as e:
-        logger.error(
-            "Failed to save uploaded file | Path: %s | Error: %s | Traceback: %s",
-            temp_file_path,
-            str(e),
-            traceback.format_exc(),
-        )
+        await upload.receive(file)
+    except UploadBudgetExceeded as e:
+        logger.warning("Upload rejected | File: %s | Error: %s", file.filename, str(e))
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to save the uploaded file. Error: {str(e)}",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"},
         )
-
-
-def save_upload_file_sync(file: UploadFile, temp_file_path: str) -> None:
-    """Save uploaded file synchronously."""
-    try:
-        with open(temp_file_path, "wb") as temp_file:
-            copyfileobj(file.file, temp_file)
     except Exception as e:
         logger.error(
-            "Failed to save uploaded file | Path: %s | Error: %s | Traceback: %s",
-            temp_file_path,
+            "Failed to save uploaded file | File: %s | Error: %s | Traceback: %s",
+            file.filename,
             str(e),
             traceback.format_exc(),
         )
@@ -86,36 +101,50 @@ def save_upload_file_sync(file: UploadFile, temp_file_path: str) -> None:
         )
 
 
-async def load_file_content(filename: str, content_type: str, file_path: str, executor) -> tuple:
+def get_upload_loader(upload: SpooledUpload, filename: str, content_type: str) -> tuple:
+    """`get_loader` for a spooled upload: text in memory is decoded from the buffer, other files are read from disk."""
+    if upload.buffer is not None and loader_kind(filename, content_type) in TEXT_LOADER_KINDS:
+        return get_loader(filename, content_type, upload.name, buffer=upload.buffer)
+    return get_loader(filename, content_type, upload.ensure_file())
+
+
+async def load_file_content(filename: str, content_type: str, upload: SpooledUpload, executor) -> tuple:
     """Load file content using appropriate loader."""
-    temp_file_created = False
     temp_file_path = None
+    loader = None
 
-    # Preprocess Excel files to Markdown for text extraction
-    if filename.lower().endswith((".xlsx", ".xls")):
-        new_filename, new_content_type, new_file_path = preprocess_excel(file_path)
-        # Use TextLoader to preserve markdown table formatting
-        from langchain_community.document_loaders import TextLoader
-
-        loader = TextLoader(new_file_path, autodetect_encoding=True)
-        known_type = True
-        file_ext = "md"
-        temp_file_created = True
-        temp_file_path = new_file_path
-    else:
-        loader, known_type, file_ext = get_loader(filename, content_type, file_path)
+    try:
+        # Preprocess Excel files to Markdown for text extraction
+        if filename.lower().endswith((".xlsx", ".xls")):
+            spool_path = await run_in_executor(executor, upload.ensure_file)
+            with timed_stage("preprocess"), span("preprocess", file_type="excel"):
+                new_filename, new_content_type, temp_file_path = await run_in_executor(
+                    executor, preprocess_excel, spool_path
+                )
+            # Use TextLoader to preserve markdown table formatting
+            from langchain_community.document_loaders import TextLoader
 
-    data = await run_in_executor(executor, loader.load)
+            loader = TextLoader(temp_file_path, autodetect_encoding=True)
+            known_type = True
+            file_ext = "md"
+        else:
+            loader, known_type, file_ext = await run_in_executor(
+                executor, get_upload_loader, upload, filename, content_type
+            )
 
-    # Clean up temporary UTF-8 file if it was created for encoding conversion
-    cleanup_temp_encoding_file(loader)
+        with timed_stage("load"), span("load", loader=type(loader).__name__) as load_span:
+            data = await run_in_executor(executor, loader.load)
+            load_span.attributes["pages"] = len(data)
+    finally:
+        # Clean up temporary UTF-8 file if it was created for encoding conversion
+        cleanup_temp_encoding_file(loader)
 
-    # Clean up temporary file if it was created by preprocessing
-    if temp_file_created and temp_file_path and os.path.exists(temp_file_path):
-        try:
-            os.remove(temp_file_path)
-        except Exception as e:
-            logger.warning(f"Failed to remove temporary preprocessed file {temp_file_path}: {e}")
+        # Clean up temporary file if it was created by preprocessing
+        if temp_file_path and os.path.exists(temp_file_path):
+            try:
+                os.remove(temp_file_path)
+            except Exception as e:
+                logger.warning(f"Failed to remove temporary preprocessed file {temp_file_path}: {e}")
 
     return data, known_type, file_ext
 
@@ -123,14 +152,22 @@ async def load_file_content(filename: str, content_type: str, file_path: str, ex
 def extract_text_from_documents(documents: List[Document], file_ext: str) -> str:
     """Extract text content from loaded documents."""
     text_content = ""
+    previous = None
     if documents:
         for doc in documents:
             if hasattr(doc, "page_content"):
+                content = doc.page_content
+                overlap = chunk_overlap(previous, doc.metadata)
+                previous = doc.metadata
+                if overlap:
+                    # Stored chunks that continue the previous one: drop the repeated text and the separator
+                    content = content[overlap:]
+                    text_content = text_content[:-1]
                 # Clean text if it's a PDF
                 if file_ext == "pdf":
-                    text_content += clean_text(doc.page_content) + "\n"
+                    text_content += clean_text(content) + "\n"
                 else:
-                    text_content += doc.page_content + "\n"
+                    text_content += content + "\n"
 
     # Remove trailing newline
     return text_content.rstrip("\n")
@@ -191,6 +228,27 @@ async def health_check():
         return {"status": "DOWN", "error": str(e)}, 503
 
 
+@router.get("/stats")
+async def get_stats():
+    """Counters of the embeddings provider and its caches, file updates, PDF page routing, tracing and uploads."""
+    return {
+        "embeddings": embeddings.stats(),
+        "embedding_cache": chunk_embedding_cache.stats() if chunk_embedding_cache else None,
+        "query_cache": query_embedding_cache.stats(),
+        "file_index_cache": file_index_cache.stats() if file_index_cache else None,
+        "file_updates": dict(update_stats),
+        "pdf_processing": pdf_policy_snapshot(),
+        "tracing": tracer.stats(),
+        "uploads": upload_budget.stats(),
+    }
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Request and pipeline stage latency histograms, chunk and byte counters and pool gauges, in Prometheus format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @router.get("/documents", response_model=list[DocumentResponse])
 async def get_documents_by_ids(ids: list[str] = Query(...)):
     try:
@@ -233,6 +291,9 @@ async def delete_documents(document_ids: List[str] = Body(...)):
         if isinstance(vector_store, AsyncPgVector):
             existing_ids = await vector_store.get_filtered_ids(document_ids)
             await vector_store.delete(ids=document_ids)
+            if file_index_cache is not None:
+                for document_id in document_ids:
+                    file_index_cache.invalidate(document_id)
         else:
             existing_ids = vector_store.get_filtered_ids(document_ids)
             vector_store.delete(ids=document_ids)
@@ -259,10 +320,84 @@ async def delete_documents(document_ids: List[str] = Body(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Cache the embedding function with LRU cache
-@lru_cache(maxsize=128)
-def get_cached_query_embedding(query: str):
-    return vector_store.embedding_function.embed_query(query)
+async def get_cached_query_embedding(query: str):
+    with timed_stage("query_embed"), span("query_embed"):
+        return await query_embedding_cache.aembed_query(vector_store.embedding_function, query)
+
+
+async def search_file_chunks(
+    embedding: List[float],
+    file_ids: List[str],
+    k: int,
+    ef_search: int = None,
+    probes: int = None,
+    hybrid_query: Optional[str] = None,
+):
+    """
+    Top-k chunks of the given files, from the in-memory file index when enabled, else the vector store.
+    With `hybrid_query`, pgvector fuses a full-text search for it with the vector search.
+    """
+    with timed_stage("search"), span("search", k=k, files=len(file_ids), hybrid=bool(hybrid_query)):
+        filter = {"file_id": file_ids[0]} if len(file_ids) == 1 else {"file_id": {"$in": file_ids}}
+        if not isinstance(vector_store, AsyncPgVector):
+            return vector_store.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+        if hybrid_query and vector_store.text_search_config:
+            return await vector_store.ahybrid_search_with_score_by_vector(
+                embedding,
+                hybrid_query,
+                k=k,
+                filter=filter,
+                candidates=RAG_HYBRID_CANDIDATES,
+                rrf_k=RAG_HYBRID_RRF_K,
+                ef_search=ef_search,
+                probes=probes,
+            )
+        if file_index_cache is not None:
+            documents = await file_index_cache.asimilarity_search(vector_store, embedding, file_ids, k=k)
+            if documents is not None:
+                return documents
+        return await vector_store.asimilarity_search_with_score_by_vector(
+            embedding, k=k, filter=filter, ef_search=ef_search, probes=probes
+        )
+
+
+def hybrid_query(body) -> Optional[str]:
+    """The text to search lexically for a query body, when it asks for (or defaults to) hybrid search."""
+    hybrid = RAG_HYBRID_SEARCH if body.hybrid is None else body.hybrid
+    return body.query if hybrid else None
+
+
+def is_authorized_for_document(doc_user_id, request: Request, entity_id: str = None) -> bool:
+    """
+    Whether the caller may read a document owned by `doc_user_id`: the document has no owner,
+    or it belongs to `entity_id` (or the user when no entity is given), falling back to the
+    user's own id when an entity was given.
+    """
+    if not hasattr(request.state, "user"):
+        user_authorized = entity_id if entity_id else "public"
+    else:
+        user_authorized = entity_id if entity_id else request.state.user.get("id")
+
+    if doc_user_id is None or doc_user_id == user_authorized:
+        return True
+
+    # If using entity_id and access denied, try again with user's actual ID
+    if entity_id and hasattr(request.state, "user"):
+        user_authorized = request.state.user.get("id")
+        if doc_user_id == user_authorized:
+            return True
+        if entity_id == doc_user_id:
+            logger.warning(
+                f"Entity ID {entity_id} matches document user_id but user {user_authorized} is not authorized"
+            )
+        else:
+            logger.warning(
+                f"Access denied for both entity ID {entity_id} and user {user_authorized} to document with user_id {doc_user_id}"
+            )
+    else:
+        logger.warning(f"Unauthorized access attempt by user {user_authorized} to a document with user_id {doc_user_id}")
+    return False
 
 
 @router.post("/query")
@@ -270,57 +405,26 @@ async def query_embeddings_by_file_id(
     body: QueryRequestBody,
     request: Request,
 ):
-    if not hasattr(request.state, "user"):
-        user_authorized = body.entity_id if body.entity_id else "public"
-    else:
-        user_authorized = body.entity_id if body.entity_id else request.state.user.get("id")
-
     authorized_documents = []
 
     try:
-        embedding = get_cached_query_embedding(body.query)
-
-        if isinstance(vector_store, AsyncPgVector):
-            documents = await run_in_executor(
-                None,
-                vector_store.similarity_search_with_score_by_vector,
-                embedding,
-                k=body.k,
-                filter={"file_id": body.file_id},
-            )
-        else:
-            documents = vector_store.similarity_search_with_score_by_vector(
-                embedding, k=body.k, filter={"file_id": body.file_id}
-            )
+        embedding = await get_cached_query_embedding(body.query)
+
+        documents = await search_file_chunks(
+            embedding,
+            [body.file_id],
+            k=body.k,
+            ef_search=body.ef_search,
+            probes=body.probes,
+            hybrid_query=hybrid_query(body),
+        )
 
         if not documents:
             return authorized_documents
 
         document, score = documents[0]
-        doc_metadata = document.metadata
-        doc_user_id = doc_metadata.get("user_id")
-
-        if doc_user_id is None or doc_user_id == user_authorized:
+        if is_authorized_for_document(document.metadata.get("user_id"), request, body.entity_id):
             authorized_documents = documents
-        else:
-            # If using entity_id and access denied, try again with user's actual ID
-            if body.entity_id and hasattr(request.state, "user"):
-                user_authorized = request.state.user.get("id")
-                if doc_user_id == user_authorized:
-                    authorized_documents = documents
-                else:
-                    if body.entity_id == doc_user_id:
-                        logger.warning(
-                            f"Entity ID {body.entity_id} matches document user_id but user {user_authorized} is not authorized"
-                        )
-                    else:
-                        logger.warning(
-                            f"Access denied for both entity ID {body.entity_id} and user {user_authorized} to document with user_id {doc_user_id}"
-                        )
-            else:
-                logger.warning(
-                    f"Unauthorized access attempt by user {user_authorized} to a document with user_id {doc_user_id}"
-                )
 
         return authorized_documents
 
@@ -342,9 +446,50 @@ async def query_embeddings_by_file_id(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def generate_digest(page_content: str):
-    hash_obj = hashlib.md5(page_content.encode())
-    return hash_obj.hexdigest()
+@router.post("/query_batch")
+async def query_embeddings_batch(body: QueryBatchBody, request: Request):
+    """
+    Run several queries in one request. Uncached queries are embedded together, searches run
+    concurrently, and results come back in request order. Each returned chunk is checked with
+    the same ownership rules as `/query`.
+    """
+    try:
+        with timed_stage("query_embed"), span("query_embed", queries=len(body.queries)):
+            embeddings = await query_embedding_cache.aembed_queries(
+                vector_store.embedding_function, [item.query for item in body.queries]
+            )
+        results = await asyncio.gather(
+            *(
+                search_file_chunks(embedding, item.file_ids, k=item.k, ef_search=body.ef_search, probes=body.probes)
+                for item, embedding in zip(body.queries, embeddings)
+            )
+        )
+
+        authorized = {}
+
+        def is_authorized(document: Document) -> bool:
+            doc_user_id = document.metadata.get("user_id")
+            if doc_user_id not in authorized:
+                authorized[doc_user_id] = is_authorized_for_document(doc_user_id, request, body.entity_id)
+            return authorized[doc_user_id]
+
+        return [[(document, score) for document, score in documents if is_authorized(document)] for documents in results]
+
+    except HTTPException as http_exc:
+        logger.error(
+            "HTTP Exception in query_embeddings_batch | Status: %d | Detail: %s",
+            http_exc.status_code,
+            http_exc.detail,
+        )
+        raise http_exc
+    except Exception as e:
+        logger.error(
+            "Error in batch query embeddings | Queries: %d | Error: %s | Traceback: %s",
+            len(body.queries),
+            str(e),
+            traceback.format_exc(),
+        )
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 async def store_data_in_vector_db(
@@ -352,36 +497,41 @@ async def store_data_in_vector_db(
     file_id: str,
     user_id: str = "",
     clean_content: bool = False,
+    executor=None,
+    progress=None,
+    cleanup: Optional[CleanupMethod] = None,
+    file_ext: Optional[str] = None,
+    splitter: Optional[str] = None,
 ) -> bool:
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    documents = text_splitter.split_documents(data)
+    """
+    Split, embed and store documents for a file.
 
-    # If `clean_content` is True, clean the page_content of each document (remove null bytes)
-    if clean_content:
-        for doc in documents:
-            doc.page_content = clean_text(doc.page_content)
-
-    # Preparing documents with page content and metadata for insertion.
-    docs = [
-        Document(
-            page_content=doc.page_content,
-            metadata={
-                "file_id": file_id,
-                "user_id": user_id,
-                "digest": generate_digest(doc.page_content),
-                **(doc.metadata or {}),
-            },
-        )
-        for doc in documents
-    ]
+    `data` may be a lazy iterator (see `lazy_load_documents`); it is consumed in `executor`
+    and streamed through the ingestion pipeline, so large files are never fully materialized.
+    `cleanup` replaces the chunks already stored for `file_id` (see `store_documents`), and
+    `file_ext`, the uploaded file's type, and `splitter` select the text splitter (see `get_text_splitter`).
+    """
+    text_splitter = get_text_splitter(file_ext, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, name=splitter)
+    counters = {}
 
     try:
-        if isinstance(vector_store, AsyncPgVector):
-            ids = await vector_store.aadd_documents(docs, ids=[file_id] * len(documents))
-        else:
-            ids = vector_store.add_documents(docs, ids=[file_id] * len(documents))
+        with span("ingest", file_id=file_id, splitter=type(text_splitter).__name__) as ingest_span:
+            ids = await store_documents(
+                data,
+                vector_store,
+                text_splitter,
+                file_id=file_id,
+                user_id=user_id,
+                clean_content=clean_content,
+                executor=executor,
+                progress=progress,
+                embedding_cache=chunk_embedding_cache,
+                cleanup=cleanup,
+                counters=counters,
+            )
+            ingest_span.attributes.update(counters)
 
-        return {"message": "Documents added successfully", "ids": ids}
+        return {"message": "Documents added successfully", "ids": ids, "counters": counters}
 
     except Exception as e:
         logger.error(
@@ -392,6 +542,9 @@ async def store_data_in_vector_db(
             traceback.format_exc(),
         )
         return {"message": "An error occurred while adding documents.", "error": str(e)}
+    finally:
+        if file_index_cache is not None:
+            file_index_cache.invalidate(file_id)
 
 
 @router.post("/local/embed")
@@ -446,150 +599,409 @@ async def embed_local_file(document: StoreDocument, request: Request, entity_id:
             )
 
 
-@router.post("/embed")
-async def embed_file(
-    request: Request,
-    file_id: str = Form(...),
-    file: UploadFile = File(...),
-    entity_id: str = Form(None),
-):
-    response_status = True
-    response_message = "File processed successfully."
-    known_type = None
-    if not hasattr(request.state, "user"):
-        user_id = entity_id if entity_id else "public"
-    else:
-        user_id = entity_id if entity_id else request.state.user.get("id")
+def get_pdf_page_count(pdf_path: str) -> int:
+    return page_count(pdf_path)
 
-    temp_base_path = os.path.join(RAG_UPLOAD_DIR, user_id)
-    os.makedirs(temp_base_path, exist_ok=True)
-    temp_file_path = os.path.join(RAG_UPLOAD_DIR, user_id, file.filename)
 
-    try:
-        async with aiofiles.open(temp_file_path, "wb") as temp_file:
-            chunk_size = 64 * 1024  # 64 KB
-            while content := await file.read(chunk_size):
-                await temp_file.write(content)
-    except Exception as e:
-        logger.error(
-            "Failed to save uploaded file | Path: %s | Error: %s | Traceback: %s",
-            temp_file_path,
-            str(e),
-            traceback.format_exc(),
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to save the uploaded file. Error: {str(e)}",
-        )
+async def embed_uploaded_file(
+    upload: SpooledUpload,
+    filename: str,
+    content_type: str,
+    file_id: str,
+    user_id: str,
+    executor,
+    progress=None,
+    cleanup: Optional[CleanupMethod] = None,
+    splitter: Optional[str] = None,
+) -> tuple:
+    """
+    Preprocess, load and store a spooled upload.
+
+    Shared by the synchronous `/embed` flow and background ingestion jobs. Any preprocessed copy
+    is always removed; the upload itself is removed by its owner. Returns `(known_type, result)`;
+    for preprocessed PDFs, `result["pdf_processing"]` has the per-page report of `preprocess_pdf`.
+    """
+    temp_file_paths = []
+    pdf_report = {}
+
+    async def report(stage: str):
+        if progress:
+            await progress(stage=stage)
 
     try:
+        await report("preprocessing")
         # Preprocess file based on type
-        if file.filename.endswith(".pdf"):
-            import fitz  # PyMuPDF for PDF processing
-
-            # Open the PDF to get page count
-            with fitz.open(temp_file_path) as doc:
-                num_pages = doc.page_count
+        if filename.endswith(".pdf"):
+            temp_file_path = await run_in_executor(executor, upload.ensure_file)
+            num_pages = await run_in_executor(executor, get_pdf_page_count, temp_file_path)
 
             if num_pages < 50:
-                new_file_name, new_content_type, temp_file_path = preprocess_pdf(temp_file_path)
+                with timed_stage("preprocess"), span("preprocess", file_type="pdf", pages=num_pages):
+                    new_file_name, new_content_type, temp_file_path = await run_in_executor(
+                        executor, preprocess_pdf, temp_file_path, pdf_report
+                    )
+                temp_file_paths.append(temp_file_path)
             else:
-                new_file_name = file.filename
-                new_content_type = file.content_type
+                new_file_name = filename
+                new_content_type = content_type
                 # Skip preprocessing for PDFs with ≥50 pages
 
             # Initialize loader for PDF files
             loader, known_type, file_ext = get_loader(new_file_name, new_content_type, temp_file_path)
-        elif file.filename.lower().endswith((".xlsx", ".xls")):
+        elif filename.lower().endswith((".xlsx", ".xls")):
             # Preprocess Excel files to Markdown
-            new_file_name, new_content_type, temp_file_path = preprocess_excel(temp_file_path)
+            temp_file_path = await run_in_executor(executor, upload.ensure_file)
+            with timed_stage("preprocess"), span("preprocess", file_type="excel"):
+                new_file_name, new_content_type, temp_file_path = await run_in_executor(
+                    executor, preprocess_excel, temp_file_path
+                )
+            temp_file_paths.append(temp_file_path)
             # Use TextLoader to preserve markdown table formatting
             from langchain_community.document_loaders import TextLoader
 
             loader = TextLoader(temp_file_path, autodetect_encoding=True)
             known_type = True
-            file_ext = "md"
+            # Loaded as Markdown, but chunked as a spreadsheet
+            file_ext = filename.lower().rsplit(".", 1)[-1]
         else:
-            new_file_name = file.filename
-            new_content_type = file.content_type
+            new_file_name = filename
+            new_content_type = content_type
             # Continue default flow
-            loader, known_type, file_ext = get_loader(new_file_name, new_content_type, temp_file_path)
-        data = loader.load()
-        result = await store_data_in_vector_db(data=data, file_id=file_id, user_id=user_id, clean_content=file_ext == "pdf")
+            loader, known_type, file_ext = await run_in_executor(
+                executor, get_upload_loader, upload, new_file_name, new_content_type
+            )
 
-        if not result:
-            response_status = False
-            response_message = "Failed to process/store the file data."
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to process/store the file data.",
+        await report("embedding")
+        try:
+            # Pages are parsed in the thread pool and streamed into the embedding batches
+            result = await store_data_in_vector_db(
+                data=lazy_load_documents(loader),
+                file_id=file_id,
+                user_id=user_id,
+                clean_content=file_ext == "pdf",
+                executor=executor,
+                progress=progress,
+                cleanup=cleanup,
+                file_ext=file_ext,
+                splitter=splitter,
             )
-        elif "error" in result:
-            response_status = False
-            response_message = "Failed to process/store the file data."
-            if isinstance(result["error"], str):
-                response_message = result["error"]
-            else:
+        finally:
+            cleanup_temp_encoding_file(loader)
+
+        if pdf_report and isinstance(result, dict):
+            result["pdf_processing"] = pdf_report
+        return known_type, result
+    finally:
+        for path in temp_file_paths:
+            if os.path.exists(path):
+                await cleanup_temp_file_async(path)
+
+
+async def run_embed_job(job: IngestionJob, report, executor=None) -> dict:
+    """
+    Background ingestion job handler for `/embed?async=true` uploads. A recovered job replaces the
+    file's chunks, so the ones an interrupted run already stored are not added a second time.
+    """
+    cleanup = job.payload.get("cleanup")
+    if job.payload.get("recovered") and not cleanup:
+        cleanup = CleanupMethod.full
+    # Continues the trace of the request that queued the job
+    trace_id, parent_id = parse_trace_header(job.payload.get("traceparent"))
+    with span("embed_job", trace_id=trace_id, parent_id=parent_id, job_id=job.job_id, file_id=job.file_id):
+        async with SpooledUpload(job.filename, job.user_id) as upload:
+            try:
+                # Takes over the budget reserved for the file, released when the upload is closed
+                upload.adopt(job.payload["filepath"])
+            except FileNotFoundError:
+                raise FileNotFoundError("The uploaded file is no longer available; please upload it again.")
+            known_type, result = await embed_uploaded_file(
+                upload,
+                job.filename,
+                job.payload.get("content_type"),
+                job.file_id,
+                job.user_id,
+                executor,
+                progress=report,
+                cleanup=cleanup,
+                splitter=job.payload.get("splitter"),
+            )
+    if not result or "error" in result:
+        raise RuntimeError((result or {}).get("error") or "Failed to process/store the file data.")
+
+    return {
+        "file_id": job.file_id,
+        "filename": job.filename,
+        "known_type": known_type,
+        "chunks": len(result["ids"]),
+        "chunks_reused": result["counters"].get("chunks_reused", 0),
+        "chunks_embedded": result["counters"].get("chunks_embedded", 0),
+        "chunks_cached": result["counters"].get("chunks_cached", 0),
+        "chunks_deleted": result["counters"].get("chunks_deleted", 0),
+        "pdf_processing": result.get("pdf_processing"),
+    }
+
+
+async def discard_embed_job(job: IngestionJob) -> None:
+    """Remove the upload of an `/embed?async=true` job that won't run, releasing the budget reserved for it."""
+    async with SpooledUpload(job.filename, job.user_id) as upload:
+        try:
+            upload.adopt(job.payload["filepath"])
+        except FileNotFoundError:
+            pass
+
+
+@router.post("/embed")
+async def embed_file(
+    request: Request,
+    file_id: str = Form(...),
+    file: UploadFile = File(...),
+    entity_id: str = Form(None),
+    cleanup: Optional[CleanupMethod] = Form(None),
+    splitter: Optional[str] = Form(None),
+    run_async: bool = Query(False, alias="async"),
+):
+    if splitter and splitter != "auto" and splitter not in TEXT_SPLITTERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown splitter '{splitter}'. Choose 'auto' or one of: {', '.join(TEXT_SPLITTERS)}.",
+        )
+    response_status = True
+    response_message = "File processed successfully."
+    known_type = None
+    if not hasattr(request.state, "user"):
+        user_id = entity_id if entity_id else "public"
+    else:
+        user_id = entity_id if entity_id else request.state.user.get("id")
+
+    async with SpooledUpload(file.filename, user_id) as upload:
+        with span("save_upload", filename=file.filename):
+            await receive_upload(file, upload)
+
+        if run_async:
+            # Queued uploads wait on disk for a job worker, which removes them
+            job_id = new_job_id()
+            job = IngestionJob(
+                job_id=job_id,
+                file_id=file_id,
+                user_id=user_id,
+                filename=file.filename,
+                payload={
+                    "filepath": await upload.detach(),
+                    "content_type": file.content_type,
+                    "cleanup": cleanup,
+                    "splitter": splitter,
+                    "traceparent": current_span().traceparent if current_span() else None,
+                },
+            )
+            try:
+                await request.app.state.job_manager.submit(job)
+            except Exception as e:
+                # Taken back, so it is removed when the upload is closed
+                upload.adopt(job.payload["filepath"])
+                logger.error(
+                    "Failed to queue ingestion job | File ID: %s | Error: %s | Traceback: %s",
+                    file_id,
+                    str(e),
+                    traceback.format_exc(),
+                )
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="An unspecified error occurred.",
+                    detail=f"Failed to queue the file for processing. Error: {str(e)}",
                 )
+
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    "status": True,
+                    "message": "File queued for processing.",
+                    "job_id": job_id,
+                    "file_id": file_id,
+                    "filename": file.filename,
+                },
+            )
+
+        try:
+            known_type, result = await embed_uploaded_file(
+                upload,
+                file.filename,
+                file.content_type,
+                file_id,
+                user_id,
+                getattr(request.app.state, "thread_pool", None),
+                cleanup=cleanup,
+                splitter=splitter,
+            )
+
+            if not result:
+                response_status = False
+                response_message = "Failed to process/store the file data."
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to process/store the file data.",
+                )
+            elif "error" in result:
+                response_status = False
+                response_message = "Failed to process/store the file data."
+                if isinstance(result["error"], str):
+                    response_message = result["error"]
+                else:
+                    raise HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail="An unspecified error occurred.",
+                    )
+        except HTTPException as http_exc:
+            response_status = False
+            response_message = f"HTTP Exception: {http_exc.detail}"
+            logger.error(
+                "HTTP Exception in embed_file | Status: %d | Detail: %s",
+                http_exc.status_code,
+                http_exc.detail,
+            )
+            raise http_exc
+        except Exception as e:
+            response_status = False
+            response_message = f"Error during file processing: {str(e)}"
+            logger.error(
+                "Error during file processing: %s\nTraceback: %s",
+                str(e),
+                traceback.format_exc(),
+            )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error during file processing: {str(e)}",
+            )
+
+    response = {
+        "status": response_status,
+        "message": response_message,
+        "file_id": file_id,
+        "filename": file.filename,
+        "known_type": known_type,
+    }
+    if result.get("pdf_processing"):
+        response["pdf_processing"] = result["pdf_processing"]
+    if cleanup:
+        response.update(
+            {
+                key: result.get("counters", {}).get(key, 0)
+                for key in ("chunks_reused", "chunks_embedded", "chunks_cached", "chunks_deleted")
+            }
+        )
+    return response
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, request: Request, entity_id: str = None):
+    try:
+        job = await request.app.state.job_manager.store.get(job_id)
+
+        # Jobs of other users are reported as missing
+        if job is None or job.user_id not in {get_user_id(request, entity_id), get_user_id(request)}:
+            raise HTTPException(status_code=404, detail="The specified job_id was not found")
+
+        return job.model_dump(mode="json", exclude={"payload"})
     except HTTPException as http_exc:
-        response_status = False
-        response_message = f"HTTP Exception: {http_exc.detail}"
         logger.error(
-            "HTTP Exception in embed_file | Status: %d | Detail: %s",
+            "HTTP Exception in get_job_status | Status: %d | Detail: %s",
             http_exc.status_code,
             http_exc.detail,
         )
         raise http_exc
     except Exception as e:
-        response_status = False
-        response_message = f"Error during file processing: {str(e)}"
         logger.error(
-            "Error during file processing: %s\nTraceback: %s",
+            "Error getting job status | Job ID: %s | Error: %s | Traceback: %s",
+            job_id,
             str(e),
             traceback.format_exc(),
         )
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Error during file processing: {str(e)}",
-        )
-    finally:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def iter_file_documents(file_id: str) -> AsyncIterator[Document]:
+    """A file's chunks in storage order, streamed from pgvector or loaded at once from other stores."""
+    if isinstance(vector_store, AsyncPgVector):
+        async for doc in vector_store.aiter_documents(file_id):
+            yield doc
+    else:
+        for doc in vector_store.get_documents_by_ids([file_id]):
+            yield doc
+
+
+async def stream_document_context(documents: AsyncIterator[Document]) -> AsyncIterator[str]:
+    """`process_documents` as a stream; the file name is taken from the first chunk's source."""
+    assembler = None
+    async for doc in documents:
+        if assembler is None:
+            assembler = DocumentTextAssembler()
+            yield assembler.start(doc.metadata.get("source", "").split("/")[-1])
+        yield assembler.add(doc)
+
+
+async def stream_text_content(documents: AsyncIterator[Document]) -> AsyncIterator[str]:
+    """`extract_text_from_documents` as a stream: chunks joined by newlines, without trailing ones."""
+    pending = None
+    previous = None
+    async for doc in documents:
+        overlap = chunk_overlap(previous, doc.metadata)
+        previous = doc.metadata
+        if pending is None:
+            text = doc.page_content
+        elif overlap:
+            text = pending + doc.page_content[overlap:]
+        else:
+            text = pending + "\n" + doc.page_content
+        stripped = text.rstrip("\n")
+        pending = text[len(stripped) :]
+        yield stripped
+
+
+def streaming_text_response(pieces: AsyncIterator[str], stream_format: str, file_id: str) -> StreamingResponse:
+    """Send text pieces as chunked `text/plain`, or as NDJSON lines of `{"text": ...}`."""
+
+    async def body():
         try:
-            await aiofiles.os.remove(temp_file_path)
+            async for piece in pieces:
+                if not piece:
+                    continue
+                yield piece if stream_format == "text" else json.dumps({"text": piece}) + "\n"
         except Exception as e:
             logger.error(
-                "Failed to remove temporary file | Path: %s | Error: %s | Traceback: %s",
-                temp_file_path,
+                "Error while streaming document text | File ID: %s | Error: %s | Traceback: %s",
+                file_id,
                 str(e),
                 traceback.format_exc(),
             )
+            raise
 
-    return {
-        "status": response_status,
-        "message": response_message,
-        "file_id": file_id,
-        "filename": file.filename,
-        "known_type": known_type,
-    }
+    media_type = "text/plain; charset=utf-8" if stream_format == "text" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
 
 
 @router.get("/documents/{id}/context")
-async def load_document_context(id: str):
+async def load_document_context(id: str, stream: str = Query(None, pattern="^(text|ndjson)$")):
+    """
+    Return the reconstructed text of a file. With `stream=text` or `stream=ndjson`, the text is
+    streamed from a database cursor instead, so memory use doesn't grow with the file size.
+    """
     ids = [id]
     try:
         if isinstance(vector_store, AsyncPgVector):
             existing_ids = await vector_store.get_filtered_ids(ids)
-            documents = await vector_store.get_documents_by_ids(ids)
         else:
             existing_ids = vector_store.get_filtered_ids(ids)
-            documents = vector_store.get_documents_by_ids(ids)
 
         # Ensure the requested id exists
         if not all(id in existing_ids for id in ids):
             raise HTTPException(status_code=404, detail="The specified file_id was not found")
 
+        if stream:
+            return streaming_text_response(stream_document_context(iter_file_documents(id)), stream, id)
+
+        if isinstance(vector_store, AsyncPgVector):
+            documents = await vector_store.get_documents_by_ids(ids)
+        else:
+            documents = vector_store.get_documents_by_ids(ids)
+
         # Ensure documents list is not empty
         if not documents:
             raise HTTPException(status_code=404, detail="No document found for the given ID")
@@ -612,24 +1024,32 @@ async def load_document_context(id: str):
 
 
 @router.get("/text/{file_id}")
-async def get_text_content(file_id: str, request: Request):
+async def get_text_content(file_id: str, request: Request, stream: str = Query(None, pattern="^(text|ndjson)$")):
     """
     Get the full text content of a processed file for "Upload as Text" functionality.
+
+    With `stream=text` or `stream=ndjson`, the text is streamed instead of returned as `{"text": ...}`.
     """
     ids = [file_id]
 
     try:
         if isinstance(vector_store, AsyncPgVector):
             existing_ids = await vector_store.get_filtered_ids(ids)
-            documents = await vector_store.get_documents_by_ids(ids)
         else:
             existing_ids = vector_store.get_filtered_ids(ids)
-            documents = vector_store.get_documents_by_ids(ids)
 
         # Ensure the requested id exists
         if not all(id in existing_ids for id in ids):
             raise HTTPException(status_code=404, detail="The specified file_id was not found")
 
+        if stream:
+            return streaming_text_response(stream_text_content(iter_file_documents(file_id)), stream, file_id)
+
+        if isinstance(vector_store, AsyncPgVector):
+            documents = await vector_store.get_documents_by_ids(ids)
+        else:
+            documents = vector_store.get_documents_by_ids(ids)
+
         # Ensure documents list is not empty
         if not documents:
             raise HTTPException(status_code=404, detail="No document found for the given ID")
@@ -669,53 +1089,43 @@ async def embed_file_upload(
     uploaded_file: UploadFile = File(...),
     entity_id: str = Form(None),
 ):
-    temp_file_path = os.path.join(RAG_UPLOAD_DIR, uploaded_file.filename)
-
     if not hasattr(request.state, "user"):
         user_id = entity_id if entity_id else "public"
     else:
         user_id = entity_id if entity_id else request.state.user.get("id")
 
-    try:
-        with open(temp_file_path, "wb") as temp_file:
-            copyfileobj(uploaded_file.file, temp_file)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to save the uploaded file. Error: {str(e)}",
-        )
+    async with SpooledUpload(uploaded_file.filename, user_id) as upload:
+        await receive_upload(uploaded_file, upload)
 
-    try:
-        loader, known_type = get_loader(uploaded_file.filename, uploaded_file.content_type, temp_file_path)
+        try:
+            loader, known_type = get_loader(uploaded_file.filename, uploaded_file.content_type, upload.ensure_file())
 
-        data = loader.load()
-        result = await store_data_in_vector_db(data, file_id, user_id)
+            data = loader.load()
+            result = await store_data_in_vector_db(data, file_id, user_id)
 
-        if not result:
+            if not result:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to process/store the file data.",
+                )
+        except HTTPException as http_exc:
+            logger.error(
+                "HTTP Exception in embed_file_upload | Status: %d | Detail: %s",
+                http_exc.status_code,
+                http_exc.detail,
+            )
+            raise http_exc
+        except Exception as e:
+            logger.error(
+                "Error during file processing | File: %s | Error: %s | Traceback: %s",
+                uploaded_file.filename,
+                str(e),
+                traceback.format_exc(),
+            )
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to process/store the file data.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error during file processing: {str(e)}",
             )
-    except HTTPException as http_exc:
-        logger.error(
-            "HTTP Exception in embed_file_upload | Status: %d | Detail: %s",
-            http_exc.status_code,
-            http_exc.detail,
-        )
-        raise http_exc
-    except Exception as e:
-        logger.error(
-            "Error during file processing | File: %s | Error: %s | Traceback: %s",
-            uploaded_file.filename,
-            str(e),
-            traceback.format_exc(),
-        )
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Error during file processing: {str(e)}",
-        )
-    finally:
-        os.remove(temp_file_path)
 
     return {
         "status": True,
@@ -730,21 +1140,17 @@ async def embed_file_upload(
 async def query_embeddings_by_file_ids(body: QueryMultipleBody):
     try:
         # Get the embedding of the query text
-        embedding = get_cached_query_embedding(body.query)
+        embedding = await get_cached_query_embedding(body.query)
 
         # Perform similarity search with the query embedding and filter by the file_ids in metadata
-        if isinstance(vector_store, AsyncPgVector):
-            documents = await run_in_executor(
-                None,
-                vector_store.similarity_search_with_score_by_vector,
-                embedding,
-                k=body.k,
-                filter={"file_id": {"$in": body.file_ids}},
-            )
-        else:
-            documents = vector_store.similarity_search_with_score_by_vector(
-                embedding, k=body.k, filter={"file_id": {"$in": body.file_ids}}
-            )
+        documents = await search_file_chunks(
+            embedding,
+            body.file_ids,
+            k=body.k,
+            ef_search=body.ef_search,
+            probes=body.probes,
+            hybrid_query=hybrid_query(body),
+        )
 
         # Ensure documents list is not empty
         if not documents:
@@ -781,22 +1187,23 @@ async def extract_text_from_file(
     Returns the raw text content for text parsing purposes.
     """
     user_id = get_user_id(request, entity_id)
-    temp_base_path = os.path.join(RAG_UPLOAD_DIR, user_id)
-    os.makedirs(temp_base_path, exist_ok=True)
-    temp_file_path = os.path.join(RAG_UPLOAD_DIR, user_id, file.filename)
-
-    await save_upload_file_async(file, temp_file_path)
+    upload = SpooledUpload(file.filename, user_id)
 
     try:
+        with span("save_upload", filename=file.filename):
+            await receive_upload(file, upload)
+
         data, known_type, file_ext = await load_file_content(
             file.filename,
             file.content_type,
-            temp_file_path,
+            upload,
             request.app.state.thread_pool,
         )
 
         # Extract text content from loaded documents
-        text_content = extract_text_from_documents(data, file_ext)
+        with span("extract_text", file_ext=file_ext) as extract_span:
+            text_content = extract_text_from_documents(data, file_ext)
+            extract_span.attributes["characters"] = len(text_content)
 
         # Log do conteúdo extraído para debug
         logger.info(f"📄 [Upload as Text] Conteúdo extraído do arquivo {file.filename}:")
@@ -806,15 +1213,9 @@ async def extract_text_from_file(
         logger.info(f"📄 [Upload as Text] Conteúdo completo:\n{text_content}")
 
         # Validação de tokens para "Upload as Text" - limite de 30k tokens
-        try:
-            # Usar encoding para GPT-4/GPT-3.5-turbo
-            encoding = tiktoken.get_encoding("cl100k_base")
-            tokens = encoding.encode(text_content)
-            token_count = len(tokens)
-        except ImportError:
-            # Fallback para estimativa se tiktoken não estiver disponível
-            token_count = len(text_content) // 4
-            logger.warning("tiktoken not available, using character-based estimation")
+        # Encoding carregado uma vez por worker, com estimativa por caracteres se não estiver disponível
+        with span("count_tokens"):
+            token_count = token_length(text_content)
 
         if token_count > 30000:
             raise HTTPException(
@@ -854,6 +1255,4 @@ async def extract_text_from_file(
                 detail=f"Error during text extraction: {str(e)}",
             )
     finally:
-        # Only clean up the original file if it still exists (wasn't preprocessed)
-        if os.path.exists(temp_file_path):
-            await cleanup_temp_file_async(temp_file_path)
+        await upload.close()
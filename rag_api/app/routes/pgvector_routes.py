@@ -6,6 +6,11 @@ from app.services.database import PSQLDatabase
 router = APIRouter()
 
 
+def record_to_json(record) -> dict:
+    # Vectors are decoded to numpy arrays by the pgvector codec
+    return {key: value.tolist() if hasattr(value, "tolist") else value for key, value in dict(record).items()}
+
+
 async def check_index_exists(table_name: str, column_name: str) -> bool:
     pool = await PSQLDatabase.get_pool()
     async with pool.acquire() as conn:
@@ -79,7 +84,7 @@ async def get_all_records(table_name: str):
         records = await conn.fetch(f"SELECT * FROM {table_name};")
 
     # Convert records to JSON serializable format, assuming records can be directly serialized
-    records_json = [dict(record) for record in records]
+    records_json = [record_to_json(record) for record in records]
 
     return records_json
 
@@ -97,6 +102,6 @@ async def get_records_filtered_by_custom_id(custom_id: str, table_name: str = "l
         records = await conn.fetch(query, custom_id)
 
     # Convert records to JSON serializable format, assuming the Record class has a dict method.
-    records_json = [dict(record) for record in records]
+    records_json = [record_to_json(record) for record in records]
 
     return records_json
@@ -0,0 +1,189 @@
+# app/server.py
+"""
+The FastAPI application and its lifespan. Started by `main.py`, which keeps it out of the PDF page
+workers (see `app.utils.pdf_pages`).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+
+from app.config import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    PDF_EXTRACT_IMAGES,
+    RAG_ANN_DIMENSIONS,
+    RAG_ANN_INDEX,
+    RAG_BINARY_RERANK_FACTOR,
+    RAG_EMBEDDING_STORAGE,
+    RAG_HNSW_EF_CONSTRUCTION,
+    RAG_HNSW_EF_SEARCH,
+    RAG_HNSW_M,
+    RAG_HYBRID_SEARCH,
+    RAG_IVFFLAT_LISTS,
+    RAG_IVFFLAT_PROBES,
+    RAG_JOB_LEASE_SECONDS,
+    RAG_JOB_RETENTION_SECONDS,
+    RAG_JOB_STORE,
+    RAG_JOB_WORKERS,
+    RAG_TEXT_SEARCH_CONFIG,
+    RAG_TRACE_EXPORTER,
+    RAG_TRACE_FILE,
+    RAG_TRACE_OTLP_ENDPOINT,
+    VECTOR_DB_TYPE,
+    LogMiddleware,
+    VectorDBType,
+    debug_mode,
+    logger,
+    vector_store,
+)
+from app.middleware import metrics_middleware, security_middleware, timeout_middleware, tracing_middleware
+from app.routes import document_routes, pgvector_routes
+from app.services.database import (
+    PSQLDatabase,
+    ensure_ann_index,
+    ensure_embedding_storage,
+    ensure_metadata_columns,
+    ensure_text_search_column,
+    ensure_vector_indexes,
+    get_pgvector_version,
+    schema_lock,
+)
+from app.services.embedding_cache import ChunkEmbeddingCache, chunk_embedding_cache
+from app.services.jobs import JobManager, get_job_store
+from app.services.metrics import track_db_pool, track_thread_pool
+from app.services.query_cache import query_embedding_cache
+from app.services.tracing import get_span_exporter, tracer
+from app.services.uploads import spool_uploads_in_upload_dir, sweep_uploads
+from app.services.vector_store.async_pg_vector import EMBEDDING_TABLE
+from app.utils.pdf_pages import shutdown_process_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup logic goes here
+    # Create bounded thread pool executor based on CPU cores
+    max_workers = min(int(os.getenv("RAG_THREAD_POOL_SIZE", str(os.cpu_count()))), 8)  # Cap at 8
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-worker")
+    logger.info(f"Initialized thread pool with {max_workers} workers (CPU cores: {os.cpu_count()})")
+    track_thread_pool(app.state.thread_pool)
+    track_db_pool(lambda: PSQLDatabase.pool)
+    tracer.start(
+        get_span_exporter(RAG_TRACE_EXPORTER, file_path=RAG_TRACE_FILE, otlp_endpoint=RAG_TRACE_OTLP_ENDPOINT)
+    )
+
+    if VECTOR_DB_TYPE == VectorDBType.PGVECTOR:
+        await PSQLDatabase.get_pool()  # Initialize the pool
+        vector_store.configure_embedding_storage(RAG_EMBEDDING_STORAGE, rerank_factor=RAG_BINARY_RERANK_FACTOR)
+        # Every worker runs this; the lock makes the others wait while one rewrites the table or builds an index
+        async with schema_lock(EMBEDDING_TABLE):
+            await ensure_metadata_columns()
+            await ensure_vector_indexes()
+            await ensure_embedding_storage(RAG_EMBEDDING_STORAGE)
+            ann_dimensions = await ensure_ann_index(
+                RAG_ANN_INDEX,
+                vector_store.ann_operator_class,
+                dimensions=RAG_ANN_DIMENSIONS,
+                m=RAG_HNSW_M,
+                ef_construction=RAG_HNSW_EF_CONSTRUCTION,
+                lists=RAG_IVFFLAT_LISTS,
+                storage=RAG_EMBEDDING_STORAGE,
+            )
+            if RAG_HYBRID_SEARCH:
+                await ensure_text_search_column(RAG_TEXT_SEARCH_CONFIG)
+        vector_store.configure_ann_search(
+            RAG_ANN_INDEX,
+            ann_dimensions,
+            default=RAG_HNSW_EF_SEARCH if RAG_ANN_INDEX == "hnsw" else RAG_IVFFLAT_PROBES,
+            iterative_scan=await get_pgvector_version() >= (0, 8, 0),
+        )
+        if RAG_HYBRID_SEARCH:
+            vector_store.configure_text_search(RAG_TEXT_SEARCH_CONFIG)
+        if chunk_embedding_cache is not None:
+            async with schema_lock(ChunkEmbeddingCache.table_name):
+                await chunk_embedding_cache.setup()
+
+    if query_embedding_cache.backend is not None:
+        async with schema_lock(ChunkEmbeddingCache.table_name):
+            await query_embedding_cache.backend.setup()
+
+    app.state.job_manager = JobManager(
+        get_job_store(RAG_JOB_STORE),
+        handler=partial(document_routes.run_embed_job, executor=app.state.thread_pool),
+        workers=RAG_JOB_WORKERS,
+        lease_seconds=RAG_JOB_LEASE_SECONDS,
+        retention_seconds=RAG_JOB_RETENTION_SECONDS,
+        discard=document_routes.discard_embed_job,
+    )
+    await app.state.job_manager.start()
+    # Uploads of requests and queued jobs a previous run didn't get to finish
+    unfinished = await app.state.job_manager.store.unfinished()
+    swept = sweep_uploads(keep=[job.payload["filepath"] for job in unfinished if job.payload.get("filepath")])
+    if swept:
+        logger.info(f"Removed {swept} uploads left behind by a previous run")
+
+    yield
+
+    # Cleanup logic
+    logger.info("Stopping ingestion job workers")
+    await app.state.job_manager.stop()
+    logger.info("Shutting down thread pool")
+    app.state.thread_pool.shutdown(wait=True)
+    logger.info("Thread pool shutdown complete")
+    shutdown_process_pool()
+    tracer.shutdown()
+
+
+# Uploads Starlette spools to disk are then moved into place instead of copied
+spool_uploads_in_upload_dir()
+
+app = FastAPI(lifespan=lifespan, debug=debug_mode)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+app.add_middleware(LogMiddleware)
+
+app.middleware("http")(timeout_middleware)
+app.middleware("http")(security_middleware)
+# Added last so they wrap the ones above, and rejected and timed out requests are traced and measured too;
+# metrics_middleware, added after tracing, is the outermost
+app.middleware("http")(tracing_middleware)
+app.middleware("http")(metrics_middleware)
+
+# Set state variables for use in routes
+app.state.CHUNK_SIZE = CHUNK_SIZE
+app.state.CHUNK_OVERLAP = CHUNK_OVERLAP
+app.state.PDF_EXTRACT_IMAGES = PDF_EXTRACT_IMAGES
+
+# Include routers
+app.include_router(document_routes.router)
+if debug_mode:
+    app.include_router(router=pgvector_routes.router)
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    body = await request.body()
+    logger.debug("Validation error occurred")
+    logger.debug(f"Raw request body: {body.decode()}")
+    logger.debug(f"Validation errors: {exc.errors()}")
+    return JSONResponse(
+        status_code=422,
+        content={
+            "detail": exc.errors(),
+            "body": body.decode(),
+            "message": "Request validation failed",
+        },
+    )
+
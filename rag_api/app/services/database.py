@@ -1,7 +1,54 @@
 # app/services/database.py
+import asyncio
+import hashlib
+import math
+import re
+import struct
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
 import asyncpg
+import numpy as np
+from pgvector.asyncpg import register_vector
+
+from app.config import DSN, RAG_INGEST_DB_CONNECTIONS, logger
+from app.services.vector_store.async_pg_vector import EMBEDDING_STORAGE, EMBEDDING_TABLE, METADATA_COLUMNS
+
+ANN_INDEX_PREFIX = f"idx_{EMBEDDING_TABLE}_ann_"
+# Longest identifier Postgres keeps, longer ones are truncated
+MAX_IDENTIFIER_LENGTH = 63
+# Most dimensions pgvector can index, by embedding storage mode
+MAX_ANN_DIMENSIONS = {"vector": 2000, "halfvec": 4000, "binary": 64000}
+# Full-text column searched by hybrid queries (see `AsyncPgVector.ahybrid_search_with_score_by_vector`)
+TEXT_SEARCH_COLUMN = "document_tsv"
+_TEXT_SEARCH_CONFIG = re.compile(r"^[A-Za-z_][A-Za-z0-9_.]*$")
+
+
+def _halfvec_to_db(value) -> bytes:
+    # pgvector's binary format: dimensions, an unused int16, then big-endian half floats
+    value = np.asarray(value, dtype=">f2")
+    return struct.pack(">HH", value.shape[0], 0) + value.tobytes()
 
-from app.config import DSN, logger
+
+def _halfvec_from_db(data: bytes) -> np.ndarray:
+    dimensions, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f2", count=dimensions, offset=4).astype(np.float32)
+
+
+async def init_connection(conn) -> None:
+    """Exchange pgvector values in binary format on every pooled connection."""
+    try:
+        await register_vector(conn)
+    except ValueError:
+        # The vector extension is created by the vector store on startup; until then there is no type to register
+        logger.warning("pgvector type not found, vector values will not use the binary codec")
+        return
+    try:
+        await conn.set_type_codec("halfvec", encoder=_halfvec_to_db, decoder=_halfvec_from_db, format="binary")
+    except ValueError:
+        # pgvector before 0.7 has no halfvec type
+        pass
 
 
 class PSQLDatabase:
@@ -10,7 +57,7 @@ class PSQLDatabase:
     @classmethod
     async def get_pool(cls):
         if cls.pool is None:
-            cls.pool = await asyncpg.create_pool(dsn=DSN)
+            cls.pool = await asyncpg.create_pool(dsn=DSN, init=init_connection)
         return cls.pool
 
     @classmethod
@@ -20,8 +67,73 @@ class PSQLDatabase:
             cls.pool = None
 
 
+_ingestion_slots: Optional[asyncio.Semaphore] = None
+
+
+@asynccontextmanager
+async def ingestion_slot():
+    """
+    Hold one of the `RAG_INGEST_DB_CONNECTIONS` slots around a pooled connection used by
+    ingestion, so uploads and background jobs never take every connection away from queries.
+    """
+    global _ingestion_slots
+    if _ingestion_slots is None:
+        _ingestion_slots = asyncio.Semaphore(RAG_INGEST_DB_CONNECTIONS)
+    async with _ingestion_slots:
+        yield
+
+
+@asynccontextmanager
+async def schema_lock(table_name: str = EMBEDDING_TABLE):
+    """
+    Hold a session advisory lock keyed on `table_name` while the block changes its schema or
+    indexes, so when several workers start at once only one of them does it; the others wait and
+    then find everything in place. The lock is released if the block raises.
+    """
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock(hashtext($1))", table_name)
+        try:
+            yield
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", table_name)
+
+
+async def ensure_metadata_columns():
+    """
+    Promote the `METADATA_COLUMNS` keys (`file_id`, `user_id`, `chunk_index`) to columns of the embedding table.
+
+    They are stored generated columns derived from `cmetadata`, so every writer (including
+    LangChain's) keeps them in sync. Adding them rewrites the table, which backfills all
+    existing rows but locks the table while it runs; it only happens when a column is missing.
+    """
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        existing = {
+            record["column_name"]
+            for record in await conn.fetch(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = $1", EMBEDDING_TABLE
+            )
+        }
+        missing = [column for column in METADATA_COLUMNS if column not in existing]
+        if not missing:
+            return
+
+        logger.info(f"Adding columns {', '.join(missing)} to {EMBEDDING_TABLE} and backfilling existing rows")
+        started = time.perf_counter()
+        await conn.execute(
+            f"ALTER TABLE {EMBEDDING_TABLE} "
+            + ", ".join(
+                f"ADD COLUMN IF NOT EXISTS {column} {METADATA_COLUMNS[column]} "
+                f"GENERATED ALWAYS AS ((cmetadata->>'{column}')::{METADATA_COLUMNS[column].lower()}) STORED"
+                for column in missing
+            )
+        )
+        logger.info(f"Backfilled {EMBEDDING_TABLE} metadata columns in {time.perf_counter() - started:.1f}s")
+
+
 async def ensure_vector_indexes():
-    table_name = "langchain_pg_embedding"
+    table_name = EMBEDDING_TABLE
     column_name = "custom_id"
     # You might want to standardize the index naming convention
     index_name = f"idx_{table_name}_{column_name}"
@@ -34,16 +146,237 @@ async def ensure_vector_indexes():
         """
         )
 
+        # Superseded by the (file_id, chunk_index) index below
+        await conn.execute(f"DROP INDEX IF EXISTS idx_{table_name}_file_id")
+
+        # Ordered range scans over a file's chunks, and file_id filters
         await conn.execute(
             f"""
-            CREATE INDEX IF NOT EXISTS idx_{table_name}_file_id 
-            ON {table_name} ((cmetadata->>'file_id'));
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_file_id_chunk_index
+            ON {table_name} (file_id, chunk_index);
+        """
+        )
+
+        await conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_user_id
+            ON {table_name} (user_id);
         """
         )
 
         logger.info("Vector database indexes ensured")
 
 
+async def ensure_text_search_column(config: str) -> None:
+    """
+    Add the `document_tsv` full-text column of the chunks, with a GIN index, for hybrid searches.
+
+    It is a stored generated column, `to_tsvector(config, document)`, so every writer keeps it
+    in sync. Adding it, or rebuilding it for another text search `config`, rewrites the table
+    like `ensure_metadata_columns`. The index is built `CONCURRENTLY`, and rebuilt if an
+    interrupted build left it invalid.
+    """
+    if not _TEXT_SEARCH_CONFIG.match(config):
+        raise ValueError(f"Invalid text search configuration: {config}")
+    index_name = f"idx_{EMBEDDING_TABLE}_{TEXT_SEARCH_COLUMN}"
+
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        expression = await conn.fetchval(
+            "SELECT generation_expression FROM information_schema.columns WHERE table_name = $1 AND column_name = $2",
+            EMBEDDING_TABLE,
+            TEXT_SEARCH_COLUMN,
+        )
+        if expression is not None and f"'{config}'::regconfig" not in expression:
+            logger.info(f"Dropping {TEXT_SEARCH_COLUMN}, built with another text search configuration than {config}")
+            await conn.execute(f"ALTER TABLE {EMBEDDING_TABLE} DROP COLUMN {TEXT_SEARCH_COLUMN}")
+            expression = None
+        if expression is None:
+            logger.info(f"Adding {TEXT_SEARCH_COLUMN} to {EMBEDDING_TABLE} and backfilling existing rows")
+            started = time.perf_counter()
+            await conn.execute(
+                f"ALTER TABLE {EMBEDDING_TABLE} ADD COLUMN IF NOT EXISTS {TEXT_SEARCH_COLUMN} tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('{config}'::regconfig, coalesce(document, ''))) STORED"
+            )
+            logger.info(f"Backfilled {TEXT_SEARCH_COLUMN} in {time.perf_counter() - started:.1f}s")
+
+        valid = await conn.fetchval(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = $1",
+            index_name,
+        )
+        if valid is False:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+        if not valid:
+            logger.info(f"Building full-text index {index_name}")
+            started = time.perf_counter()
+            await conn.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+                f"ON {EMBEDDING_TABLE} USING gin ({TEXT_SEARCH_COLUMN})"
+            )
+            logger.info(f"Built full-text index {index_name} in {time.perf_counter() - started:.1f}s")
+
+
+async def get_pgvector_version() -> Tuple[int, ...]:
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        version = await conn.fetchval("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    return tuple(int(part) for part in version.split(".")) if version else ()
+
+
+def _ann_index_name(index_type: str, distance: str, dimensions: int, parameters: str) -> str:
+    """
+    Name of the managed ANN index built with these settings. Postgres truncates identifiers over
+    63 characters, and a truncated name would never match again, so when the readable name is too
+    long (such as for halfvec indexes) the dimensions and build parameters are replaced by a hash.
+    """
+    index_name = f"{ANN_INDEX_PREFIX}{index_type}_{distance}_{dimensions}_{parameters}"
+    if len(index_name) > MAX_IDENTIFIER_LENGTH:
+        digest = hashlib.sha1(f"{dimensions}_{parameters}".encode()).hexdigest()[:8]
+        index_name = f"{ANN_INDEX_PREFIX}{index_type}_{distance}_{digest}"
+    assert len(index_name) <= MAX_IDENTIFIER_LENGTH, index_name
+    return index_name
+
+
+async def _ann_indexes(conn) -> list:
+    return await conn.fetch(
+        """
+        SELECT c.relname AS name, i.indisvalid AS valid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = $1::regclass AND starts_with(c.relname, $2)
+        """,
+        EMBEDDING_TABLE,
+        ANN_INDEX_PREFIX,
+    )
+
+
+async def ensure_embedding_storage(storage: str) -> None:
+    """
+    Convert the `embedding` column to the type the `storage` mode keeps embeddings in.
+
+    "halfvec" stores half-precision floats, half the size of "vector". "binary" keeps
+    full-precision `vector` values for re-ranking and only quantizes them in its ANN index
+    (see `ensure_ann_index`). Changing the type rewrites every existing row and locks the table
+    while it runs, so managed ANN indexes are dropped first and left to `ensure_ann_index` to
+    rebuild. Going back from "halfvec" does not restore the precision it dropped.
+    """
+    if storage not in EMBEDDING_STORAGE:
+        raise ValueError(f"Unsupported embedding storage: {storage}. Choose one of {', '.join(EMBEDDING_STORAGE)}.")
+    if storage != "vector" and await get_pgvector_version() < (0, 7):
+        raise ValueError(f"Embedding storage '{storage}' requires pgvector 0.7 or newer")
+    column_type = "halfvec" if storage == "halfvec" else "vector"
+
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        current = await conn.fetchval(
+            "SELECT udt_name FROM information_schema.columns WHERE table_name = $1 AND column_name = 'embedding'",
+            EMBEDDING_TABLE,
+        )
+        if current is None or current == column_type:
+            return
+
+        for record in await _ann_indexes(conn):
+            logger.info(f"Dropping ANN index {record['name']} before converting embeddings")
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {record['name']}")
+        logger.info(f"Converting {EMBEDDING_TABLE}.embedding from {current} to {column_type}, rewriting existing rows")
+        started = time.perf_counter()
+        await conn.execute(
+            f"ALTER TABLE {EMBEDDING_TABLE} ALTER COLUMN embedding TYPE {column_type} USING embedding::{column_type}"
+        )
+        logger.info(f"Converted {EMBEDDING_TABLE}.embedding in {time.perf_counter() - started:.1f}s")
+
+
+def ivfflat_lists(rows: int) -> int:
+    """pgvector's recommended list count: rows / 1000 up to 1M rows, sqrt(rows) above."""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+async def ensure_ann_index(
+    index_type: str,
+    operator_class: str,
+    dimensions: int = 0,
+    m: int = 16,
+    ef_construction: int = 64,
+    lists: int = 0,
+    storage: str = "vector",
+) -> Optional[int]:
+    """
+    Make the approximate nearest neighbour index on `langchain_pg_embedding` match the settings.
+
+    `index_type` is "hnsw", "ivfflat" or "none". The index is a partial expression index on
+    `embedding::vector(dimensions)` using `operator_class` (see `AsyncPgVector.ann_operator_class`),
+    or on the matching `EMBEDDING_STORAGE` expression for other `storage` modes, such as the
+    binary-quantized `bit(dimensions)` of each embedding for "binary";
+    `dimensions` defaults to the size of the stored embeddings. Its name encodes the build
+    parameters, so managed indexes built with other settings (or left invalid by an interrupted
+    build) are dropped and rebuilt. Indexes are built `CONCURRENTLY`, so ingestion and queries
+    keep working while it runs.
+
+    Returns the indexed dimension, or None when no index is in use.
+    """
+    if index_type not in ("hnsw", "ivfflat", "none"):
+        raise ValueError(f"Unsupported ANN index type: {index_type}. Choose 'hnsw', 'ivfflat' or 'none'.")
+
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        existing = await _ann_indexes(conn)
+
+        index_name = None
+        if index_type != "none":
+            if not dimensions:
+                dimensions = await conn.fetchval(f"SELECT vector_dims(embedding) FROM {EMBEDDING_TABLE} LIMIT 1")
+            if not dimensions:
+                logger.info("No embeddings stored yet, skipping the %s index until the next startup", index_type)
+            elif dimensions > MAX_ANN_DIMENSIONS[storage]:
+                logger.warning(
+                    "Cannot build a %s index on %d-dimensional %s embeddings (max %d), searches stay exact",
+                    index_type,
+                    dimensions,
+                    storage,
+                    MAX_ANN_DIMENSIONS[storage],
+                )
+                dimensions = None
+            else:
+                if index_type == "hnsw":
+                    parameters = f"m{m}_ef{ef_construction}"
+                    options = f"m = {m}, ef_construction = {ef_construction}"
+                else:
+                    parameters = f"lists{lists}" if lists else "auto"
+                    if not lists:
+                        lists = ivfflat_lists(
+                            await conn.fetchval(
+                                f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE vector_dims(embedding) = $1", dimensions
+                            )
+                        )
+                    options = f"lists = {lists}"
+                distance = operator_class.removeprefix("vector_").removesuffix("_ops")
+                index_name = _ann_index_name(index_type, distance, dimensions, parameters)
+
+        for record in existing:
+            if record["name"] != index_name or not record["valid"]:
+                logger.info(f"Dropping ANN index {record['name']}")
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {record['name']}")
+
+        if index_name is None:
+            return None
+        if any(record["name"] == index_name and record["valid"] for record in existing):
+            return dimensions
+
+        logger.info(f"Building ANN index {index_name}, this can take a while on large tables")
+        started = time.perf_counter()
+        await conn.execute(
+            f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {EMBEDDING_TABLE}
+            USING {index_type} (({EMBEDDING_STORAGE[storage].format(dimensions=dimensions)}) {operator_class})
+            WITH ({options})
+            WHERE vector_dims(embedding) = {dimensions}
+            """
+        )
+        logger.info(f"Built ANN index {index_name} in {time.perf_counter() - started:.1f}s")
+    return dimensions
+
+
 async def pg_health_check() -> bool:
     try:
         pool = await PSQLDatabase.get_pool()
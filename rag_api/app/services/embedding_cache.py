@@ -0,0 +1,228 @@
+# app/services/embedding_cache.py
+import time
+import traceback
+from contextlib import asynccontextmanager, nullcontext
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from app.config import (
+    EMBEDDINGS_MODEL,
+    EMBEDDINGS_PROVIDER,
+    RAG_EMBEDDING_CACHE,
+    RAG_EMBEDDING_CACHE_MAX_ENTRIES,
+    RAG_EMBEDDING_CACHE_TTL,
+    VECTOR_DB_TYPE,
+    VectorDBType,
+    logger,
+)
+
+
+class ChunkEmbeddingCache:
+    """
+    Content-addressed cache of chunk embeddings, stored in Postgres next to `langchain_pg_embedding`.
+
+    Entries are keyed on (embedding model, chunk digest), so re-uploads and chunks shared between
+    files are only sent to the embeddings provider once. Entries unused for `ttl_seconds` are not
+    served and get evicted, and the table is trimmed to the `max_entries` most recently used rows.
+    Lookups are plain reads; a hit only rewrites its `last_used_at` once it is `touch_interval_seconds`
+    old (by default a tenth of the TTL, at most an hour), so recency is tracked at that granularity.
+    Cache errors are logged and treated as misses; they never fail an ingestion. With `ingestion`,
+    lookups and writes hold one of the ingestion connection slots (see `ingestion_slot`).
+    """
+
+    table_name = "rag_embedding_cache"
+
+    def __init__(
+        self,
+        model: str,
+        max_entries: int,
+        ttl_seconds: int,
+        evict_interval_seconds: int = 300,
+        ingestion: bool = True,
+        touch_interval_seconds: Optional[float] = None,
+    ):
+        self.model = model
+        self.ingestion = ingestion
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval_seconds = (
+            touch_interval_seconds if touch_interval_seconds is not None else min(ttl_seconds / 10, 3600)
+        )
+        self.evict_interval_seconds = evict_interval_seconds
+        self._last_eviction = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.errors = 0
+
+    async def _pool(self):
+        from app.services.database import PSQLDatabase
+
+        return await PSQLDatabase.get_pool()
+
+    @asynccontextmanager
+    async def _connection(self):
+        from app.services.database import ingestion_slot
+
+        pool = await self._pool()
+        async with ingestion_slot() if self.ingestion else nullcontext(), pool.acquire() as conn:
+            yield conn
+
+    async def setup(self) -> None:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    model TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    embedding REAL[] NOT NULL,
+                    last_used_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (model, digest)
+                );
+            """
+            )
+            # Eviction runs per model: chunk and query embeddings share the table with different TTLs and caps
+            await conn.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{self.table_name}_model_last_used_at
+                ON {self.table_name} (model, last_used_at);
+            """
+            )
+            await conn.execute(f"DROP INDEX IF EXISTS idx_{self.table_name}_last_used_at")
+
+    async def get_many(self, digests: List[str]) -> Dict[str, List[float]]:
+        """
+        Return cached embeddings for the given digests. Hits last used more than
+        `touch_interval_seconds` ago are marked as recently used, in one statement.
+        """
+        if not digests:
+            return {}
+        async with self._connection() as conn:
+            records = await conn.fetch(
+                f"""
+                SELECT digest, embedding, last_used_at < now() - make_interval(secs => $4) AS stale
+                FROM {self.table_name}
+                WHERE model = $1 AND digest = ANY($2::text[])
+                AND last_used_at > now() - make_interval(secs => $3)
+                """,
+                self.model,
+                list(set(digests)),
+                float(self.ttl_seconds),
+                float(self.touch_interval_seconds),
+            )
+            stale = [record["digest"] for record in records if record["stale"]]
+            if stale:
+                await conn.execute(
+                    f"UPDATE {self.table_name} SET last_used_at = now() WHERE model = $1 AND digest = ANY($2::text[])",
+                    self.model,
+                    stale,
+                )
+        return {record["digest"]: list(record["embedding"]) for record in records}
+
+    async def put_many(self, embeddings: Dict[str, List[float]]) -> None:
+        if not embeddings:
+            return
+        async with self._connection() as conn:
+            await conn.executemany(
+                f"""
+                INSERT INTO {self.table_name} (model, digest, embedding) VALUES ($1, $2, $3)
+                ON CONFLICT (model, digest) DO UPDATE SET embedding = EXCLUDED.embedding, last_used_at = now()
+                """,
+                [(self.model, digest, embedding) for digest, embedding in embeddings.items()],
+            )
+
+    async def evict(self) -> int:
+        """Delete expired entries of this model, then trim them to the `max_entries` most recently used."""
+        async with self._connection() as conn:
+            expired = await conn.execute(
+                f"DELETE FROM {self.table_name} WHERE model = $1 AND last_used_at < now() - make_interval(secs => $2)",
+                self.model,
+                float(self.ttl_seconds),
+            )
+            overflow = await conn.execute(
+                f"""
+                DELETE FROM {self.table_name} WHERE ctid IN (
+                    SELECT ctid FROM {self.table_name} WHERE model = $1 ORDER BY last_used_at DESC OFFSET $2
+                )
+                """,
+                self.model,
+                self.max_entries,
+            )
+        # asyncpg returns the command tag, e.g. "DELETE 42"
+        evicted = int(expired.split()[-1]) + int(overflow.split()[-1])
+        self.evicted += evicted
+        self._last_eviction = time.monotonic()
+        return evicted
+
+    async def evict_if_due(self) -> None:
+        if time.monotonic() - self._last_eviction > self.evict_interval_seconds:
+            await self.evict()
+
+    async def aembed_documents(
+        self,
+        embedding_function: Embeddings,
+        texts: List[str],
+        digests: List[str],
+        counts: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Embed `texts`, only sending chunks whose digest is not cached to the provider. If given,
+        `counts["embedded"]` and `counts["cached"]` are increased by the chunks sent and not sent.
+        """
+        try:
+            cached = await self.get_many(digests)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Embedding cache lookup failed, embedding all chunks: {e}")
+            cached = {}
+
+        # Embed each unseen digest once, even if it repeats within the batch
+        missing: Dict[str, str] = {}
+        for text, digest in zip(texts, digests):
+            if digest not in cached and digest not in missing:
+                missing[digest] = text
+        self.hits += len(digests) - len(missing)
+        self.misses += len(missing)
+        if counts is not None:
+            counts["embedded"] = counts.get("embedded", 0) + len(missing)
+            counts["cached"] = counts.get("cached", 0) + len(digests) - len(missing)
+
+        if missing:
+            vectors = await embedding_function.aembed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            cached.update(fresh)
+            try:
+                await self.put_many(fresh)
+                await self.evict_if_due()
+            except Exception as e:
+                self.errors += 1
+                logger.warning(
+                    "Failed to update embedding cache | Error: %s | Traceback: %s", str(e), traceback.format_exc()
+                )
+
+        return [cached[digest] for digest in digests]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+
+# The cache lives in Postgres, so it is only available with the pgvector backend
+chunk_embedding_cache = (
+    ChunkEmbeddingCache(
+        model=f"{EMBEDDINGS_PROVIDER.value}:{EMBEDDINGS_MODEL}",
+        max_entries=RAG_EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl_seconds=RAG_EMBEDDING_CACHE_TTL,
+    )
+    if RAG_EMBEDDING_CACHE and VECTOR_DB_TYPE == VectorDBType.PGVECTOR
+    else None
+)
@@ -0,0 +1,402 @@
+# app/services/embedding_dispatcher.py
+"""
+Request shaping in front of the embeddings provider: `EmbeddingCoalescer` merges concurrent
+calls and `EmbeddingDispatcher` sends them in adaptive, concurrent batches.
+
+`app.config` wraps the embeddings client while it is being imported, so this module must stay
+free of `app.config`.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, List, Optional, Set, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Exception names (or botocore error codes) embeddings clients use for throttled requests
+RATE_LIMIT_ERRORS = {"RateLimitError", "ThrottlingException", "ResourceExhausted", "TooManyRequests"}
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether an embeddings client error is a throttling response: HTTP 429 or the provider's equivalent."""
+    if type(error).__name__ in RATE_LIMIT_ERRORS or getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        # botocore's ClientError
+        return response.get("Error", {}).get("Code") in RATE_LIMIT_ERRORS
+    return getattr(response, "status_code", None) == 429
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked to wait before retrying, from the `Retry-After` header of the error's response."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return max(float(headers.get("retry-after")), 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def default_length(text: str) -> int:
+    """Token count of `RAG_TIKTOKEN_ENCODING`, imported on first use since `app.config` is still loading here."""
+    from app.utils.text_splitters import token_length
+
+    return token_length(text)
+
+
+# (texts, token length of each text)
+Batch = Tuple[List[str], List[int]]
+
+
+class EmbeddingDispatcher(Embeddings):
+    """
+    Embeds documents with the wrapped embeddings in concurrent batches sized by token count.
+
+    `aembed_documents` groups texts, in order, into batches of at most `batch_tokens` tokens and
+    `max_batch_size` texts, and sends up to `concurrency` batches at once; the limit is shared
+    by every caller in the process. When the provider throttles a request, all batches pause for
+    its `Retry-After` (or an exponential back-off with jitter), the batch limits are halved and
+    the throttled texts are re-batched and retried, up to `max_retries` times. After
+    `grow_after` consecutive successful requests the limits grow by a quarter again, up to
+    `max_batch_tokens` and `max_batch_size`.
+
+    Queries are sent one at a time but share the back-off, retries and metrics; synchronous calls
+    go straight to the wrapped embeddings. Callers that already counted the tokens of their texts
+    pass them as `lengths`, so texts are not tokenized twice on the event loop.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        provider: str,
+        concurrency: int = 4,
+        batch_tokens: int = 8000,
+        max_batch_tokens: int = 64000,
+        max_batch_size: Optional[int] = None,
+        max_retries: int = 6,
+        grow_after: int = 10,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 60.0,
+        length_function: Optional[Callable[[str], int]] = None,
+    ):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.concurrency = max(concurrency, 1)
+        self.batch_tokens = min(max(batch_tokens, 1), max_batch_tokens)
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_size = max_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.grow_after = grow_after
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.length_function = length_function or default_length
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
+        self._resume_at = 0.0
+        self._successes = 0
+        self._in_flight = 0
+        self._busy_since = 0.0
+        self.requests = 0
+        self.texts = 0
+        self.tokens = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.request_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def __getattr__(self, name):
+        # Provider-specific attributes (model, dimensions, ...) of the wrapped embeddings
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def slots(self) -> asyncio.Semaphore:
+        """The process-wide concurrency limit, recreated if the event loop changed."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def batches(self, texts: List[str], lengths: List[int]) -> List[Batch]:
+        """Split texts, in order, into batches within the current limits; longer texts get a batch of their own."""
+        batches: List[Batch] = []
+        batch_texts, batch_lengths, tokens = [], [], 0
+        for text, length in zip(texts, lengths):
+            full = self.batch_size is not None and len(batch_texts) >= self.batch_size
+            if batch_texts and (full or tokens + length > self.batch_tokens):
+                batches.append((batch_texts, batch_lengths))
+                batch_texts, batch_lengths, tokens = [], [], 0
+            batch_texts.append(text)
+            batch_lengths.append(length)
+            tokens += length
+        if batch_texts:
+            batches.append((batch_texts, batch_lengths))
+        return batches
+
+    async def _request(self, texts: List[str], tokens: int, query: bool = False):
+        """One provider call, after any back-off in progress, with its metrics."""
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        if self._in_flight == 0:
+            self._busy_since = time.perf_counter()
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            if query:
+                result = await self.embeddings.aembed_query(texts[0])
+            else:
+                result = await self.embeddings.aembed_documents(texts)
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                self.errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            finished = time.perf_counter()
+            self.requests += 1
+            self.request_seconds += finished - started
+            if self._in_flight == 0:
+                self.busy_seconds += finished - self._busy_since
+        self.texts += len(texts)
+        self.tokens += tokens
+        self._succeeded()
+        return result
+
+    def _succeeded(self) -> None:
+        self._successes += 1
+        if self._successes < self.grow_after:
+            return
+        self._successes = 0
+        self.batch_tokens = min(self.max_batch_tokens, self.batch_tokens + max(self.batch_tokens // 4, 1))
+        if self.batch_size is not None:
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(self.batch_size // 4, 1))
+
+    def _should_retry(self, error: Exception, attempt: int, texts: int, tokens: int) -> bool:
+        """Record a failed request; when it was throttled, back off and shrink the batches before a retry."""
+        if not is_rate_limit_error(error):
+            return False
+        self.rate_limited += 1
+        if attempt >= self.max_retries:
+            self.errors += 1
+            return False
+        self.retries += 1
+        self._successes = 0
+        # Only batches within the current limits shrink them, so requests that were already in
+        # flight when the limits were cut don't cut them again
+        if tokens <= self.batch_tokens and (self.batch_size is None or texts <= self.batch_size):
+            self.batch_tokens = max(self.batch_tokens // 2, 1)
+            if self.batch_size is not None:
+                self.batch_size = max(self.batch_size // 2, 1)
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.backoff_seconds * 2**attempt, self.max_backoff_seconds) * random.uniform(0.5, 1.0)
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        logger.warning(
+            "Embeddings provider %s throttled a request, retrying in %.1fs with batches of up to %d tokens: %s",
+            self.provider,
+            delay,
+            self.batch_tokens,
+            error,
+        )
+        return True
+
+    async def _embed_batch(self, texts: List[str], lengths: List[int], attempt: int = 0) -> List[List[float]]:
+        async with self.slots():
+            try:
+                return await self._request(texts, sum(lengths))
+            except Exception as e:
+                if not self._should_retry(e, attempt, len(texts), sum(lengths)):
+                    raise
+        # The limits were cut, so the throttled texts go out again in smaller batches
+        return await self._embed_batches(self.batches(texts, lengths), attempt + 1)
+
+    async def _embed_batches(self, batches: List[Batch], attempt: int = 0) -> List[List[float]]:
+        tasks = [asyncio.ensure_future(self._embed_batch(texts, lengths, attempt)) for texts, lengths in batches]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [vector for vectors in results for vector in vectors]
+
+    async def aembed_documents(self, texts: List[str], lengths: Optional[List[int]] = None) -> List[List[float]]:
+        if not texts:
+            return []
+        if lengths is None:
+            lengths = [self.length_function(text) for text in texts]
+        return await self._embed_batches(self.batches(list(texts), list(lengths)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        tokens = self.length_function(text)
+        attempt = 0
+        while True:
+            try:
+                return await self._request([text], tokens, query=True)
+            except Exception as e:
+                if not self._should_retry(e, attempt, 1, tokens):
+                    raise
+            attempt += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        return {
+            "provider": self.provider,
+            "concurrency": self.concurrency,
+            "batch_tokens": self.batch_tokens,
+            "batch_size": self.batch_size,
+            "requests": self.requests,
+            "texts": self.texts,
+            "tokens": self.tokens,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "mean_request_seconds": round(self.request_seconds / self.requests, 4) if self.requests else 0.0,
+            "texts_per_second": round(self.texts / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+            "tokens_per_second": round(self.tokens / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+        }
+
+
+class EmbeddingCoalescer(Embeddings):
+    """
+    Merges `aembed_documents` calls made at about the same time into one call to the wrapped embeddings.
+
+    The first call waits up to `max_wait_ms` for others to join; the merged call goes out when
+    the wait ends, or as soon as `max_batch_size` texts or `max_batch_tokens` tokens are pending,
+    and each caller gets back the vectors of its own texts. When a merged call fails, every caller's
+    texts are retried on their own, so one caller's bad input doesn't fail the others. Queries and
+    synchronous calls are not delayed. In front of an `EmbeddingDispatcher`, texts are counted
+    with its `length_function` and the counts are handed to it with the texts.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_wait_ms: float = 5,
+        max_batch_size: int = 256,
+        max_batch_tokens: int = 8000,
+        length_function: Optional[Callable[[str], int]] = None,
+    ):
+        self.embeddings = embeddings
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.length_function = length_function or getattr(embeddings, "length_function", default_length)
+        # (texts, token length of each text, caller's future)
+        self._pending: List[Tuple[List[str], List[int], asyncio.Future]] = []
+        self._pending_texts = 0
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop = None
+        self._sending: Set[asyncio.Task] = set()
+        self.calls = 0
+        self.flushes = 0
+        self.texts = 0
+        self.split_retries = 0
+
+    def __getattr__(self, name):
+        # The wrapped embeddings' attributes (model, batch limits, ...)
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Calls pending on a previous event loop can't be served any more
+            self._loop, self._pending, self._pending_texts, self._pending_tokens, self._timer = loop, [], 0, 0, None
+        future = loop.create_future()
+        lengths = [self.length_function(text) for text in texts]
+        self._pending.append((list(texts), lengths, future))
+        self._pending_texts += len(texts)
+        self._pending_tokens += sum(lengths)
+        self.calls += 1
+        self.texts += len(texts)
+        if self._pending_texts >= self.max_batch_size or self._pending_tokens >= self.max_batch_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._pending_texts, self._pending_tokens = self._pending, [], 0, 0
+        if not pending:
+            return
+        self.flushes += 1
+        task = asyncio.get_running_loop().create_task(self._send(pending))
+        # Keep a reference until the task is done, the event loop only holds weak ones
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _embed(self, texts: List[str], lengths: List[int]) -> List[List[float]]:
+        if isinstance(self.embeddings, EmbeddingDispatcher):
+            return await self.embeddings.aembed_documents(texts, lengths=lengths)
+        return await self.embeddings.aembed_documents(texts)
+
+    async def _send(self, pending: List[Tuple[List[str], List[int], asyncio.Future]]) -> None:
+        try:
+            vectors = await self._embed(
+                [text for texts, _, _ in pending for text in texts],
+                [length for _, lengths, _ in pending for length in lengths],
+            )
+        except Exception as e:
+            if len(pending) == 1:
+                if not pending[0][2].done():
+                    pending[0][2].set_exception(e)
+                return
+            self.split_retries += 1
+            logger.warning(f"Merged embeddings call for {len(pending)} callers failed, retrying each on its own: {e}")
+            results = await asyncio.gather(
+                *(self._embed(texts, lengths) for texts, lengths, _ in pending), return_exceptions=True
+            )
+            for (_, _, future), result in zip(pending, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            return
+        start = 0
+        for texts, _, future in pending:
+            if not future.done():
+                future.set_result(vectors[start : start + len(texts)])
+            start += len(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        """The wrapped embeddings' stats, with the coalescing counters under `coalescing`."""
+        stats = self.embeddings.stats() if hasattr(self.embeddings, "stats") else {}
+        stats["coalescing"] = {
+            "max_wait_ms": self.max_wait_ms,
+            "calls": self.calls,
+            "merged_calls": self.flushes,
+            "calls_per_merged_call": round(self.calls / self.flushes, 2) if self.flushes else 0.0,
+            "texts_per_merged_call": round(self.texts / self.flushes, 1) if self.flushes else 0.0,
+            "split_retries": self.split_retries,
+        }
+        return stats
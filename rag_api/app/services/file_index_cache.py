@@ -0,0 +1,260 @@
+# app/services/file_index_cache.py
+import asyncio
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.pgvector import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.runnables import run_in_executor
+
+from app.config import (
+    RAG_FILE_INDEX_CACHE,
+    RAG_FILE_INDEX_CACHE_MAX_MB,
+    RAG_FILE_INDEX_CACHE_TTL,
+    VECTOR_DB_TYPE,
+    VectorDBType,
+    logger,
+)
+
+
+def _sizeof(value) -> int:
+    """Approximate memory held by a chunk's text or metadata, including nested containers."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_sizeof(item) for item in value)
+    return size
+
+
+@dataclass
+class FileIndex:
+    """All chunks of one file, with their embeddings as a contiguous float32 matrix."""
+
+    documents: List[Tuple[str, dict]]
+    matrix: np.ndarray
+    # Squared row norms, used by the cosine and euclidean distances
+    squared_norms: np.ndarray
+    expires_at: float
+    # Memory held by the chunks' page content and metadata
+    documents_nbytes: int = 0
+
+    @classmethod
+    def from_records(cls, records: List[dict], expires_at: float) -> "FileIndex":
+        matrix = np.ascontiguousarray(np.stack([record["embedding"] for record in records]), dtype=np.float32)
+        documents = [(record["document"], record["cmetadata"]) for record in records]
+        return cls(
+            documents=documents,
+            matrix=matrix,
+            squared_norms=np.einsum("ij,ij->i", matrix, matrix),
+            expires_at=expires_at,
+            documents_nbytes=sum(_sizeof(document) for document in documents),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.squared_norms.nbytes + self.documents_nbytes
+
+    def distances(self, query: np.ndarray, distance_strategy: DistanceStrategy) -> np.ndarray:
+        """Distances to `query`, computed like pgvector's `<=>`, `<->` and `<#>` operators."""
+        dot = self.matrix @ query
+        if distance_strategy == DistanceStrategy.COSINE:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return 1.0 - dot / np.sqrt(self.squared_norms * float(query @ query))
+        if distance_strategy == DistanceStrategy.EUCLIDEAN:
+            return np.sqrt(np.maximum(self.squared_norms - 2.0 * dot + float(query @ query), 0.0))
+        return -dot
+
+
+class FileTooLarge(Exception):
+    """The file's embeddings don't fit in the cache budget; it is searched in Postgres."""
+
+
+class FileIndexCache:
+    """
+    Process-local cache of per-file embedding matrices for exact top-k search without Postgres.
+
+    A file is loaded on its first query and kept until it is invalidated (when `/embed` or
+    `DELETE /documents` touches it in this worker), it expires after `ttl_seconds` (which bounds
+    staleness for writes made by other workers), or it is the least recently used entry when
+    the cache exceeds `max_bytes` (embeddings, page content and metadata all count). Files that
+    don't fit in the budget are never cached. Building and searching more than `offload_min_bytes`
+    of embeddings runs in the default executor, so large files don't stall the event loop.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: int, offload_min_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.offload_min_bytes = offload_min_bytes
+        self._entries: "OrderedDict[str, FileIndex]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Bumped when a file is invalidated during its load, so a load that raced with a write is
+        # not cached; only kept while the load is in flight
+        self._generations: Dict[str, int] = {}
+        # Files over budget, with when to check their size again
+        self._oversized: Dict[str, float] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def _remove(self, file_id: str) -> None:
+        entry = self._entries.pop(file_id, None)
+        if entry is not None:
+            self.bytes -= entry.nbytes
+
+    def _put(self, file_id: str, entry: FileIndex) -> None:
+        self._remove(file_id)
+        self._entries[file_id] = entry
+        self.bytes += entry.nbytes
+        while self.bytes > self.max_bytes and self._entries:
+            evicted, _ = next(iter(self._entries.items()))
+            self._remove(evicted)
+            self.evictions += 1
+
+    def invalidate(self, file_id: str) -> None:
+        if file_id in self._inflight:
+            self._generations[file_id] = self._generations.get(file_id, 0) + 1
+        self._oversized.pop(file_id, None)
+        if file_id in self._entries:
+            self._remove(file_id)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._oversized.clear()
+        self.bytes = 0
+
+    async def _load(self, vector_store, file_id: str) -> Optional[FileIndex]:
+        generation = self._generations.get(file_id, 0)
+        records = await vector_store.aget_file_embeddings(file_id)
+        if not records:
+            return None
+        expires_at = time.monotonic() + self.ttl_seconds
+        # float32 size of the matrix, before it is built
+        if len(records) * len(records[0]["embedding"]) * 4 >= self.offload_min_bytes:
+            entry = await run_in_executor(None, FileIndex.from_records, records, expires_at)
+        else:
+            entry = FileIndex.from_records(records, expires_at)
+        if entry.nbytes > self.max_bytes:
+            logger.debug("File %s is too large for the file index cache (%d bytes)", file_id, entry.nbytes)
+            self._oversized[file_id] = entry.expires_at
+            raise FileTooLarge(file_id)
+        if self._generations.get(file_id, 0) == generation:
+            self._put(file_id, entry)
+        return entry
+
+    async def get(self, vector_store, file_id: str) -> Optional[FileIndex]:
+        """The cached index of a file, loading it if needed; None if the file has no chunks."""
+        if self._oversized.get(file_id, 0) >= time.monotonic():
+            raise FileTooLarge(file_id)
+        entry = self._entries.get(file_id)
+        if entry is not None and entry.expires_at >= time.monotonic():
+            self._entries.move_to_end(file_id)
+            self.hits += 1
+            return entry
+        if entry is not None:
+            self._remove(file_id)
+
+        inflight = self._inflight.get(file_id)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[file_id] = future
+        try:
+            entry = await self._load(vector_store, file_id)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(file_id, None)
+            self._generations.pop(file_id, None)
+
+    @staticmethod
+    def _top_k(
+        indexes: List[FileIndex], query: np.ndarray, distance_strategy: DistanceStrategy, k: int
+    ) -> List[Tuple[float, FileIndex, int]]:
+        """The `k` nearest rows of each index, as (distance, index, row) candidates."""
+        candidates = []
+        for entry in indexes:
+            distances = entry.distances(query, distance_strategy)
+            top = np.argpartition(distances, k - 1)[:k] if len(distances) > k else np.arange(len(distances))
+            candidates.extend((float(distances[row]), entry, row) for row in top)
+        return candidates
+
+    async def asimilarity_search(
+        self, vector_store, embedding: List[float], file_ids: List[str], k: int = 4
+    ) -> Optional[List[Tuple[Document, float]]]:
+        """
+        Exact top-k over the chunks of `file_ids`, with the same scores as the pgvector search.
+
+        Returns None when the cache can't answer (a file is over budget, a load failed or stored
+        embeddings have mixed dimensions), so the caller falls back to the database.
+        """
+        try:
+            indexes = []
+            for file_id in dict.fromkeys(file_ids):
+                entry = await self.get(vector_store, file_id)
+                if entry is not None:
+                    indexes.append(entry)
+            query = np.asarray(embedding, dtype=np.float32)
+            distance_strategy = vector_store.distance_strategy_type
+            if sum(entry.matrix.nbytes for entry in indexes) >= self.offload_min_bytes:
+                candidates = await run_in_executor(None, self._top_k, indexes, query, distance_strategy, k)
+            else:
+                candidates = self._top_k(indexes, query, distance_strategy, k)
+        except FileTooLarge:
+            return None
+        except Exception as e:
+            self.errors += 1
+            logger.warning(
+                "File index cache search failed, using pgvector | Error: %s | Traceback: %s",
+                str(e),
+                traceback.format_exc(),
+            )
+            return None
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        results = []
+        for distance, entry, row in candidates[:k]:
+            page_content, metadata = entry.documents[row]
+            results.append((Document(page_content=page_content, metadata=dict(metadata)), distance))
+        return results
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+# The embeddings are loaded from Postgres, so the cache is only available with the pgvector backend
+file_index_cache = (
+    FileIndexCache(max_bytes=RAG_FILE_INDEX_CACHE_MAX_MB * 1024 * 1024, ttl_seconds=RAG_FILE_INDEX_CACHE_TTL)
+    if RAG_FILE_INDEX_CACHE and VECTOR_DB_TYPE == VectorDBType.PGVECTOR
+    else None
+)
@@ -0,0 +1,466 @@
+# app/services/ingestion.py
+import asyncio
+import concurrent.futures
+import contextvars
+import hashlib
+import threading
+import time
+import traceback
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.runnables.config import run_in_executor
+from langchain_text_splitters import TextSplitter
+
+from app.config import RAG_EMBED_BATCH_SIZE, RAG_PIPELINE_QUEUE_SIZE, logger
+from app.models import CleanupMethod
+from app.services.metrics import count_chunks, observe_stage
+from app.services.tracing import span
+from app.services.vector_store.async_pg_vector import ChunkChanges
+from app.utils.document_loader import clean_text
+
+_END_OF_STREAM = object()
+
+ProgressCallback = Callable[..., Awaitable[None]]
+
+# Totals over all re-ingestions of existing files in this worker, reported by `/stats`
+update_stats = {"files": 0, "chunks_reused": 0, "chunks_embedded": 0, "chunks_cached": 0, "chunks_deleted": 0}
+
+
+def generate_digest(page_content: str) -> str:
+    hash_obj = hashlib.md5(page_content.encode())
+    return hash_obj.hexdigest()
+
+
+def lazy_load_documents(loader) -> Iterator[Document]:
+    """Iterate a loader page by page when it supports it, falling back to a full load."""
+    if hasattr(loader, "lazy_load"):
+        try:
+            yield from loader.lazy_load()
+            return
+        except NotImplementedError:
+            pass
+    yield from loader.load()
+
+
+def _put_threadsafe(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, item, stop: threading.Event) -> bool:
+    """Put an item on an asyncio queue from a worker thread, honouring back-pressure and cancellation."""
+    future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+    while True:
+        try:
+            future.result(timeout=0.5)
+            return True
+        except concurrent.futures.TimeoutError:
+            if stop.is_set():
+                future.cancel()
+                return False
+
+
+class StoredChunks:
+    """
+    The chunks already stored for a file that is being ingested again.
+
+    With `reuse`, new chunks whose digest matches a stored row keep that row (and its embedding)
+    instead of being embedded again; kept rows only get their metadata rewritten when their
+    position changed. Whatever is left unclaimed once the new version is split is deleted.
+    """
+
+    def __init__(self, stored: List[Tuple[str, dict]], reuse: bool = True):
+        self.reuse = reuse
+        self._by_digest: Dict[str, Deque[Tuple[str, dict]]] = defaultdict(deque)
+        for row_uuid, metadata in stored:
+            self._by_digest[metadata.get("digest")].append((row_uuid, metadata))
+        self._updated: Dict[str, dict] = {}
+
+    def claim(self, metadata: dict) -> bool:
+        """Keep a stored row for a new chunk with this metadata; False if it must be embedded."""
+        if not self.reuse or not self._by_digest.get(metadata["digest"]):
+            return False
+        row_uuid, stored_metadata = self._by_digest[metadata["digest"]].popleft()
+        if stored_metadata != metadata:
+            self._updated[row_uuid] = metadata
+        return True
+
+    def changes(self) -> ChunkChanges:
+        return ChunkChanges(
+            delete=[row_uuid for rows in self._by_digest.values() for row_uuid, _ in rows],
+            metadata=self._updated,
+        )
+
+
+def split_with_positions(
+    documents: Iterable[Document], text_splitter: TextSplitter, clean_content: bool = False
+) -> Iterator[Document]:
+    """
+    Split documents into chunks numbered in reading order.
+
+    Every chunk gets `chunk_index` and, when it can be located in its page, `start_index` /
+    `end_index`: character offsets into the concatenated (cleaned) page texts, which lets
+    readers remove the overlap between consecutive chunks exactly. Splitters with
+    `iter_split_documents` (see `TableTextSplitter`) get the whole document stream, and their
+    chunks, which are not verbatim page text, are only numbered.
+    """
+    if clean_content:
+        # Clean each page before splitting (remove null bytes) so offsets match the chunks
+        documents = (
+            Document(page_content=clean_text(document.page_content), metadata=document.metadata)
+            for document in documents
+        )
+    if hasattr(text_splitter, "iter_split_documents"):
+        for chunk_index, chunk in enumerate(text_splitter.iter_split_documents(documents)):
+            chunk.metadata["chunk_index"] = chunk_index
+            yield chunk
+        return
+
+    chunk_index = 0
+    page_offset = 0
+    for document in documents:
+        search_from = 0
+        for chunk in text_splitter.split_documents([document]):
+            start = document.page_content.find(chunk.page_content, search_from)
+            if start >= 0:
+                chunk.metadata["start_index"] = page_offset + start
+                chunk.metadata["end_index"] = page_offset + start + len(chunk.page_content)
+                search_from = start + 1
+            chunk.metadata["chunk_index"] = chunk_index
+            chunk_index += 1
+            yield chunk
+        page_offset += len(document.page_content)
+
+
+def _load_and_split(
+    loop: asyncio.AbstractEventLoop,
+    chunk_queue: asyncio.Queue,
+    documents: Iterable[Document],
+    text_splitter: TextSplitter,
+    clean_content: bool,
+    stop: threading.Event,
+    counters: dict,
+) -> int:
+    """
+    Load stage + split stage. Runs in the thread pool and streams chunks to the event loop.
+
+    Loading and splitting interleave page by page; the time spent pulling pages from the loader
+    is observed as the "load" stage and the rest of producing chunks as "split", while waiting
+    on the queue counts as neither.
+    """
+    chunk_count = 0
+    load_seconds = split_seconds = 0.0
+
+    def count_pages():
+        nonlocal load_seconds
+        pages = iter(documents)
+        while not stop.is_set():
+            started = time.perf_counter()
+            document = next(pages, _END_OF_STREAM)
+            load_seconds += time.perf_counter() - started
+            if document is _END_OF_STREAM:
+                return
+            counters["pages_loaded"] += 1
+            yield document
+
+    with span("load_and_split", splitter=type(text_splitter).__name__) as stage_span:
+        try:
+            chunks = split_with_positions(count_pages(), text_splitter, clean_content)
+            while True:
+                started, loaded = time.perf_counter(), load_seconds
+                chunk = next(chunks, _END_OF_STREAM)
+                split_seconds += time.perf_counter() - started - (load_seconds - loaded)
+                if chunk is _END_OF_STREAM or not _put_threadsafe(loop, chunk_queue, chunk, stop):
+                    return chunk_count
+                chunk_count += 1
+        finally:
+            _put_threadsafe(loop, chunk_queue, _END_OF_STREAM, stop)
+            observe_stage("load", load_seconds)
+            observe_stage("split", split_seconds)
+            stage_span.attributes.update(
+                pages=counters["pages_loaded"],
+                chunks=chunk_count,
+                load_seconds=round(load_seconds, 6),
+                split_seconds=round(split_seconds, 6),
+            )
+
+
+async def run_ingestion_pipeline(
+    documents: Iterable[Document],
+    vector_store,
+    text_splitter: TextSplitter,
+    file_id: str,
+    user_id: str = "",
+    clean_content: bool = False,
+    executor: Optional[concurrent.futures.Executor] = None,
+    batch_size: int = RAG_EMBED_BATCH_SIZE,
+    queue_size: int = RAG_PIPELINE_QUEUE_SIZE,
+    progress: Optional[ProgressCallback] = None,
+    embedding_cache=None,
+    stored_chunks: Optional[StoredChunks] = None,
+    counters: Optional[dict] = None,
+) -> List[str]:
+    """
+    Stream documents through load -> split -> embed -> insert.
+
+    `documents` is iterated inside `executor`, so passing `lazy_load_documents(loader)` keeps
+    parsing off the event loop. Chunks are embedded in batches of `batch_size` while the previous
+    batch is being inserted; at most `queue_size` batches are buffered between stages, which
+    bounds the memory held for a single upload. Stores with `acopy_embeddings` receive all
+    chunks as one streamed bulk insert, which only holds a database connection while it copies
+    an embedded batch, and removes the copied rows again if the file fails. If given,
+    `progress(stage=..., **counters)` is awaited after every stored batch, and only chunks missing
+    from `embedding_cache` are sent to the embeddings provider.
+
+    `stored_chunks` replaces an existing version of the file in the same bulk insert (it needs a
+    store with `acopy_embeddings`): matching chunks are reused and the rest are deleted. The
+    final counters are written to `counters` when it is given.
+    """
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    counters = counters if counters is not None else {}
+    counters.update(
+        pages_loaded=0, chunks_embedded=0, chunks_cached=0, chunks_stored=0, chunks_reused=0, chunks_deleted=0
+    )
+    chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size * queue_size)
+    insert_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    ids: List[str] = []
+    # Time spent in the embeddings provider, and by the insert stage waiting for embedded batches
+    embed_seconds = insert_wait_seconds = 0.0
+
+    def to_stored_document(chunk: Document) -> Document:
+        # Preparing documents with page content and metadata for insertion.
+        return Document(
+            page_content=chunk.page_content,
+            metadata={
+                "file_id": file_id,
+                "user_id": user_id,
+                "digest": generate_digest(chunk.page_content),
+                **(chunk.metadata or {}),
+            },
+        )
+
+    async def embed_stage():
+        batch: List[Document] = []
+
+        async def flush():
+            nonlocal embed_seconds
+            texts = [doc.page_content for doc in batch]
+            started = time.perf_counter()
+            with span("embed", chunks=len(texts)):
+                if embedding_cache is not None:
+                    counts = {}
+                    embeddings = await embedding_cache.aembed_documents(
+                        vector_store.embedding_function, texts, [doc.metadata["digest"] for doc in batch], counts
+                    )
+                    # Cache hits never reach the provider
+                    counters["chunks_embedded"] += counts["embedded"]
+                    counters["chunks_cached"] += counts["cached"]
+                else:
+                    embeddings = await vector_store.embedding_function.aembed_documents(texts)
+                    counters["chunks_embedded"] += len(texts)
+            embed_seconds += time.perf_counter() - started
+            await insert_queue.put((list(batch), embeddings))
+            batch.clear()
+
+        while (chunk := await chunk_queue.get()) is not _END_OF_STREAM:
+            doc = to_stored_document(chunk)
+            if stored_chunks is not None and stored_chunks.claim(doc.metadata):
+                counters["chunks_reused"] += 1
+                ids.append(file_id)
+                continue
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+        await insert_queue.put(_END_OF_STREAM)
+
+    async def next_batch():
+        nonlocal insert_wait_seconds
+        started = time.perf_counter()
+        item = await insert_queue.get()
+        insert_wait_seconds += time.perf_counter() - started
+        return item
+
+    async def stored_rows():
+        while (item := await next_batch()) is not _END_OF_STREAM:
+            docs, embeddings = item
+            for doc, embedding in zip(docs, embeddings):
+                yield file_id, doc.page_content, doc.metadata, embedding
+            ids.extend([file_id] * len(docs))
+            counters["chunks_stored"] += len(docs)
+            if progress:
+                await progress(stage="embedding", **counters)
+
+    def changes() -> ChunkChanges:
+        chunk_changes = stored_chunks.changes()
+        counters["chunks_deleted"] = len(chunk_changes.delete)
+        return chunk_changes
+
+    async def insert_stage():
+        started = time.perf_counter()
+        with span("insert") as stage_span:
+            try:
+                await insert_batches()
+            finally:
+                observe_stage("insert", time.perf_counter() - started - insert_wait_seconds)
+                stage_span.attributes.update(chunks=counters["chunks_stored"], wait_seconds=round(insert_wait_seconds, 6))
+
+    async def insert_batches():
+        if stored_chunks is not None:
+            await vector_store.acopy_embeddings(stored_rows(), changes=changes)
+            return
+        if hasattr(vector_store, "acopy_embeddings"):
+            # One COPY stream for the whole file, committed batch by batch
+            await vector_store.acopy_embeddings(stored_rows())
+            return
+        while (item := await next_batch()) is not _END_OF_STREAM:
+            docs, embeddings = item
+            ids.extend(
+                await vector_store.aadd_embeddings(
+                    texts=[doc.page_content for doc in docs],
+                    embeddings=embeddings,
+                    metadatas=[doc.metadata for doc in docs],
+                    ids=[file_id] * len(docs),
+                    executor=executor,
+                )
+            )
+            counters["chunks_stored"] += len(docs)
+            if progress:
+                await progress(stage="embedding", **counters)
+
+    # The producer thread runs in a copy of this context, so its span joins the request's trace
+    producer = loop.run_in_executor(
+        executor,
+        contextvars.copy_context().run,
+        _load_and_split,
+        loop,
+        chunk_queue,
+        documents,
+        text_splitter,
+        clean_content,
+        stop,
+        counters,
+    )
+    stages = [asyncio.ensure_future(embed_stage()), asyncio.ensure_future(insert_stage())]
+    try:
+        await asyncio.gather(producer, *stages)
+    except BaseException:
+        stop.set()
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(producer, *stages, return_exceptions=True)
+        raise
+    finally:
+        observe_stage("embed", embed_seconds)
+
+    count_chunks(
+        embedded=counters["chunks_embedded"],
+        cached=counters["chunks_cached"],
+        stored=counters["chunks_stored"],
+        reused=counters["chunks_reused"],
+        deleted=counters["chunks_deleted"],
+    )
+
+    if stored_chunks is not None:
+        update_stats["files"] += 1
+        for key in ("chunks_reused", "chunks_embedded", "chunks_cached", "chunks_deleted"):
+            update_stats[key] += counters[key]
+        logger.info(
+            "Updated file_id %s: %d chunks reused, %d embedded, %d from the embedding cache, %d deleted",
+            file_id,
+            counters["chunks_reused"],
+            counters["chunks_embedded"],
+            counters["chunks_cached"],
+            counters["chunks_deleted"],
+        )
+    logger.debug("Ingestion pipeline stored %d chunks for file_id %s", len(ids), file_id)
+    return ids
+
+
+async def store_documents(
+    documents: Iterable[Document],
+    vector_store,
+    text_splitter: TextSplitter,
+    file_id: str,
+    user_id: str = "",
+    clean_content: bool = False,
+    executor: Optional[concurrent.futures.Executor] = None,
+    progress: Optional[ProgressCallback] = None,
+    embedding_cache=None,
+    cleanup: Optional[CleanupMethod] = None,
+    counters: Optional[dict] = None,
+) -> List[str]:
+    """
+    Store documents for a file, streaming through the pipeline when the vector store supports it.
+
+    Without `cleanup`, chunks are added to whatever is stored for `file_id`. `CleanupMethod.full`
+    replaces the stored chunks, and `CleanupMethod.incremental` also replaces them but keeps the
+    rows (and embeddings) of chunks whose digest is unchanged. On stores with `aget_file_chunks`
+    the old chunks are removed in the last transaction of the bulk insert, so a failed update
+    leaves them in place; on other stores they are deleted first and incremental falls back to full.
+
+    Stores without `aadd_embeddings` (e.g. Atlas MongoDB) number their rows per call, so they keep
+    the single `add_documents` call, which still runs in `executor` rather than on the event loop.
+    """
+    stored_chunks = None
+    if cleanup and hasattr(vector_store, "aget_file_chunks"):
+        stored_chunks = StoredChunks(
+            await vector_store.aget_file_chunks(file_id), reuse=cleanup == CleanupMethod.incremental
+        )
+    elif cleanup:
+        if cleanup == CleanupMethod.incremental:
+            logger.info("Incremental updates are not supported by this vector store, replacing file_id %s", file_id)
+        if hasattr(vector_store, "aadd_embeddings"):
+            await vector_store.delete(ids=[file_id], executor=executor)
+        else:
+            await run_in_executor(executor, vector_store.delete, ids=[file_id])
+
+    if hasattr(vector_store, "aadd_embeddings"):
+        existing_ids = await vector_store.get_filtered_ids([file_id])
+        try:
+            return await run_ingestion_pipeline(
+                documents,
+                vector_store,
+                text_splitter,
+                file_id=file_id,
+                user_id=user_id,
+                clean_content=clean_content,
+                executor=executor,
+                progress=progress,
+                embedding_cache=embedding_cache,
+                stored_chunks=stored_chunks,
+                counters=counters,
+            )
+        except Exception:
+            # Stores without a bulk insert commit batches as they go; don't leave a half-embedded new file behind.
+            if not existing_ids:
+                try:
+                    await vector_store.delete(ids=[file_id], executor=executor)
+                except Exception as e:
+                    logger.error(
+                        "Failed to roll back partial ingestion | File ID: %s | Error: %s | Traceback: %s",
+                        file_id,
+                        str(e),
+                        traceback.format_exc(),
+                    )
+            raise
+
+    def split_all() -> List[Document]:
+        chunks = list(split_with_positions(documents, text_splitter, clean_content))
+        for chunk in chunks:
+            chunk.metadata = {
+                "file_id": file_id,
+                "user_id": user_id,
+                "digest": generate_digest(chunk.page_content),
+                **(chunk.metadata or {}),
+            }
+        return chunks
+
+    started = time.perf_counter()
+    docs = await run_in_executor(executor, split_all)
+    observe_stage("split", time.perf_counter() - started)
+    started = time.perf_counter()
+    ids = await run_in_executor(executor, vector_store.add_documents, docs, ids=[file_id] * len(docs))
+    # The store embeds and inserts in one call
+    observe_stage("insert", time.perf_counter() - started)
+    count_chunks(stored=len(docs))
+    return ids
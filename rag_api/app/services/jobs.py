@@ -0,0 +1,379 @@
+# app/services/jobs.py
+import asyncio
+import json
+import os
+import socket
+import traceback
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.config import logger
+from app.models import IngestionJob, JobStatus
+
+JobHandler = Callable[[IngestionJob, Callable[..., Awaitable[None]]], Awaitable[dict]]
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+class JobStore(ABC):
+    """Persistence for ingestion jobs. Implementations must be safe to share between worker tasks."""
+
+    async def setup(self) -> None:
+        pass
+
+    @abstractmethod
+    async def create(self, job: IngestionJob, worker_id: Optional[str] = None) -> None: ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[IngestionJob]: ...
+
+    @abstractmethod
+    async def update(self, job_id: str, **fields) -> None: ...
+
+    async def touch(self, job_ids: List[str], worker_id: str) -> None:
+        """Renew the lease on jobs owned by a live worker."""
+
+    async def claim_stale(self, worker_id: str, lease_seconds: int) -> List[IngestionJob]:
+        """
+        Take over unfinished jobs whose owning worker stopped renewing them. Their payload gets
+        `recovered: true`, since the stopped run may have stored part of the job's output.
+        """
+        return []
+
+    @abstractmethod
+    async def prune(self, retention_seconds: int) -> int:
+        """Delete completed and failed jobs last updated more than `retention_seconds` ago; returns how many."""
+
+    @abstractmethod
+    async def unfinished(self) -> List[IngestionJob]:
+        """Queued and running jobs, of every worker."""
+
+
+class InMemoryJobStore(JobStore):
+    """Process-local job store. Jobs are lost when the worker restarts."""
+
+    def __init__(self):
+        self._jobs: Dict[str, IngestionJob] = {}
+
+    async def create(self, job: IngestionJob, worker_id: Optional[str] = None) -> None:
+        self._jobs[job.job_id] = job
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        job = self._jobs.get(job_id)
+        return job.model_copy(deep=True) if job else None
+
+    async def update(self, job_id: str, **fields) -> None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        fields["updated_at"] = datetime.now(timezone.utc)
+        self._jobs[job_id] = job.model_copy(update=fields)
+
+    async def prune(self, retention_seconds: int) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention_seconds)
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in (JobStatus.completed, JobStatus.failed) and job.updated_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def unfinished(self) -> List[IngestionJob]:
+        return [
+            job.model_copy(deep=True)
+            for job in self._jobs.values()
+            if job.status in (JobStatus.queued, JobStatus.running)
+        ]
+
+
+class PostgresJobStore(JobStore):
+    """
+    Job store backed by the shared asyncpg pool.
+
+    Every job carries the id of the worker that owns it and a lease (`updated_at`) that the owner
+    renews; unfinished jobs whose lease expired are re-claimed by another (or a restarted) worker.
+    """
+
+    table_name = "rag_ingestion_jobs"
+    _json_fields = ("progress", "result", "payload")
+
+    async def _pool(self):
+        from app.services.database import PSQLDatabase
+
+        return await PSQLDatabase.get_pool()
+
+    async def setup(self) -> None:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    job_id TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress JSONB NOT NULL DEFAULT '{{}}',
+                    result JSONB,
+                    error TEXT,
+                    payload JSONB NOT NULL DEFAULT '{{}}',
+                    worker_id TEXT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """
+            )
+            await conn.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{self.table_name}_unfinished
+                ON {self.table_name} (updated_at) WHERE status IN ('queued', 'running');
+            """
+            )
+            await conn.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{self.table_name}_finished
+                ON {self.table_name} (updated_at) WHERE status IN ('completed', 'failed');
+            """
+            )
+
+    def _to_job(self, record) -> IngestionJob:
+        data = dict(record)
+        data.pop("worker_id", None)
+        for field in self._json_fields:
+            if isinstance(data.get(field), str):
+                data[field] = json.loads(data[field])
+        return IngestionJob(**data)
+
+    async def create(self, job: IngestionJob, worker_id: Optional[str] = None) -> None:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO {self.table_name}
+                    (job_id, file_id, user_id, filename, status, stage, progress, result, error, payload,
+                     worker_id, created_at, updated_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb, $8::jsonb, $9, $10::jsonb, $11, $12, $13)
+                """,
+                job.job_id,
+                job.file_id,
+                job.user_id,
+                job.filename,
+                job.status.value,
+                job.stage,
+                json.dumps(job.progress),
+                json.dumps(job.result) if job.result is not None else None,
+                job.error,
+                json.dumps(job.payload),
+                worker_id,
+                job.created_at,
+                job.updated_at,
+            )
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            record = await conn.fetchrow(f"SELECT * FROM {self.table_name} WHERE job_id = $1", job_id)
+        return self._to_job(record) if record else None
+
+    async def update(self, job_id: str, **fields) -> None:
+        if not fields:
+            return
+        assignments = []
+        values = []
+        for name, value in fields.items():
+            if name not in IngestionJob.model_fields or name in ("job_id", "updated_at"):
+                raise ValueError(f"Unknown job field: {name}")
+            if name in self._json_fields:
+                value = json.dumps(value) if value is not None else None
+                assignments.append(f"{name} = ${len(values) + 2}::jsonb")
+            else:
+                value = value.value if isinstance(value, JobStatus) else value
+                assignments.append(f"{name} = ${len(values) + 2}")
+            values.append(value)
+
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"UPDATE {self.table_name} SET {', '.join(assignments)}, updated_at = now() WHERE job_id = $1",
+                job_id,
+                *values,
+            )
+
+    async def touch(self, job_ids: List[str], worker_id: str) -> None:
+        if not job_ids:
+            return
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"UPDATE {self.table_name} SET updated_at = now(), worker_id = $2 WHERE job_id = ANY($1::text[])",
+                job_ids,
+                worker_id,
+            )
+
+    async def claim_stale(self, worker_id: str, lease_seconds: int) -> List[IngestionJob]:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(
+                f"""
+                UPDATE {self.table_name}
+                SET status = 'queued', worker_id = $1, updated_at = now(),
+                    payload = payload || '{{"recovered": true}}'::jsonb
+                WHERE status IN ('queued', 'running')
+                AND updated_at < now() - make_interval(secs => $2)
+                RETURNING *
+                """,
+                worker_id,
+                float(lease_seconds),
+            )
+        return [self._to_job(record) for record in records]
+
+    async def prune(self, retention_seconds: int) -> int:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                f"""
+                DELETE FROM {self.table_name}
+                WHERE status IN ('completed', 'failed')
+                AND updated_at < now() - make_interval(secs => $1)
+                """,
+                float(retention_seconds),
+            )
+        return int(result.split()[-1])
+
+    async def unfinished(self) -> List[IngestionJob]:
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(f"SELECT * FROM {self.table_name} WHERE status IN ('queued', 'running')")
+        return [self._to_job(record) for record in records]
+
+
+def get_job_store(kind: str) -> JobStore:
+    if kind == "memory":
+        return InMemoryJobStore()
+    elif kind == "postgres":
+        return PostgresJobStore()
+    else:
+        raise ValueError(f"Unsupported job store: {kind}. Choose 'memory' or 'postgres'.")
+
+
+class JobManager:
+    """
+    Worker pool for background ingestion jobs, owned by the application lifespan.
+
+    Jobs are queued in-process and executed by `workers` tasks with `handler(job, report)`,
+    where `report(stage=..., **progress)` records progress on the job. Finished jobs are kept for
+    `retention_seconds`, then pruned along with the periodic lease renewal. A job that fails
+    before its handler runs is passed to `discard`, to release what it holds (such as its upload).
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: JobHandler,
+        workers: int = 2,
+        lease_seconds: int = 300,
+        retention_seconds: int = 86400,
+        discard: Optional[Callable[[IngestionJob], Awaitable[None]]] = None,
+    ):
+        self.store = store
+        self.handler = handler
+        self.discard = discard
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._owned: set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        await self.store.setup()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain_leases()))
+        logger.info(f"Started {self.workers} ingestion job workers ({type(self.store).__name__})")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job: IngestionJob) -> IngestionJob:
+        await self.store.create(job, worker_id=self.worker_id)
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: IngestionJob) -> None:
+        self._owned.add(job.job_id)
+        self._queue.put_nowait(job)
+
+    async def _maintain_leases(self) -> None:
+        interval = max(self.lease_seconds / 3, 1)
+        while True:
+            try:
+                await self.store.touch(list(self._owned), self.worker_id)
+                for job in await self.store.claim_stale(self.worker_id, self.lease_seconds):
+                    logger.info(f"Recovered ingestion job {job.job_id} for file_id {job.file_id}")
+                    self._enqueue(job)
+                pruned = await self.store.prune(self.retention_seconds)
+                if pruned:
+                    logger.info(f"Pruned {pruned} finished ingestion jobs")
+            except Exception as e:
+                logger.error(
+                    "Failed to maintain ingestion job leases | Error: %s | Traceback: %s",
+                    str(e),
+                    traceback.format_exc(),
+                )
+            await asyncio.sleep(interval)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._owned.discard(job.job_id)
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob) -> None:
+        try:
+            await self.store.update(job.job_id, status=JobStatus.running, stage="started", error=None)
+        except Exception as e:
+            logger.error(
+                "Failed to start ingestion job | Job ID: %s | Error: %s | Traceback: %s",
+                job.job_id,
+                str(e),
+                traceback.format_exc(),
+            )
+            if self.discard is not None:
+                await self.discard(job)
+            return
+
+        async def report(stage: Optional[str] = None, **progress) -> None:
+            fields = {"progress": progress} if progress else {}
+            if stage:
+                fields["stage"] = stage
+            await self.store.update(job.job_id, **fields)
+
+        try:
+            result = await self.handler(job, report)
+            await self.store.update(job.job_id, status=JobStatus.completed, stage="completed", result=result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(
+                "Ingestion job failed | Job ID: %s | File ID: %s | Error: %s | Traceback: %s",
+                job.job_id,
+                job.file_id,
+                str(e),
+                traceback.format_exc(),
+            )
+            detail = getattr(e, "detail", None) or str(e)
+            await self.store.update(job.job_id, status=JobStatus.failed, stage="failed", error=str(detail))
@@ -0,0 +1,86 @@
+# app/services/metrics.py
+"""
+Prometheus metrics of this worker, served by `/metrics`.
+
+Request latency is recorded per route template by `metrics_middleware`. Pipeline stages are
+timed with `time.perf_counter()` and observed once per file (load, preprocess, split, embed,
+insert) or once per query (query_embed, search), so the hot path never touches a histogram per
+chunk. Queue depth and pool usage gauges are only read when `/metrics` is scraped.
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Ingestion stages run for seconds to minutes on large files, searches for milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGES = ("load", "preprocess", "split", "embed", "insert", "query_embed", "search")
+
+request_seconds = Histogram(
+    "rag_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+stage_seconds = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in a pipeline stage, per ingested file or per query",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+chunks_total = Counter("rag_chunks", "Chunks handled by ingestion, by outcome", ["outcome"])
+upload_bytes_total = Counter("rag_upload_bytes", "Bytes of uploaded files received")
+thread_pool_queue_depth = Gauge("rag_thread_pool_queue_depth", "Tasks waiting for a worker of the shared thread pool")
+db_pool_connections = Gauge("rag_db_pool_connections", "Connections of the asyncpg pool, by state", ["state"])
+db_pool_max_connections = Gauge("rag_db_pool_max_connections", "Size limit of the asyncpg pool")
+
+# Children bound once, so observing a stage is a dict lookup and a histogram update
+_stages = {stage: stage_seconds.labels(stage) for stage in STAGES}
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    _stages[stage].observe(seconds)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Observe the wall time of the block as `stage`, also when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages[stage].observe(time.perf_counter() - started)
+
+
+def count_chunks(**outcomes: int) -> None:
+    """Add chunk counts by outcome, e.g. `count_chunks(embedded=10, reused=2)`."""
+    for outcome, count in outcomes.items():
+        if count:
+            chunks_total.labels(outcome).inc(count)
+
+
+def track_thread_pool(executor) -> None:
+    """Report the pending work items of a `ThreadPoolExecutor`."""
+    thread_pool_queue_depth.set_function(lambda: executor._work_queue.qsize())
+
+
+def track_db_pool(get_pool: Callable[[], Optional[object]]) -> None:
+    """Report the usage of the asyncpg pool returned by `get_pool()`, or zeros while there is none."""
+
+    def in_use() -> int:
+        pool = get_pool()
+        return pool.get_size() - pool.get_idle_size() if pool is not None else 0
+
+    def idle() -> int:
+        pool = get_pool()
+        return pool.get_idle_size() if pool is not None else 0
+
+    def max_size() -> int:
+        pool = get_pool()
+        return pool.get_max_size() if pool is not None else 0
+
+    db_pool_connections.labels("in_use").set_function(in_use)
+    db_pool_connections.labels("idle").set_function(idle)
+    db_pool_max_connections.set_function(max_size)
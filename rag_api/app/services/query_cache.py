@@ -0,0 +1,270 @@
+# app/services/query_cache.py
+import asyncio
+import hashlib
+import time
+import traceback
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from app.config import (
+    EMBEDDINGS_MODEL,
+    EMBEDDINGS_PROVIDER,
+    EmbeddingsProvider,
+    RAG_QUERY_CACHE_BACKEND,
+    RAG_QUERY_CACHE_SIZE,
+    RAG_QUERY_CACHE_TTL,
+    RAG_REDIS_URI,
+    logger,
+)
+
+
+class QueryCacheBackend(ABC):
+    """Cache shared by all workers, consulted after the process-local LRU misses."""
+
+    async def setup(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[List[float]]: ...
+
+    @abstractmethod
+    async def set(self, key: str, embedding: List[float], ttl_seconds: int) -> None: ...
+
+
+class RedisQueryCacheBackend(QueryCacheBackend):
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ValueError(
+                "RAG_QUERY_CACHE_BACKEND=redis requires the `redis` package (pip install redis)."
+            ) from e
+
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        value = await self._client.get(f"rag:query_embedding:{key}")
+        return array("f", value).tolist() if value is not None else None
+
+    async def set(self, key: str, embedding: List[float], ttl_seconds: int) -> None:
+        await self._client.set(f"rag:query_embedding:{key}", array("f", embedding).tobytes(), ex=ttl_seconds)
+
+
+class PostgresQueryCacheBackend(QueryCacheBackend):
+    """Stores query embeddings in the chunk embedding cache table, under a separate model key."""
+
+    def __init__(self, model: str, max_entries: int, ttl_seconds: int):
+        from app.services.embedding_cache import ChunkEmbeddingCache
+
+        # Looked up by queries, so it doesn't wait for the ingestion connection slots
+        self._cache = ChunkEmbeddingCache(
+            model=f"{model}:query", max_entries=max_entries, ttl_seconds=ttl_seconds, ingestion=False
+        )
+
+    async def setup(self) -> None:
+        await self._cache.setup()
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        return (await self._cache.get_many([key])).get(key)
+
+    async def set(self, key: str, embedding: List[float], ttl_seconds: int) -> None:
+        await self._cache.put_many({key: embedding})
+        await self._cache.evict_if_due()
+
+
+class QueryEmbeddingCache:
+    """
+    Async, TTL-bounded cache for query embeddings.
+
+    Lookups go through a process-local LRU of `max_size` entries, then the optional shared
+    `backend`. Concurrent misses for the same query share a single provider call, and provider
+    calls go through `aembed_query`, which keeps them off the event loop. With `batch_queries`,
+    misses from `aembed_queries` are embedded with one `aembed_documents` call; only enable it
+    for providers that embed queries and documents the same way.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_size: int,
+        ttl_seconds: int,
+        backend: Optional[QueryCacheBackend] = None,
+        batch_queries: bool = False,
+    ):
+        self.model = model
+        self.batch_queries = batch_queries
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._local: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, query: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{query}".encode()).hexdigest()
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, embedding = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return embedding
+
+    def _set_local(self, key: str, embedding: List[float]) -> None:
+        if self.max_size <= 0:
+            return
+        self._local[key] = (time.monotonic() + self.ttl_seconds, embedding)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def _get_shared(self, key: str) -> Optional[List[float]]:
+        if self.backend is None:
+            return None
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Query embedding cache lookup failed: {e}")
+            return None
+
+    async def _set_shared(self, key: str, embedding: List[float]) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(key, embedding, self.ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(
+                "Failed to update query embedding cache | Error: %s | Traceback: %s", str(e), traceback.format_exc()
+            )
+
+    async def aembed_query(self, embedding_function: Embeddings, query: str) -> List[float]:
+        return (await self.aembed_queries(embedding_function, [query]))[0]
+
+    async def _embed_misses(self, embedding_function: Embeddings, queries: List[str]) -> List[List[float]]:
+        if len(queries) == 1:
+            return [await embedding_function.aembed_query(queries[0])]
+        if self.batch_queries:
+            return await embedding_function.aembed_documents(queries)
+        return list(await asyncio.gather(*(embedding_function.aembed_query(query) for query in queries)))
+
+    async def aembed_queries(self, embedding_function: Embeddings, queries: List[str]) -> List[List[float]]:
+        """
+        Embed several queries, sending all of those missing from both cache levels to the
+        provider at once (in a single call when `batch_queries` is set).
+        """
+        keys = [self._key(query) for query in queries]
+        results: Dict[str, List[float]] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        owned: Dict[str, str] = {}
+        loop = asyncio.get_running_loop()
+        for query, key in zip(queries, keys):
+            if key in results or key in waiting or key in owned:
+                continue
+            embedding = self._get_local(key)
+            if embedding is not None:
+                self.hits += 1
+                results[key] = embedding
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[key] = self._inflight[key]
+            else:
+                owned[key] = query
+                self._inflight[key] = loop.create_future()
+
+        try:
+            if owned:
+                shared = await asyncio.gather(*(self._get_shared(key) for key in owned))
+                misses: Dict[str, str] = {}
+                for (key, query), embedding in zip(owned.items(), shared):
+                    if embedding is not None:
+                        self.shared_hits += 1
+                        results[key] = embedding
+                    else:
+                        misses[key] = query
+                if misses:
+                    self.misses += len(misses)
+                    embeddings = await self._embed_misses(embedding_function, list(misses.values()))
+                    results.update(zip(misses, embeddings))
+                    await asyncio.gather(*(self._set_shared(key, results[key]) for key in misses))
+                for key in owned:
+                    self._set_local(key, results[key])
+                    self._inflight[key].set_result(results[key])
+        except BaseException as e:
+            for key in owned:
+                future = self._inflight[key]
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    # Waiters re-raise it; don't warn about an unretrieved exception when there are none
+                    future.exception()
+            raise
+        finally:
+            for key in owned:
+                self._inflight.pop(key, None)
+
+        for key, future in waiting.items():
+            results[key] = await asyncio.shield(future)
+        return [results[key] for key in keys]
+
+    def clear(self) -> None:
+        self._local.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.coalesced + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "size": len(self._local),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+        }
+
+
+def get_query_cache_backend(kind: str, model: str) -> Optional[QueryCacheBackend]:
+    if not kind:
+        return None
+    elif kind == "redis":
+        return RedisQueryCacheBackend(RAG_REDIS_URI)
+    elif kind == "postgres":
+        return PostgresQueryCacheBackend(model, max_entries=RAG_QUERY_CACHE_SIZE * 100, ttl_seconds=RAG_QUERY_CACHE_TTL)
+    else:
+        raise ValueError(f"Unsupported query cache backend: {kind}. Choose 'redis' or 'postgres'.")
+
+
+# Providers whose `embed_query(text)` equals `embed_documents([text])[0]` (Google's embed queries with a different task type)
+BATCHABLE_QUERY_PROVIDERS = {
+    EmbeddingsProvider.OPENAI,
+    EmbeddingsProvider.AZURE,
+    EmbeddingsProvider.HUGGINGFACE,
+    EmbeddingsProvider.HUGGINGFACETEI,
+    EmbeddingsProvider.OLLAMA,
+}
+
+_query_cache_model = f"{EMBEDDINGS_PROVIDER.value}:{EMBEDDINGS_MODEL}"
+query_embedding_cache = QueryEmbeddingCache(
+    model=_query_cache_model,
+    max_size=RAG_QUERY_CACHE_SIZE,
+    ttl_seconds=RAG_QUERY_CACHE_TTL,
+    backend=get_query_cache_backend(RAG_QUERY_CACHE_BACKEND, _query_cache_model),
+    batch_queries=EMBEDDINGS_PROVIDER in BATCHABLE_QUERY_PROVIDERS,
+)
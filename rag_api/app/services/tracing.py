@@ -0,0 +1,306 @@
+# app/services/tracing.py
+"""
+Lightweight request tracing: nested spans carried in a context variable, exported in batches.
+
+`span(name, **attributes)` times a block as a child of the current span, so a request's stages
+and the vector store calls they make form one trace. Trace ids come from an incoming W3C
+`traceparent` (or `X-Trace-Id`) header when there is one, and are added to the JSON logs.
+Spans are encoded as OTLP/JSON and handed to a pluggable exporter from a background thread:
+"file" appends them to a local JSON lines file and works offline, "otlp" posts them to an
+OpenTelemetry collector. With no exporter, spans still give logs their trace ids but are not kept.
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "rag_api"
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+_INVALID_TRACE_ID = "0" * 32
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> dict:
+        encoded = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            encoded["parentSpanId"] = self.parent_id
+        return encoded
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def parse_trace_header(traceparent: Optional[str], trace_id: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """`(trace_id, parent_span_id)` of a W3C `traceparent` header, else of a bare 32-hex-digit trace id."""
+    if traceparent:
+        match = _TRACEPARENT.match(traceparent.strip().lower())
+        if match and match.group(1) != _INVALID_TRACE_ID:
+            return match.group(1), match.group(2)
+    if trace_id and _TRACE_ID.match(trace_id.strip().lower()):
+        return trace_id.strip().lower(), None
+    return None, None
+
+
+@contextmanager
+def span(
+    name: str,
+    trace_id: Optional[str] = None,
+    parent_id: Optional[str] = None,
+    kind: int = SPAN_KIND_INTERNAL,
+    **attributes,
+):
+    """
+    Time the block as a span, a child of the current one unless `trace_id` (and `parent_id`,
+    for a remote parent) start another trace. Exceptions mark the span as failed.
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        parent_id = parent.span_id if parent else None
+    current = Span(name, trace_id, parent_id, kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        tracer.on_end(current)
+
+
+def traced(name: str):
+    """Decorator running a coroutine function inside `span(name)`."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class SpanExporter(ABC):
+    """Destination of finished spans; `export` is called from the tracer's background thread."""
+
+    @abstractmethod
+    def export(self, spans: List[Span]) -> None: ...
+
+    def shutdown(self) -> None:
+        pass
+
+
+def otlp_request(spans: List[Span]) -> dict:
+    """An OTLP/JSON `ExportTraceServiceRequest` body for the spans."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": [span.to_otlp() for span in spans]}],
+            }
+        ]
+    }
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends one OTLP/JSON export request per batch to a JSON lines file. Each line can be posted
+    as is to a collector's `/v1/traces` endpoint later.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        line = json.dumps(otlp_request(spans), separators=(",", ":"))
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Posts OTLP/JSON export requests to an OpenTelemetry collector's `/v1/traces` endpoint."""
+
+    def __init__(self, endpoint: str, timeout: float = 10.0, headers: Optional[Dict[str, str]] = None):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def export(self, spans: List[Span]) -> None:
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(otlp_request(spans)).encode(), headers=self.headers, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+# Exporter factories by name; they receive every tracing option and take the ones they need
+SPAN_EXPORTERS: Dict[str, Callable[..., SpanExporter]] = {}
+
+
+def register_span_exporter(name: str):
+    """Decorator registering a span exporter factory under `name` (see `RAG_TRACE_EXPORTER`)."""
+
+    def decorator(factory: Callable[..., SpanExporter]):
+        SPAN_EXPORTERS[name] = factory
+        return factory
+
+    return decorator
+
+
+@register_span_exporter("file")
+def _file_exporter(file_path: str, **options) -> SpanExporter:
+    return FileSpanExporter(file_path)
+
+
+@register_span_exporter("otlp")
+def _otlp_exporter(otlp_endpoint: str, **options) -> SpanExporter:
+    return OtlpHttpSpanExporter(otlp_endpoint)
+
+
+def get_span_exporter(name: str, **options) -> Optional[SpanExporter]:
+    """The exporter registered as `name` built with `options`, or None for "none"."""
+    if name == "none":
+        return None
+    if name not in SPAN_EXPORTERS:
+        raise ValueError(f"Unknown trace exporter '{name}'. Choose 'none' or one of: {', '.join(SPAN_EXPORTERS)}.")
+    return SPAN_EXPORTERS[name](**options)
+
+
+class Tracer:
+    """
+    Buffers finished spans and exports them every `interval` seconds from a daemon thread, so
+    request handlers only append to a deque. Spans beyond `max_queue` are dropped and counted.
+    """
+
+    def __init__(self):
+        self.exporter: Optional[SpanExporter] = None
+        self.interval = 1.0
+        self.max_queue = 10000
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: deque = deque()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, exporter: Optional[SpanExporter], interval: float = 1.0, max_queue: int = 10000) -> None:
+        self.shutdown()
+        self.exporter, self.interval, self.max_queue = exporter, interval, max_queue
+        if exporter is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, finished: Span) -> None:
+        if self.exporter is None:
+            return
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(finished)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Export the buffered spans now."""
+        batch = []
+        while self._queue:
+            batch.append(self._queue.popleft())
+        if not batch or self.exporter is None:
+            return
+        try:
+            self.exporter.export(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning("Failed to export %d spans: %s", len(batch), e)
+
+    def shutdown(self) -> None:
+        """Stop the export thread, export what is left and release the exporter."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self.exporter is not None:
+            self.exporter.shutdown()
+            self.exporter = None
+
+    def stats(self) -> dict:
+        return {"exported": self.exported, "dropped": self.dropped, "failed": self.failed, "queued": len(self._queue)}
+
+
+tracer = Tracer()
@@ -0,0 +1,334 @@
+# app/services/uploads.py
+"""
+Uploaded files of this worker, spooled within a memory and disk budget.
+
+An upload up to `RAG_UPLOAD_MEMORY_MAX_KB` is read into memory with a single read, and loaders
+that read plain text decode it from there. Larger uploads are streamed to a file under a
+directory of their own in `RAG_UPLOAD_DIR/<user_id>/`, so concurrent uploads of the same
+filename never overwrite each other and loaders still see the original filename. An in-memory
+upload is only written to disk, once, when a loader needs a path. Leaving the
+`async with SpooledUpload(...)` block removes the spool file and releases the budget, also when
+the block raises.
+
+Starlette spools each uploaded file while it parses the request, to a temporary file once it
+outgrows 1 MB. With `spool_uploads_in_upload_dir()` that temporary file is created in
+`RAG_UPLOAD_DIR`, so `receive` moves it into place instead of writing the upload a second time.
+"""
+import glob
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from langchain_core.runnables import run_in_executor
+from starlette import formparsers
+
+from app.config import (
+    RAG_UPLOAD_DIR,
+    RAG_UPLOAD_DISK_BUDGET_MB,
+    RAG_UPLOAD_MEMORY_BUDGET_MB,
+    RAG_UPLOAD_MEMORY_MAX_KB,
+    RAG_UPLOAD_TIMEOUT,
+    logger,
+)
+from app.services.metrics import upload_bytes_total
+
+CHUNK_SIZE = 64 * 1024  # 64 KB
+SPOOL_PREFIX = "upload-"
+# Files Starlette is still writing, before `receive` moves them
+INCOMING_PREFIX = "incoming-"
+
+
+class UploadBudgetExceeded(Exception):
+    """The worker has no room for another upload right now."""
+
+
+class UploadBudget:
+    """
+    Bytes of uploads held in memory and on disk by this worker. `reserve` refuses what doesn't
+    fit; `charge` always counts, for bytes already accepted, such as the uploads of jobs recovered
+    from another worker. Uploads queued for a background job stay reserved while they wait: the
+    request `hand_over`s its reservation and the job takes it over with `take_over`.
+    """
+
+    def __init__(self, memory_bytes: int, disk_bytes: int):
+        self.limits = {"memory": memory_bytes, "disk": disk_bytes}
+        self.in_use = {"memory": 0, "disk": 0}
+        self.peak = {"memory": 0, "disk": 0}
+        self.counts = {"in_memory": 0, "spooled": 0, "rejected": 0}
+        # Disk bytes reserved for queued uploads, by spool file
+        self._handed_over: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def try_reserve(self, kind: str, size: int) -> bool:
+        with self._lock:
+            if self.in_use[kind] + size > self.limits[kind]:
+                return False
+            self._add(kind, size)
+            return True
+
+    def reserve(self, kind: str, size: int) -> None:
+        if not self.try_reserve(kind, size):
+            self.counts["rejected"] += 1
+            raise UploadBudgetExceeded(
+                f"The upload {kind} budget of {self.limits[kind] // (1024 * 1024)} MB is in use, try again later."
+            )
+
+    def charge(self, kind: str, size: int) -> None:
+        with self._lock:
+            self._add(kind, size)
+
+    def release(self, kind: str, size: int) -> None:
+        with self._lock:
+            self.in_use[kind] -= size
+
+    def hand_over(self, path: str, size: int) -> None:
+        with self._lock:
+            self._handed_over[path] = self._handed_over.get(path, 0) + size
+
+    def take_over(self, path: str) -> Optional[int]:
+        """The disk bytes reserved for `path` by `hand_over`, or None when it wasn't handed over here."""
+        with self._lock:
+            return self._handed_over.pop(path, None)
+
+    def _add(self, kind: str, size: int) -> None:
+        self.in_use[kind] += size
+        self.peak[kind] = max(self.peak[kind], self.in_use[kind])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counts,
+                "queued": len(self._handed_over),
+                **{f"{kind}_bytes": value for kind, value in self.in_use.items()},
+                **{f"{kind}_peak_bytes": value for kind, value in self.peak.items()},
+                **{f"{kind}_limit_bytes": value for kind, value in self.limits.items()},
+            }
+
+
+upload_budget = UploadBudget(RAG_UPLOAD_MEMORY_BUDGET_MB * 1024 * 1024, RAG_UPLOAD_DISK_BUDGET_MB * 1024 * 1024)
+
+
+class UploadSpoolFile(tempfile.SpooledTemporaryFile):
+    """
+    Starlette's spool for an uploaded file, rolled over to a named file in `RAG_UPLOAD_DIR`
+    rather than an anonymous one, so `SpooledUpload.receive` can move it. The file is removed
+    when it is closed unless it was moved.
+    """
+
+    _moved = False
+
+    def rollover(self) -> None:
+        # CPython's rollover, with a named file kept on close in place of `TemporaryFile`
+        if self._rolled:
+            return
+        buffer = self._file
+        os.makedirs(RAG_UPLOAD_DIR, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(
+            **{**self._TemporaryFileArgs, "prefix": INCOMING_PREFIX, "dir": RAG_UPLOAD_DIR}, delete=False
+        )
+        del self._TemporaryFileArgs
+        position = buffer.tell()
+        if hasattr(self._file, "buffer"):
+            self._file.buffer.write(buffer.detach().getvalue())
+        else:
+            self._file.write(buffer.getvalue())
+        self._file.seek(position, 0)
+        self._rolled = True
+
+    @property
+    def path(self) -> Optional[str]:
+        """The file the upload was rolled over to, while it is still there."""
+        return self._file.name if self._rolled and not self._moved else None
+
+    def move(self, destination: str) -> None:
+        os.replace(self._file.name, destination)
+        self._moved = True
+
+    def close(self) -> None:
+        path = self.path
+        super().close()
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error("Failed to remove incoming upload | Path: %s | Error: %s", path, str(e))
+
+
+def spool_uploads_in_upload_dir() -> bool:
+    """
+    Have Starlette's multipart parser spool uploaded files with `UploadSpoolFile`. Starlette is
+    pinned to the version this was written for; if its parser or CPython's `SpooledTemporaryFile`
+    no longer look as expected, Starlette is left alone and uploads are copied instead. Returns
+    whether the parser was patched.
+    """
+    probe = tempfile.SpooledTemporaryFile()
+    expected = all(hasattr(probe, attribute) for attribute in ("_file", "_rolled", "_TemporaryFileArgs"))
+    probe.close()
+    spool_class = getattr(formparsers, "SpooledTemporaryFile", None)
+    if not expected or spool_class not in (tempfile.SpooledTemporaryFile, UploadSpoolFile):
+        logger.warning("Cannot spool uploads in RAG_UPLOAD_DIR with this Starlette or Python version, copying them")
+        return False
+    formparsers.SpooledTemporaryFile = UploadSpoolFile
+    return True
+
+
+def sweep_uploads(keep: Iterable[str] = (), min_age_seconds: float = RAG_UPLOAD_TIMEOUT) -> int:
+    """
+    Remove the spool files a previous run left behind, such as the uploads of jobs an in-memory
+    job store lost on restart: incoming files, and upload directories other than those of the
+    `keep` files (the uploads of unfinished jobs). Anything younger than `min_age_seconds` may
+    belong to a request another worker is still serving, and stays. Returns how many were removed.
+    """
+    keep_directories = {os.path.dirname(os.path.abspath(path)) for path in keep}
+    cutoff = time.time() - min_age_seconds
+    removed = 0
+    for path in glob.glob(os.path.join(RAG_UPLOAD_DIR, f"{INCOMING_PREFIX}*")) + glob.glob(
+        os.path.join(RAG_UPLOAD_DIR, "*", f"{SPOOL_PREFIX}*")
+    ):
+        try:
+            if os.path.abspath(path) in keep_directories or os.path.getmtime(path) > cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.error("Failed to remove leftover upload | Path: %s | Error: %s", path, str(e))
+    return removed
+
+
+class SpooledUpload:
+    """
+    One upload, held in `buffer` while it is in memory or in the spool file `path` once on disk.
+
+    `receive` reads an `UploadFile`; `detach` hands it over to a background job, which takes it
+    over with `adopt`. `name` is the upload's path as loaders should report it: the spool file
+    once there is one, else where it would have been saved.
+    """
+
+    def __init__(self, filename: str, user_id: str, budget: Optional[UploadBudget] = None):
+        self.filename = os.path.basename(filename or "") or "upload"
+        self.directory = os.path.join(RAG_UPLOAD_DIR, user_id)
+        self.buffer: Optional[bytes] = None
+        self.path: Optional[str] = None
+        self.size = 0
+        self._budget = budget or upload_budget
+        self._reserved = {"memory": 0, "disk": 0}
+        self._owns_directory = False
+
+    @property
+    def name(self) -> str:
+        return self.path or os.path.join(self.directory, self.filename)
+
+    async def __aenter__(self) -> "SpooledUpload":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def receive(self, file: UploadFile, memory_max: int = RAG_UPLOAD_MEMORY_MAX_KB * 1024) -> None:
+        """
+        Read the upload: in one piece into memory when it is small and fits the budget, else to
+        disk. A file Starlette already spooled to `RAG_UPLOAD_DIR` is moved there, not copied.
+        """
+        if file.size is not None and file.size <= memory_max and self._budget.try_reserve("memory", file.size):
+            self._reserved["memory"] = file.size
+            self.buffer = await file.read()
+            self.size = len(self.buffer)
+            upload_bytes_total.inc(self.size)
+            self._budget.counts["in_memory"] += 1
+            return
+
+        if file.size is not None:
+            # Known size: refuse before reading anything
+            self._reserve_disk(file.size)
+        self._create_spool_file()
+        if isinstance(file.file, UploadSpoolFile) and file.file.path is not None:
+            await run_in_executor(None, file.file.move, self.path)
+            self.size = os.path.getsize(self.path)
+            if self.size > self._reserved["disk"]:
+                self._reserve_disk(self.size - self._reserved["disk"])
+            upload_bytes_total.inc(self.size)
+            self._budget.counts["spooled"] += 1
+            return
+        async with aiofiles.open(self.path, "wb") as spool_file:
+            while chunk := await file.read(CHUNK_SIZE):
+                if self.size + len(chunk) > self._reserved["disk"]:
+                    self._reserve_disk(self.size + len(chunk) - self._reserved["disk"])
+                await spool_file.write(chunk)
+                self.size += len(chunk)
+                upload_bytes_total.inc(len(chunk))
+        self._budget.counts["spooled"] += 1
+
+    def adopt(self, path: str) -> None:
+        """
+        Take over a spool file handed over by `detach`, with the disk budget reserved for it. A
+        file queued by another worker, for a job recovered from it, is charged to this worker.
+        """
+        self.path = path
+        self._owns_directory = os.path.basename(os.path.dirname(path)).startswith(SPOOL_PREFIX)
+        reserved = self._budget.take_over(path)
+        if reserved is not None:
+            self._reserved["disk"] = reserved
+        self.size = os.path.getsize(path)
+        if reserved is None:
+            self._budget.charge("disk", self.size)
+            self._reserved["disk"] = self.size
+
+    def ensure_file(self) -> str:
+        """The spool file, written from the in-memory buffer the first time a loader needs a path."""
+        if self.path is None:
+            # Bounded by RAG_UPLOAD_MEMORY_MAX_KB and already accepted in memory, so never refused
+            self._budget.charge("disk", self.size)
+            self._reserved["disk"] += self.size
+            self._create_spool_file()
+            with open(self.path, "wb") as spool_file:
+                spool_file.write(self.buffer)
+        return self.path
+
+    async def detach(self) -> str:
+        """
+        Hand the upload over as a file, for a background job that adopts and removes it. Its disk
+        reservation is kept until then, so queued uploads still count against the budget and new
+        uploads are refused while the queue holds too much.
+        """
+        path = await run_in_executor(None, self.ensure_file)
+        self._budget.hand_over(path, self._reserved["disk"])
+        self._reserved["disk"] = 0
+        self.path = None
+        self._owns_directory = False
+        await self.close()
+        return path
+
+    async def close(self) -> None:
+        """Remove the spool file and its directory, drop the buffer and release the budget."""
+        if self.path is not None:
+            try:
+                if os.path.exists(self.path):
+                    await aiofiles.os.remove(self.path)
+                if self._owns_directory:
+                    await aiofiles.os.rmdir(os.path.dirname(self.path))
+            except Exception as e:
+                logger.error("Failed to remove spooled upload | Path: %s | Error: %s", self.path, str(e))
+            self.path = None
+        self.buffer = None
+        for kind, size in self._reserved.items():
+            if size:
+                self._budget.release(kind, size)
+        self._reserved = {"memory": 0, "disk": 0}
+
+    def _reserve_disk(self, size: int) -> None:
+        self._budget.reserve("disk", size)
+        self._reserved["disk"] += size
+
+    def _create_spool_file(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(tempfile.mkdtemp(prefix=SPOOL_PREFIX, dir=self.directory), self.filename)
+        self._owns_directory = True
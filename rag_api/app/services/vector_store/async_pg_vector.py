@@ -1,16 +1,150 @@
 import asyncio
-from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import re
+import time
+import uuid
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
+from langchain_community.vectorstores.pgvector import DistanceStrategy
 from langchain_core.documents import Document
 from langchain_core.runnables.config import run_in_executor
 
+from app.services.tracing import traced
+
 from .extended_pg_vector import ExtendedPgVector
 
+logger = logging.getLogger(__name__)
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+
+DISTANCE_OPERATORS = {
+    DistanceStrategy.COSINE: "<=>",
+    DistanceStrategy.EUCLIDEAN: "<->",
+    DistanceStrategy.MAX_INNER_PRODUCT: "<#>",
+}
+
+ANN_OPERATOR_CLASSES = {
+    DistanceStrategy.COSINE: "vector_cosine_ops",
+    DistanceStrategy.EUCLIDEAN: "vector_l2_ops",
+    DistanceStrategy.MAX_INNER_PRODUCT: "vector_ip_ops",
+}
+
+# How each embedding storage mode is searched: the expression an ANN index is built on (and
+# queries order by), with `{dimensions}` filled in. "binary" keeps full-precision vectors and only
+# indexes their sign bits, so its nearest candidates are re-ranked by exact distance.
+EMBEDDING_STORAGE = {
+    "vector": "embedding::vector({dimensions})",
+    "halfvec": "embedding::halfvec({dimensions})",
+    "binary": "binary_quantize(embedding)::bit({dimensions})",
+}
+
+# Query-time knob of each ANN index type
+ANN_SEARCH_SETTINGS = {"hnsw": "hnsw.ef_search", "ivfflat": "ivfflat.probes"}
+
+# Metadata keys that are also stored as indexed columns (see `ensure_metadata_columns`), with their types
+METADATA_COLUMNS = {"file_id": "TEXT", "user_id": "TEXT", "chunk_index": "INTEGER"}
+
+_METADATA_FIELD = re.compile(r"^[A-Za-z0-9_]+$")
+
+# (custom_id, document, cmetadata, embedding)
+EmbeddingRow = Tuple[str, str, dict, List[float]]
+
+
+class ChunkChanges(NamedTuple):
+    """Changes to stored rows applied together with a bulk insert (see `acopy_embeddings`)."""
+
+    # Row uuids to delete
+    delete: List[str]
+    # New `cmetadata` of kept rows, by row uuid
+    metadata: Dict[str, dict]
+
+
+def _load_metadata(value) -> dict:
+    # `cmetadata` is a JSON column, which asyncpg returns as text
+    if value is None:
+        return {}
+    return json.loads(value) if isinstance(value, str) else value
+
 
 class AsyncPgVector(ExtendedPgVector):
-    def __init__(self, *args, **kwargs):
+    """
+    pgvector store whose async methods run directly on the shared asyncpg pool.
+
+    Vectors are sent and received in pgvector's binary format (the codec is registered on every
+    pool connection, see `PSQLDatabase`), and queries are parameterized so asyncpg prepares them
+    once per connection and reuses them from its statement cache. The SQLAlchemy-based sync
+    methods inherited from `ExtendedPgVector` are still used to create the schema, and as a
+    thread-pool fallback for metadata filters that are not translated to SQL here.
+    """
+
+    # See `configure_embedding_storage`
+    embedding_storage = "vector"
+    rerank_factor = 10
+
+    def __init__(self, *args, copy_batch_size: int = 1000, **kwargs):
         super().__init__(*args, **kwargs)
+        self.copy_batch_size = copy_batch_size
+        self.ann_index: Optional[str] = None
+        self.ann_dimensions: Optional[int] = None
+        self.ann_search_default: Optional[int] = None
+        self.ann_iterative_scan = False
+        self.text_search_config: Optional[str] = None
         self._thread_pool = None
+        self._collection_uuid = None
+
+    @property
+    def distance_strategy_type(self) -> DistanceStrategy:
+        # `distance_strategy` (from PGVector) returns the SQLAlchemy comparator instead
+        return self._distance_strategy
+
+    @property
+    def ann_operator_class(self) -> str:
+        """pgvector operator class an ANN index needs to serve this store's distance strategy and storage."""
+        if self.embedding_storage == "binary":
+            return "bit_hamming_ops"
+        operator_class = ANN_OPERATOR_CLASSES[self._distance_strategy]
+        if self.embedding_storage == "halfvec":
+            return operator_class.replace("vector_", "halfvec_", 1)
+        return operator_class
+
+    def configure_embedding_storage(self, storage: str, rerank_factor: int = 10):
+        """
+        Search embeddings stored as `storage` (see `ensure_embedding_storage`).
+
+        "vector" and "halfvec" are searched by distance directly. "binary" orders by the Hamming
+        distance of the binary-quantized query and rows, then re-ranks the best
+        `k * rerank_factor` candidates by exact distance to their full-precision embeddings.
+        """
+        if storage not in EMBEDDING_STORAGE:
+            raise ValueError(f"Unsupported embedding storage: {storage}. Choose one of {', '.join(EMBEDDING_STORAGE)}.")
+        self.embedding_storage = storage
+        self.rerank_factor = max(1, rerank_factor)
+
+    def configure_ann_search(
+        self,
+        index_type: Optional[str],
+        dimensions: Optional[int],
+        default: Optional[int] = None,
+        iterative_scan: bool = False,
+    ):
+        """
+        Make searches use the ANN index managed by `ensure_ann_index`.
+
+        The embedding column has no declared dimension, so the index is built on an expression
+        such as `embedding::vector(dimensions)` (see `EMBEDDING_STORAGE`); queries must use the
+        same expression to be able to use it.
+        `default` is the `hnsw.ef_search` / `ivfflat.probes` value used when a request sets none.
+        With `iterative_scan` (pgvector 0.8+), filtered searches keep scanning the index until
+        `k` rows match the filter instead of returning fewer results.
+        """
+        if index_type and dimensions:
+            self.ann_index, self.ann_dimensions, self.ann_search_default = index_type, dimensions, default
+            self.ann_iterative_scan = iterative_scan
+        else:
+            self.ann_index, self.ann_dimensions, self.ann_search_default = None, None, None
+            self.ann_iterative_scan = False
 
     def _get_thread_pool(self):
         if self._thread_pool is None:
@@ -23,32 +157,474 @@ class AsyncPgVector(ExtendedPgVector):
                 pass
         return self._thread_pool
 
+    @staticmethod
+    async def _get_pool():
+        from app.services.database import PSQLDatabase
+
+        return await PSQLDatabase.get_pool()
+
+    async def _get_collection_uuid(self, conn) -> uuid.UUID:
+        if self._collection_uuid is None:
+            self._collection_uuid = await conn.fetchval(
+                f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = $1", self.collection_name
+            )
+            if self._collection_uuid is None:
+                raise ValueError("Collection not found")
+        return self._collection_uuid
+
+    @staticmethod
+    def _filter_clause(filter: Optional[Dict[str, Any]], first_param: int) -> Optional[Tuple[str, list]]:
+        """
+        Translate equality / `$in` metadata filters (the shapes the routes use) into SQL.
+        Text keys in `METADATA_COLUMNS` are matched on their indexed columns.
+
+        Returns None for anything else, so the caller can fall back to LangChain's filter support.
+        """
+        clauses, params = [], []
+        for field, condition in (filter or {}).items():
+            if not _METADATA_FIELD.match(field):
+                return None
+            if isinstance(condition, dict):
+                if len(condition) != 1:
+                    return None
+                operator, value = next(iter(condition.items()))
+            else:
+                operator, value = "$eq", condition
+
+            param = f"${first_param + len(params)}"
+            column = field if METADATA_COLUMNS.get(field) == "TEXT" else f"cmetadata->>'{field}'"
+            if operator == "$eq" and isinstance(value, str):
+                clauses.append(f"{column} = {param}")
+            elif operator == "$in" and all(isinstance(item, str) for item in value):
+                clauses.append(f"{column} = ANY({param}::text[])")
+                value = list(value)
+            else:
+                return None
+            params.append(value)
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    @traced("vector_store.get_all_ids")
     async def get_all_ids(self, executor=None) -> list[str]:
-        executor = executor or self._get_thread_pool()
-        return await run_in_executor(executor, super().get_all_ids)
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(f"SELECT DISTINCT custom_id FROM {EMBEDDING_TABLE} WHERE custom_id IS NOT NULL")
+        return [record["custom_id"] for record in records]
 
+    @traced("vector_store.get_filtered_ids")
     async def get_filtered_ids(self, ids: list[str], executor=None) -> list[str]:
-        executor = executor or self._get_thread_pool()
-        return await run_in_executor(executor, super().get_filtered_ids, ids)
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(
+                f"SELECT DISTINCT custom_id FROM {EMBEDDING_TABLE} WHERE custom_id = ANY($1::text[])", ids
+            )
+        return [record["custom_id"] for record in records]
 
+    @traced("vector_store.get_documents_by_ids")
     async def get_documents_by_ids(self, ids: list[str], executor=None) -> list[Document]:
-        executor = executor or self._get_thread_pool()
-        return await run_in_executor(executor, super().get_documents_by_ids, ids)
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(
+                f"""
+                SELECT document, cmetadata FROM {EMBEDDING_TABLE}
+                WHERE custom_id = ANY($1::text[]) ORDER BY custom_id, chunk_index, ctid
+                """,
+                ids,
+            )
+        return [
+            Document(page_content=record["document"], metadata=_load_metadata(record["cmetadata"])) for record in records
+        ]
 
+    async def aiter_documents(self, file_id: str, prefetch: int = 200) -> AsyncIterator[Document]:
+        """
+        Stream a file's chunks in reading order through a server-side cursor, fetching
+        `prefetch` rows at a time. The connection is held until iteration ends. Chunks stored
+        before `chunk_index` existed come last, in the order they were stored.
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            # Cursors only live inside a transaction
+            async with conn.transaction():
+                async for record in conn.cursor(
+                    f"""
+                    SELECT document, cmetadata FROM {EMBEDDING_TABLE}
+                    WHERE file_id = $1 ORDER BY chunk_index, ctid
+                    """,
+                    file_id,
+                    prefetch=prefetch,
+                ):
+                    yield Document(page_content=record["document"], metadata=_load_metadata(record["cmetadata"]))
+
+    @traced("vector_store.delete")
     async def delete(self, ids: Optional[list[str]] = None, collection_only: bool = False, executor=None) -> None:
-        executor = executor or self._get_thread_pool()
-        await run_in_executor(executor, self._delete_multiple, ids, collection_only)
+        if ids is None:
+            return
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            if collection_only:
+                await conn.execute(
+                    f"DELETE FROM {EMBEDDING_TABLE} WHERE custom_id = ANY($1::text[]) AND collection_id = $2",
+                    ids,
+                    await self._get_collection_uuid(conn),
+                )
+            else:
+                await conn.execute(f"DELETE FROM {EMBEDDING_TABLE} WHERE custom_id = ANY($1::text[])", ids)
+
+    @traced("vector_store.get_file_embeddings")
+    async def aget_file_embeddings(self, file_id: str) -> List[dict]:
+        """All chunks of a file with their embeddings, as `document`, `cmetadata`, `embedding` dicts."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(
+                f"""
+                SELECT document, cmetadata, embedding FROM {EMBEDDING_TABLE}
+                WHERE collection_id = $1 AND file_id = $2
+                """,
+                await self._get_collection_uuid(conn),
+                file_id,
+            )
+        return [
+            {"document": record["document"], "cmetadata": _load_metadata(record["cmetadata"]), "embedding": record["embedding"]}
+            for record in records
+        ]
+
+    @traced("vector_store.get_file_chunks")
+    async def aget_file_chunks(self, file_id: str) -> List[Tuple[str, dict]]:
+        """`(uuid, cmetadata)` of a file's stored chunks in reading order, without documents or embeddings."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            records = await conn.fetch(
+                f"""
+                SELECT uuid::text AS uuid, cmetadata FROM {EMBEDDING_TABLE}
+                WHERE collection_id = $1 AND file_id = $2 ORDER BY chunk_index, ctid
+                """,
+                await self._get_collection_uuid(conn),
+                file_id,
+            )
+        return [(record["uuid"], _load_metadata(record["cmetadata"])) for record in records]
+
+    def _nearest(
+        self,
+        columns: str,
+        filter_sql: str,
+        filtered: bool,
+        limit: str,
+        rows: int,
+        ef_search: Optional[int],
+        probes: Optional[int],
+    ) -> Tuple[str, List[Tuple[str, str]]]:
+        """
+        `(query, search_settings)` for the `limit` rows nearest to `$1` in collection `$2`: a query
+        selecting `columns` and their `distance`, sorted by it, written so the configured ANN
+        index can serve it, and the index settings to apply while it runs. `limit` is the query
+        parameter holding `rows`.
+        """
+        operator = DISTANCE_OPERATORS[self._distance_strategy]
+        search_settings = []
+        resort = False
+        if self.ann_index:
+            value = {"hnsw": ef_search, "ivfflat": probes}[self.ann_index] or self.ann_search_default
+            if self.ann_index == "hnsw" and self.embedding_storage == "binary":
+                # HNSW returns at most ef_search rows, which must cover the candidates to re-rank (max 1000)
+                value = min(max(value or 40, rows * self.rerank_factor), 1000)
+            if value:
+                search_settings.append((ANN_SEARCH_SETTINGS[self.ann_index], str(value)))
+            if filtered and self.ann_iterative_scan:
+                # IVFFlat only supports relaxed ordering, so its results are sorted again
+                resort = self.ann_index == "ivfflat"
+                search_settings.append(
+                    (f"{self.ann_index}.iterative_scan", "relaxed_order" if resort else "strict_order")
+                )
+            # Same predicate as the partial index, which also skips rows of other dimensions
+            filter_sql = f" AND vector_dims(embedding) = {self.ann_dimensions}{filter_sql}"
+            indexed = "(" + EMBEDDING_STORAGE[self.embedding_storage].format(dimensions=self.ann_dimensions) + ")"
+        elif self.embedding_storage == "binary":
+            # Bit strings of different lengths can't be compared
+            filter_sql = f" AND vector_dims(embedding) = vector_dims($1::vector){filter_sql}"
+            indexed = "binary_quantize(embedding)"
+        else:
+            indexed = "embedding"
+
+        if self.embedding_storage == "binary":
+            # The outer sort re-ranks the candidates, so relaxed index order is fine here too
+            query = f"""
+                SELECT {columns}, embedding {operator} $1 AS distance
+                FROM (
+                    SELECT {columns}, embedding
+                    FROM {EMBEDDING_TABLE}
+                    WHERE collection_id = $2{filter_sql}
+                    ORDER BY {indexed} <~> binary_quantize($1::vector)
+                    LIMIT {limit} * {self.rerank_factor}
+                ) candidates
+                ORDER BY distance
+                LIMIT {limit}
+                """
+            return query, search_settings
 
+        query = f"""
+            SELECT {columns}, {indexed} {operator} $1 AS distance
+            FROM {EMBEDDING_TABLE}
+            WHERE collection_id = $2{filter_sql}
+            ORDER BY distance
+            LIMIT {limit}
+            """
+        if resort:
+            query = f"WITH results AS MATERIALIZED ({query}) SELECT * FROM results ORDER BY distance"
+        return query, search_settings
+
+    async def _fetch_search(self, query: str, args: list, search_settings: List[Tuple[str, str]]):
+        """Run a search query whose second parameter is the collection uuid, with the given index settings."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            args[1] = await self._get_collection_uuid(conn)
+            if not search_settings:
+                return await conn.fetch(query, *args)
+            # set_config(..., true) only lasts until the end of the transaction
+            async with conn.transaction():
+                await conn.execute(
+                    "SELECT "
+                    + ", ".join(
+                        f"set_config(${index * 2 + 1}, ${index * 2 + 2}, true)" for index in range(len(search_settings))
+                    ),
+                    *(item for setting in search_settings for item in setting),
+                )
+                return await conn.fetch(query, *args)
+
+    @traced("vector_store.similarity_search")
     async def asimilarity_search_with_score_by_vector(
-        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, executor=None
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        executor=None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Async version of similarity_search_with_score_by_vector
+
+        `ef_search` / `probes` override the search breadth of the HNSW / IVFFlat index for this
+        query only; they are ignored unless the matching index is configured. Filters that can't
+        be translated to SQL go through LangChain's search, which binds the query as `vector` and
+        so can't compare it with `halfvec` embeddings; they are refused in that mode.
+        """
+        translated = self._filter_clause(filter, first_param=4)
+        if translated is None:
+            if self.embedding_storage == "halfvec":
+                raise ValueError(
+                    f"Unsupported filter for embeddings stored as halfvec: {filter}. "
+                    "Only equality and $in filters on metadata fields can be searched."
+                )
+            executor = executor or self._get_thread_pool()
+            return await run_in_executor(executor, super().similarity_search_with_score_by_vector, embedding, k, filter)
+
+        filter_sql, filter_params = translated
+        query, search_settings = self._nearest(
+            "document, cmetadata", filter_sql, bool(filter_params), "$3", k, ef_search, probes
+        )
+        records = await self._fetch_search(query, [embedding, None, k, *filter_params], search_settings)
+        return [
+            (Document(page_content=record["document"], metadata=_load_metadata(record["cmetadata"])), record["distance"])
+            for record in records
+        ]
+
+    def configure_text_search(self, config: Optional[str]):
+        """Enable hybrid searches on the `document_tsv` column built by `ensure_text_search_column` with `config`."""
+        self.text_search_config = config
+
+    @traced("vector_store.hybrid_search")
+    async def ahybrid_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        candidates: int = 40,
+        rrf_k: int = 60,
+        executor=None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
     ) -> List[Tuple[Document, float]]:
-        """Async version of similarity_search_with_score_by_vector"""
-        executor = executor or self._get_thread_pool()
-        return await run_in_executor(executor, super().similarity_search_with_score_by_vector, embedding, k, filter)
+        """
+        Top `k` chunks by reciprocal rank fusion of a vector search and a full-text search for `query`.
+
+        Each search returns its best `candidates` chunks; a chunk scores `1 / (rrf_k + rank)` in
+        each list it appears in, and the sums decide the order. Both searches and the fusion run
+        in one SQL statement. Query words are OR-ed, so chunks containing exact identifiers rank
+        high lexically even when the rest of the question doesn't match. Scores returned are the
+        vector distances, as for `asimilarity_search_with_score_by_vector`. Without text search
+        configured, or with a filter not translated to SQL, this is a plain vector search.
+        """
+        translated = self._filter_clause(filter, first_param=8)
+        if not getattr(self, "text_search_config", None) or translated is None:
+            return await self.asimilarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, executor=executor, ef_search=ef_search, probes=probes
+            )
+
+        filter_sql, filter_params = translated
+        candidates = max(candidates, k)
+        nearest_sql, search_settings = self._nearest(
+            "uuid", filter_sql, bool(filter_params), "$4", candidates, ef_search, probes
+        )
+        operator = DISTANCE_OPERATORS[self._distance_strategy]
+        # Ranks are assigned with row_number() over the distance, so relaxed index order is fine here
+        sql = f"""
+            WITH vector AS MATERIALIZED (
+                SELECT uuid, row_number() OVER (ORDER BY distance) AS rank
+                FROM ({nearest_sql}) nearest
+            ),
+            lexical AS MATERIALIZED (
+                SELECT uuid, row_number() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT uuid, ts_rank_cd(document_tsv, terms, 1) AS score
+                    FROM {EMBEDDING_TABLE}
+                    CROSS JOIN (
+                        SELECT replace(plainto_tsquery($6::text::regconfig, $5)::text, '&', '|')::tsquery AS terms
+                    ) q
+                    WHERE collection_id = $2{filter_sql} AND document_tsv @@ terms
+                    ORDER BY score DESC
+                    LIMIT $4
+                ) matches
+            ),
+            fused AS (
+                SELECT coalesce(vector.uuid, lexical.uuid) AS uuid,
+                    coalesce(1.0 / ($3 + vector.rank), 0) + coalesce(1.0 / ($3 + lexical.rank), 0) AS score
+                FROM vector FULL OUTER JOIN lexical ON vector.uuid = lexical.uuid
+                ORDER BY score DESC
+                LIMIT $7
+            )
+            SELECT e.document, e.cmetadata, e.embedding {operator} $1 AS distance
+            FROM fused JOIN {EMBEDDING_TABLE} e ON e.uuid = fused.uuid
+            ORDER BY fused.score DESC, distance
+            """
+        args = [embedding, None, rrf_k, candidates, query, self.text_search_config, k, *filter_params]
+        records = await self._fetch_search(sql, args, search_settings)
+        return [
+            (Document(page_content=record["document"], metadata=_load_metadata(record["cmetadata"])), record["distance"])
+            for record in records
+        ]
+
+    @traced("vector_store.copy_embeddings")
+    async def acopy_embeddings(
+        self,
+        rows: Union[Iterable[EmbeddingRow], AsyncIterable[EmbeddingRow]],
+        batch_size: Optional[int] = None,
+        changes: Optional[Callable[[], ChunkChanges]] = None,
+    ) -> int:
+        """
+        Bulk insert `(custom_id, document, cmetadata, embedding)` rows with binary `COPY`.
+
+        Rows are buffered `batch_size` (default `copy_batch_size`) at a time, and each batch is
+        copied in its own short transaction, on a pooled connection held only for that copy and
+        counted against the ingestion slots (see `ingestion_slot`). `rows` may be an async
+        iterable, which lets callers stream rows while they are still being embedded without
+        holding a connection meanwhile. If given, `changes()` is called once all rows are read,
+        and the stored rows it lists are deleted or updated in the transaction of the last batch.
+        If anything fails, the rows copied so far are deleted again; until the last batch
+        commits, readers may see part of the new rows (next to the old ones, for an update).
+        """
+        from app.services.database import ingestion_slot
+
+        batch_size = batch_size or self.copy_batch_size
+        columns = ("uuid", "collection_id", "embedding", "document", "cmetadata", "custom_id")
+        copied: List[uuid.UUID] = []
+        batch = []
+        started = time.perf_counter()
+        pool = await self._get_pool()
+
+        async def copy_batch(last: bool = False):
+            if not batch and not (last and changes is not None):
+                return
+            async with ingestion_slot(), pool.acquire() as conn:
+                collection_uuid = await self._get_collection_uuid(conn)
+                async with conn.transaction():
+                    if batch:
+                        records = [
+                            (row_uuid, collection_uuid, embedding, document, metadata, custom_id)
+                            for row_uuid, embedding, document, metadata, custom_id in batch
+                        ]
+                        await conn.copy_records_to_table(EMBEDDING_TABLE, records=records, columns=columns)
+                    if last and changes is not None:
+                        await self._apply_changes(conn, changes())
+            copied.extend(row[0] for row in batch)
+            batch.clear()
+
+        async def add(row: EmbeddingRow):
+            custom_id, document, metadata, embedding = row
+            batch.append((uuid.uuid4(), embedding, document, json.dumps(metadata), custom_id))
+            if len(batch) >= batch_size:
+                await copy_batch()
+
+        try:
+            if isinstance(rows, AsyncIterable):
+                async for row in rows:
+                    await add(row)
+            else:
+                for row in rows:
+                    await add(row)
+            await copy_batch(last=True)
+        except BaseException:
+            if copied:
+                await self._delete_copied_rows(copied)
+            raise
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "Copied %d rows into %s in %.2fs (%.0f rows/s)",
+            len(copied),
+            EMBEDDING_TABLE,
+            elapsed,
+            len(copied) / elapsed if elapsed else 0.0,
+        )
+        return len(copied)
+
+    async def _delete_copied_rows(self, row_uuids: List[uuid.UUID]) -> None:
+        """Roll back a failed bulk insert by deleting the rows its committed batches copied."""
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                await conn.execute(f"DELETE FROM {EMBEDDING_TABLE} WHERE uuid = ANY($1::uuid[])", row_uuids)
+        except Exception as e:
+            logger.error("Failed to remove %d rows of a failed bulk insert | Error: %s", len(row_uuids), str(e))
+
+    @staticmethod
+    async def _apply_changes(conn, chunk_changes: ChunkChanges) -> None:
+        if chunk_changes.delete:
+            await conn.execute(f"DELETE FROM {EMBEDDING_TABLE} WHERE uuid = ANY($1::uuid[])", chunk_changes.delete)
+        if chunk_changes.metadata:
+            await conn.execute(
+                f"""
+                UPDATE {EMBEDDING_TABLE} AS e SET cmetadata = changed.cmetadata::json
+                FROM unnest($1::uuid[], $2::text[]) AS changed(uuid, cmetadata)
+                WHERE e.uuid = changed.uuid
+                """,
+                list(chunk_changes.metadata),
+                [json.dumps(metadata) for metadata in chunk_changes.metadata.values()],
+            )
+
+    async def aadd_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        executor=None,
+        **kwargs,
+    ) -> List[str]:
+        """Async version of add_embeddings, for callers that embed the texts themselves"""
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+        if not metadatas:
+            metadatas = [{} for _ in texts]
+
+        await self.acopy_embeddings(zip(ids, texts, metadatas, embeddings))
+        return ids
 
     async def aadd_documents(
         self, documents: List[Document], ids: Optional[List[str]] = None, executor=None, **kwargs
     ) -> List[str]:
         """Async version of add_documents"""
-        executor = executor or self._get_thread_pool()
-        return await run_in_executor(executor, super().add_documents, documents, ids=ids, **kwargs)
+        texts = [document.page_content for document in documents]
+        embeddings = await self.embedding_function.aembed_documents(texts)
+        return await self.aadd_embeddings(
+            texts, embeddings, metadatas=[document.metadata for document in documents], ids=ids, **kwargs
+        )
@@ -14,6 +14,7 @@ def get_vector_store(
     collection_name: str,
     mode: str = "sync",
     search_index: Optional[str] = None,
+    copy_batch_size: int = 1000,
 ):
     if mode == "sync":
         return ExtendedPgVector(
@@ -26,6 +27,7 @@ def get_vector_store(
             connection_string=connection_string,
             embedding_function=embeddings,
             collection_name=collection_name,
+            copy_batch_size=copy_batch_size,
         )
     elif mode == "atlas-mongo":
         mongo_db = MongoClient(connection_string).get_database()
@@ -1,9 +1,11 @@
 # app/utils/document_loader.py
 
 import codecs
+import itertools
 import os
 import tempfile
-from typing import List, Optional
+from collections import deque
+from typing import Iterator, List, Optional
 
 import chardet
 from langchain_community.document_loaders import (
@@ -20,7 +22,16 @@ from langchain_community.document_loaders import (
 )
 from langchain_core.documents import Document
 
-from app.config import CHUNK_OVERLAP, PDF_EXTRACT_IMAGES, known_source_ext, logger
+from app.config import (
+    CHUNK_OVERLAP,
+    PDF_EXTRACT_IMAGES,
+    RAG_PDF_PAGES_PER_SHARD,
+    RAG_PDF_PARALLEL_MIN_PAGES,
+    RAG_PDF_WORKERS,
+    known_source_ext,
+    logger,
+)
+from app.utils.pdf_pages import extract_page_range, get_process_pool, page_count
 
 
 def detect_file_encoding(filepath: str) -> str:
@@ -30,7 +41,11 @@ def detect_file_encoding(filepath: str) -> str:
     """
     with open(filepath, "rb") as f:
         raw = f.read(4096)  # Read a larger sample for better detection
+    return detect_encoding(raw)
+
 
+def detect_encoding(raw: bytes) -> str:
+    """Encoding of the bytes from their BOM marker, else from chardet on their first 4 KB; 'utf-8' by default."""
     # Check for BOM markers first
     if raw.startswith(codecs.BOM_UTF16_LE):
         return "utf-16-le"
@@ -46,7 +61,7 @@ def detect_file_encoding(filepath: str) -> str:
         return "utf-32-be"
 
     # Use chardet to detect encoding if no BOM is found
-    result = chardet.detect(raw)
+    result = chardet.detect(raw[:4096])
     encoding = result.get("encoding")
     if encoding:
         return encoding.lower()
@@ -54,6 +69,27 @@ def detect_file_encoding(filepath: str) -> str:
     return "utf-8"
 
 
+class BufferTextLoader:
+    """
+    `TextLoader` for a file whose bytes are already in memory: decoded as UTF-8, else with the
+    encoding `detect_encoding` finds. `source` is reported as the document's source.
+    """
+
+    def __init__(self, buffer: bytes, source: str):
+        self.buffer = buffer
+        self.source = source
+
+    def load(self) -> List[Document]:
+        return list(self.lazy_load())
+
+    def lazy_load(self) -> Iterator[Document]:
+        try:
+            text = str(self.buffer, "utf-8")
+        except UnicodeDecodeError:
+            text = str(self.buffer, detect_encoding(self.buffer), errors="replace")
+        yield Document(page_content=text, metadata={"source": self.source})
+
+
 def cleanup_temp_encoding_file(loader) -> None:
     """
     Clean up temporary UTF-8 file if it was created for encoding conversion.
@@ -67,16 +103,76 @@ def cleanup_temp_encoding_file(loader) -> None:
             logger.warning(f"Failed to remove temporary UTF-8 file: {e}")
 
 
-def get_loader(filename: str, file_content_type: str, filepath: str):
-    """Get the appropriate document loader based on file type and/or content type."""
+# Loader kinds `get_loader` reads as plain text, which it can also decode from a buffer in memory
+TEXT_LOADER_KINDS = ("json", "text", "unknown")
+
+
+def loader_kind(filename: str, file_content_type: str) -> str:
+    """The kind of loader `get_loader` picks, based on file type and/or content type."""
     file_ext = filename.split(".")[-1].lower()
-    known_type = True
 
     # File Content Type reference:
     # ref.: https://developer.mozilla.org/en-US/docs/Web/HTTP/Guides/MIME_types/Common_types
     if file_ext == "pdf" or file_content_type == "application/pdf":
-        loader = SafePyPDFLoader(filepath, extract_images=PDF_EXTRACT_IMAGES)
+        return "pdf"
     elif file_ext == "csv" or file_content_type == "text/csv":
+        return "csv"
+    elif file_ext == "rst":
+        return "rst"
+    elif file_ext == "xml" or file_content_type in [
+        "application/xml",
+        "text/xml",
+        "application/xhtml+xml",
+    ]:
+        return "xml"
+    elif file_ext in ["ppt", "pptx"] or file_content_type in [
+        "application/vnd.ms-powerpoint",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ]:
+        return "ppt"
+    elif file_ext == "md" or file_content_type in [
+        "text/markdown",
+        "text/x-markdown",
+        "application/markdown",
+        "application/x-markdown",
+    ]:
+        return "md"
+    elif file_ext == "epub" or file_content_type == "application/epub+zip":
+        return "epub"
+    elif file_ext in ["doc", "docx"] or file_content_type in [
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ]:
+        return "docx"
+    elif file_ext in ["xls", "xlsx"] or file_content_type in [
+        "application/vnd.ms-excel",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ]:
+        return "excel"
+    elif file_ext == "json" or file_content_type == "application/json":
+        return "json"
+    elif file_ext in known_source_ext or (file_content_type and file_content_type.find("text/") >= 0):
+        return "text"
+    return "unknown"
+
+
+def get_loader(filename: str, file_content_type: str, filepath: str, buffer: Optional[bytes] = None):
+    """
+    Get the appropriate document loader based on file type and/or content type.
+
+    With `buffer`, the file's bytes in memory, plain text types (`TEXT_LOADER_KINDS`) are decoded
+    from it and `filepath` is only reported as their source; other types are read from `filepath`.
+    """
+    file_ext = filename.split(".")[-1].lower()
+    kind = loader_kind(filename, file_content_type)
+    known_type = kind != "unknown"
+
+    if kind == "pdf":
+        if RAG_PDF_WORKERS > 1 and safe_page_count(filepath) >= RAG_PDF_PARALLEL_MIN_PAGES:
+            loader = ParallelPdfLoader(filepath, extract_images=PDF_EXTRACT_IMAGES)
+        else:
+            loader = SafePyPDFLoader(filepath, extract_images=PDF_EXTRACT_IMAGES)
+    elif kind == "csv":
         # Detect encoding for CSV files
         encoding = detect_file_encoding(filepath)
 
@@ -105,45 +201,24 @@ def get_loader(filename: str, file_content_type: str, filepath: str):
                 raise e
         else:
             loader = CSVLoader(filepath)
-    elif file_ext == "rst":
+    elif kind == "rst":
         loader = UnstructuredRSTLoader(filepath, mode="elements")
-    elif file_ext == "xml" or file_content_type in [
-        "application/xml",
-        "text/xml",
-        "application/xhtml+xml",
-    ]:
+    elif kind == "xml":
         loader = UnstructuredXMLLoader(filepath)
-    elif file_ext in ["ppt", "pptx"] or file_content_type in [
-        "application/vnd.ms-powerpoint",
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-    ]:
+    elif kind == "ppt":
         loader = UnstructuredPowerPointLoader(filepath)
-    elif file_ext == "md" or file_content_type in [
-        "text/markdown",
-        "text/x-markdown",
-        "application/markdown",
-        "application/x-markdown",
-    ]:
+    elif kind == "md":
         loader = UnstructuredMarkdownLoader(filepath)
-    elif file_ext == "epub" or file_content_type == "application/epub+zip":
+    elif kind == "epub":
         loader = UnstructuredEPubLoader(filepath)
-    elif file_ext in ["doc", "docx"] or file_content_type in [
-        "application/msword",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    ]:
+    elif kind == "docx":
         loader = Docx2txtLoader(filepath)
-    elif file_ext in ["xls", "xlsx"] or file_content_type in [
-        "application/vnd.ms-excel",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    ]:
+    elif kind == "excel":
         loader = UnstructuredExcelLoader(filepath)
-    elif file_ext == "json" or file_content_type == "application/json":
-        loader = TextLoader(filepath, autodetect_encoding=True)
-    elif file_ext in known_source_ext or (file_content_type and file_content_type.find("text/") >= 0):
-        loader = TextLoader(filepath, autodetect_encoding=True)
+    elif buffer is not None:
+        loader = BufferTextLoader(buffer, filepath)
     else:
         loader = TextLoader(filepath, autodetect_encoding=True)
-        known_type = False
 
     return loader, known_type, file_ext
 
@@ -183,31 +258,83 @@ def remove_non_utf8(text: str) -> str:
         return text
 
 
-def process_documents(documents: List[Document]) -> str:
-    processed_text = ""
-    last_page: Optional[int] = None
-    doc_basename = ""
+def chunk_overlap(previous: Optional[dict], metadata: dict) -> Optional[int]:
+    """
+    How many leading characters of a chunk repeat the end of the previous one, from the
+    `start_index` / `end_index` offsets stored at ingestion. None when either chunk lacks them.
+    """
+    if previous is None:
+        return None
+    previous_end, start = previous.get("end_index"), metadata.get("start_index")
+    if not isinstance(previous_end, int) or not isinstance(start, int):
+        return None
+    if previous.get("file_id") != metadata.get("file_id"):
+        return None
+    return max(0, previous_end - start)
 
-    for doc in documents:
-        if "source" in doc.metadata:
-            doc_basename = doc.metadata["source"].split("/")[-1]
-            break
 
-    processed_text += f"{doc_basename}\n"
+class DocumentTextAssembler:
+    """
+    Incremental form of `process_documents`: feed chunks in order and get back the text to append.
 
-    for doc in documents:
+    Chunks with stored offsets (see `chunk_overlap`) have their overlap cut exactly; for older
+    chunks only the last `overlap` characters are kept to detect it. Trailing whitespace is held
+    back until more text follows, so the concatenated output equals `process_documents`
+    (including its final `strip()`) without building the whole string.
+    """
+
+    def __init__(self, overlap: int = CHUNK_OVERLAP):
+        self.overlap = overlap
+        self._tail = ""
+        self._pending_whitespace = ""
+        self._started = False
+        self._last_page: Optional[int] = None
+        self._last_metadata: Optional[dict] = None
+
+    def _emit(self, text: str) -> str:
+        self._tail = (self._tail + text)[-self.overlap :] if self.overlap else ""
+        text = self._pending_whitespace + text
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        stripped = text.rstrip()
+        self._pending_whitespace = text[len(stripped) :]
+        return stripped
+
+    def start(self, basename: str) -> str:
+        return self._emit(f"{basename}\n")
+
+    def add(self, doc: Document) -> str:
+        pieces = []
         current_page = doc.metadata.get("page")
-        if current_page and current_page != last_page:
-            processed_text += f"\n# PAGE {doc.metadata['page']}\n\n"
-            last_page = current_page
+        if current_page and current_page != self._last_page:
+            pieces.append(self._emit(f"\n# PAGE {doc.metadata['page']}\n\n"))
+            self._last_page = current_page
 
         new_content = doc.page_content
-        if processed_text.endswith(new_content[:CHUNK_OVERLAP]):
-            processed_text += new_content[CHUNK_OVERLAP:]
+        exact_overlap = chunk_overlap(self._last_metadata, doc.metadata)
+        self._last_metadata = doc.metadata
+        if exact_overlap is not None:
+            pieces.append(self._emit(new_content[exact_overlap:]))
+        elif self._tail.endswith(new_content[: self.overlap]):
+            pieces.append(self._emit(new_content[self.overlap :]))
         else:
-            processed_text += new_content
+            pieces.append(self._emit(new_content))
+        return "".join(pieces)
+
 
-    return processed_text.strip()
+def process_documents(documents: List[Document]) -> str:
+    doc_basename = ""
+
+    for doc in documents:
+        if "source" in doc.metadata:
+            doc_basename = doc.metadata["source"].split("/")[-1]
+            break
+
+    assembler = DocumentTextAssembler()
+    pieces = [assembler.start(doc_basename)]
+    pieces.extend(assembler.add(doc) for doc in documents)
+    return "".join(pieces)
 
 
 class SafePyPDFLoader:
@@ -242,3 +369,94 @@ class SafePyPDFLoader:
             else:
                 # Re-raise if it's a different error
                 raise
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield PDF pages one at a time, with the same image extraction fallback as `load`."""
+        loader = PyPDFLoader(self.filepath, extract_images=self.extract_images)
+        pages_yielded = 0
+
+        try:
+            for page in loader.lazy_load():
+                pages_yielded += 1
+                yield page
+        except KeyError as e:
+            if "/Filter" in str(e) and self.extract_images:
+                logger.warning(f"PDF image extraction failed for {self.filepath}, falling back to text-only: {e}")
+                fallback_loader = PyPDFLoader(self.filepath, extract_images=False)
+                # Skip the pages that were already produced before the failure
+                for index, page in enumerate(fallback_loader.lazy_load()):
+                    if index >= pages_yielded:
+                        yield page
+            else:
+                # Re-raise if it's a different error
+                raise
+
+
+def safe_page_count(filepath: str) -> int:
+    """Page count read with PyMuPDF, or 0 when it can't open the file (pypdf gets to try instead)."""
+    try:
+        return page_count(filepath)
+    except Exception as e:
+        logger.warning(f"Could not count the pages of {filepath}: {e}")
+        return 0
+
+
+class ParallelPdfLoader:
+    """
+    A PDF loader for large files that extracts pages with PyMuPDF in a process pool.
+
+    Pages are split into shards of `pages_per_shard` that run in parallel, with at most two
+    shards per worker in flight, and `lazy_load` yields pages in order as soon as their shard
+    is done. Like `SafePyPDFLoader`, pages whose images can't be extracted keep their text.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        extract_images: bool = False,
+        workers: int = RAG_PDF_WORKERS,
+        pages_per_shard: int = RAG_PDF_PAGES_PER_SHARD,
+    ):
+        self.filepath = filepath
+        self.extract_images = extract_images
+        self.workers = workers
+        self.pages_per_shard = pages_per_shard
+        self._temp_filepath = None  # For compatibility with cleanup function
+
+    def load(self) -> List[Document]:
+        return list(self.lazy_load())
+
+    def lazy_load(self) -> Iterator[Document]:
+        total_pages = page_count(self.filepath)
+        pool = get_process_pool(self.workers)
+        starts = iter(range(0, total_pages, self.pages_per_shard))
+        pending = deque()
+
+        def submit(start: int):
+            pending.append(
+                pool.submit(
+                    extract_page_range, self.filepath, start, start + self.pages_per_shard, self.extract_images
+                )
+            )
+
+        try:
+            for start in itertools.islice(starts, 2 * self.workers):
+                submit(start)
+            while pending:
+                pages = pending.popleft().result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    submit(next_start)
+                for number, text, error in pages:
+                    if error:
+                        logger.warning(
+                            f"PDF image extraction failed for {self.filepath} page {number + 1}, "
+                            f"falling back to text-only: {error}"
+                        )
+                    yield Document(
+                        page_content=text,
+                        metadata={"source": self.filepath, "page": number, "total_pages": total_pages},
+                    )
+        finally:
+            for future in pending:
+                future.cancel()
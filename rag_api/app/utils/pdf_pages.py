@@ -0,0 +1,72 @@
+# app/utils/pdf_pages.py
+"""
+PyMuPDF page extraction run in worker processes (see `ParallelPdfLoader`).
+
+Worker processes import this module on their own, so it must stay free of `app.config`
+and anything else that builds clients or connections at import time.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+# (page number, text, image extraction error)
+PageText = Tuple[int, str, Optional[str]]
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """The shared extraction pool, started on first use with `spawn` so workers don't inherit threads or sockets."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+
+
+def page_count(filepath: str) -> int:
+    import fitz  # PyMuPDF for PDF processing
+
+    with fitz.open(filepath) as pdf:
+        return pdf.page_count
+
+
+def _image_text(pdf, page) -> str:
+    """OCR text of a page's images, the way `PyPDFLoader(extract_images=True)` adds it."""
+    import fitz
+    import numpy as np
+    from langchain_community.document_loaders.parsers.pdf import extract_from_images_with_rapidocr
+
+    images = []
+    for xref, *_ in page.get_images():
+        pixmap = fitz.Pixmap(pdf, xref)
+        images.append(np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, -1))
+    return "\n" + extract_from_images_with_rapidocr(images) if images else ""
+
+
+def extract_page_range(filepath: str, start: int, stop: int, extract_images: bool = False) -> List[PageText]:
+    """
+    Text of pages `start` to `stop` (exclusive). A page whose images can't be extracted keeps
+    its text and reports the error, so the caller can log the fallback.
+    """
+    import fitz
+
+    pages = []
+    with fitz.open(filepath) as pdf:
+        for number in range(start, min(stop, pdf.page_count)):
+            page = pdf[number]
+            text = page.get_text()
+            error = None
+            if extract_images:
+                try:
+                    text += _image_text(pdf, page)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+            pages.append((number, text, error))
+    return pages
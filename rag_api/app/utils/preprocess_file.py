@@ -1,17 +1,177 @@
+import itertools
 import os
 import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterator, Optional, Tuple
 
-import pandas as pd
+import fitz  # PyMuPDF for PDF processing
 from markdown_html_pdf.tools import pdf_to_markdown
-from tabulate import tabulate
 
+from app.config import (
+    RAG_EXCEL_BLOCK_ROWS,
+    RAG_PDF_MIN_TEXT_CHARS,
+    RAG_PDF_TABLE_COVERAGE,
+    RAG_PDF_VISION_COST_PER_PAGE,
+    RAG_PDF_VISION_POLICY,
+    RAG_PDF_VISION_SECONDS_PER_PAGE,
+    logger,
+)
 
-def preprocess_pdf(pdf_path: str) -> tuple[str, str, str]:
+
+# Totais da política de páginas de PDF neste worker, reportados por `/stats`
+pdf_policy_stats = {
+    "files": 0,
+    "text_pages": 0,
+    "vision_pages": 0,
+    "estimated_seconds_saved": 0.0,
+    "estimated_cost_saved": 0.0,
+}
+# PDFs são pré-processados em paralelo nas threads do executor
+_pdf_policy_stats_lock = threading.Lock()
+
+
+def pdf_policy_snapshot() -> dict:
+    """Cópia consistente de `pdf_policy_stats`."""
+    with _pdf_policy_stats_lock:
+        return dict(pdf_policy_stats)
+
+
+@dataclass
+class PageDecision:
+    """Caminho escolhido para uma página de PDF e os sinais usados na decisão."""
+
+    page: int
+    route: str  # "text" ou "vision"
+    reason: str
+    text_chars: int
+    image_coverage: float
+    table_coverage: float
+    has_fonts: bool
+
+
+def _covered_fraction(rects, page_rect) -> float:
+    """Fração da página coberta pelos retângulos (sobreposições contam uma vez por retângulo, limitada a 1)."""
+    page_area = page_rect.get_area()
+    if not page_area:
+        return 0.0
+    covered = sum((fitz.Rect(rect) & page_rect).get_area() for rect in rects)
+    return min(covered / page_area, 1.0)
+
+
+def classify_pdf_page(page) -> PageDecision:
+    """
+    Classifica uma página do PyMuPDF entre extração nativa ("text") e conversão por visão ("vision").
+
+    Páginas escaneadas (imagens sem camada de texto utilizável) e páginas dominadas por tabelas vão
+    para a visão; as demais usam o texto nativo.
+    """
+    text_chars = len(page.get_text().strip())
+    has_fonts = bool(page.get_fonts())
+    image_coverage = _covered_fraction([info["bbox"] for info in page.get_image_info()], page.rect)
+
+    table_coverage = 0.0
+    if text_chars and page.get_drawings():
+        try:
+            table_coverage = _covered_fraction([table.bbox for table in page.find_tables().tables], page.rect)
+        except Exception as e:
+            logger.debug(f"Table detection failed on page {page.number + 1}: {e}")
+
+    if image_coverage > 0 and (not has_fonts or text_chars < RAG_PDF_MIN_TEXT_CHARS):
+        route, reason = "vision", "scanned"
+    elif table_coverage >= RAG_PDF_TABLE_COVERAGE:
+        route, reason = "vision", "tables"
+    else:
+        route, reason = "text", "text_layer" if text_chars else "blank"
+
+    return PageDecision(
+        page=page.number,
+        route=route,
+        reason=reason,
+        text_chars=text_chars,
+        image_coverage=round(image_coverage, 3),
+        table_coverage=round(table_coverage, 3),
+        has_fonts=has_fonts,
+    )
+
+
+def _vision_markdown(pdf, first_page: int, last_page: int) -> str:
+    """Converte um intervalo de páginas com `pdf_to_markdown`, através de um PDF temporário só com elas."""
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_pdf:
+        part_pdf_path = tmp_pdf.name
+    part_md_path = os.path.splitext(part_pdf_path)[0] + ".md"
+    try:
+        with fitz.open() as part:
+            part.insert_pdf(pdf, from_page=first_page, to_page=last_page)
+            part.save(part_pdf_path)
+        pdf_to_markdown(part_pdf_path, part_md_path)
+        with open(part_md_path, "r", encoding="utf-8") as f:
+            return f.read()
+    finally:
+        for path in (part_pdf_path, part_md_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def _convert_pdf_pages(pdf_path: str, temp_md_path: str) -> dict:
+    """
+    Escreve o Markdown do PDF página a página conforme `RAG_PDF_VISION_POLICY` e devolve o relatório
+    com a decisão de cada página e o tempo e custo estimados economizados pelo caminho de texto.
+    """
+    started = time.perf_counter()
+    vision_seconds = 0.0
+    with fitz.open(pdf_path) as pdf:
+        if RAG_PDF_VISION_POLICY == "auto":
+            decisions = [classify_pdf_page(page) for page in pdf]
+        else:
+            route = "vision" if RAG_PDF_VISION_POLICY == "always" else "text"
+            decisions = [PageDecision(page.number, route, "policy", 0, 0.0, 0.0, True) for page in pdf]
+
+        vision_pages = sum(decision.route == "vision" for decision in decisions)
+        if vision_pages == len(decisions):
+            # Tudo pela visão: converte o arquivo inteiro de uma vez, como antes
+            pdf_to_markdown(pdf_path, temp_md_path)
+            vision_seconds = time.perf_counter() - started
+        else:
+            pieces = []
+            # Páginas consecutivas com o mesmo caminho são processadas juntas
+            for route, group in itertools.groupby(decisions, key=lambda decision: decision.route):
+                pages = [decision.page for decision in group]
+                if route == "vision":
+                    vision_started = time.perf_counter()
+                    pieces.append(_vision_markdown(pdf, pages[0], pages[-1]))
+                    vision_seconds += time.perf_counter() - vision_started
+                else:
+                    pieces.extend(pdf[number].get_text() for number in pages)
+            with open(temp_md_path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(piece.strip() for piece in pieces if piece.strip()))
+
+    text_pages = len(decisions) - vision_pages
+    seconds_per_vision_page = vision_seconds / vision_pages if vision_pages else RAG_PDF_VISION_SECONDS_PER_PAGE
+    native_seconds = time.perf_counter() - started - vision_seconds
+    return {
+        "policy": RAG_PDF_VISION_POLICY,
+        "pages": [asdict(decision) for decision in decisions],
+        "text_pages": text_pages,
+        "vision_pages": vision_pages,
+        "vision_seconds": round(vision_seconds, 3),
+        "native_seconds": round(native_seconds, 3),
+        "estimated_seconds_saved": round(max(text_pages * seconds_per_vision_page - native_seconds, 0.0), 3),
+        "estimated_cost_saved": round(text_pages * RAG_PDF_VISION_COST_PER_PAGE, 4),
+    }
+
+
+def preprocess_pdf(pdf_path: str, report: Optional[dict] = None) -> tuple[str, str, str]:
     """
     Preprocessa um arquivo PDF convertendo-o para Markdown.
 
+    Cada página é classificada (ver `classify_pdf_page`): apenas páginas escaneadas ou com muitas
+    tabelas passam pela conversão com LLMs de visão, as demais usam a camada de texto do PDF.
+
     Args:
         pdf_path (str): Caminho do arquivo PDF original
+        report (dict, opcional): Recebe a decisão por página e o tempo e custo economizados
 
     Returns:
         tuple[str, str, str]: (new_file_name, new_content_type, temp_file_path)
@@ -22,7 +182,18 @@ def preprocess_pdf(pdf_path: str) -> tuple[str, str, str]:
             temp_md_path = tmp_md.name
 
         # Converte PDF para Markdown
-        pdf_to_markdown(pdf_path, temp_md_path)
+        pdf_report = _convert_pdf_pages(pdf_path, temp_md_path)
+        with _pdf_policy_stats_lock:
+            pdf_policy_stats["files"] += 1
+            for key in ("text_pages", "vision_pages", "estimated_seconds_saved", "estimated_cost_saved"):
+                pdf_policy_stats[key] += pdf_report[key]
+        logger.info(
+            f"PDF {os.path.basename(pdf_path)}: {pdf_report['text_pages']} text pages, "
+            f"{pdf_report['vision_pages']} vision pages, ~{pdf_report['estimated_seconds_saved']:.1f}s "
+            f"and ~{pdf_report['estimated_cost_saved']:.2f} saved"
+        )
+        if report is not None:
+            report.update(pdf_report)
 
         # Prepara os novos valores
         new_file_name = os.path.splitext(os.path.basename(pdf_path))[0] + ".md"
@@ -40,10 +211,101 @@ def preprocess_pdf(pdf_path: str) -> tuple[str, str, str]:
         raise e
 
 
+def _markdown_cell(value) -> str:
+    """Formata uma célula para uma linha de tabela Markdown."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("|", "\\|").replace("\r\n", " ").replace("\n", " ").strip()
+
+
+def _markdown_row(cells) -> str:
+    return "| " + " | ".join(cells) + " |\n"
+
+
+def _iter_excel_sheets(excel_path: str) -> Iterator[Tuple[str, Iterator[tuple]]]:
+    """
+    Percorre as planilhas uma vez, linha a linha: `.xlsx` com o openpyxl em modo somente leitura
+    e `.xls` (formato binário) com o xlrd, liberando cada planilha depois de lida.
+    """
+    with open(excel_path, "rb") as f:
+        is_xls = f.read(4) == b"\xd0\xcf\x11\xe0"
+
+    if is_xls:
+        import xlrd
+
+        workbook = xlrd.open_workbook(excel_path, on_demand=True)
+        try:
+            for sheet_name in workbook.sheet_names():
+                sheet = workbook.sheet_by_name(sheet_name)
+                yield sheet_name, (tuple(sheet.row_values(row)) for row in range(sheet.nrows))
+                workbook.unload_sheet(sheet_name)
+        finally:
+            workbook.release_resources()
+        return
+
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            yield worksheet.title, worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def write_excel_markdown(excel_path: str, output, block_rows: int = RAG_EXCEL_BLOCK_ROWS) -> int:
+    """
+    Escreve as planilhas como tabelas Markdown em `output` à medida que as linhas são lidas.
+
+    A primeira linha não vazia de cada planilha é o cabeçalho (células vazias viram "Unnamed: i",
+    como no pandas). Planilhas grandes são divididas em blocos de `block_rows` linhas, cada um com
+    o cabeçalho repetido, para que os chunks continuem legíveis. Retorna o número de linhas escritas.
+    """
+    total_rows = 0
+    for sheet_name, rows in _iter_excel_sheets(excel_path):
+        # Cabeçalho da planilha
+        output.write(f"\n# 📋 Planilha: {sheet_name}\n\n")
+        header = None
+        block_header = ""
+        rows_in_block = 0
+        for row in rows:
+            if all(value is None or value == "" for value in row):
+                continue
+            if header is None:
+                width = len(row)
+                while width and row[width - 1] in (None, ""):
+                    width -= 1
+                header = [
+                    _markdown_cell(value) if value not in (None, "") else f"Unnamed: {index}"
+                    for index, value in enumerate(row[:width])
+                ]
+                block_header = _markdown_row(header) + _markdown_row(["---"] * len(header))
+                continue
+            if rows_in_block == block_rows:
+                output.write("\n")
+                rows_in_block = 0
+            if rows_in_block == 0:
+                output.write(block_header)
+            cells = [_markdown_cell(value) for value in row[: len(header)]]
+            output.write(_markdown_row(cells + [""] * (len(header) - len(cells))))
+            rows_in_block += 1
+            total_rows += 1
+        if header is not None and rows_in_block == 0:
+            # Planilha só com cabeçalho
+            output.write(block_header)
+        output.write("\n\n")
+    return total_rows
+
+
 def preprocess_excel(excel_path: str) -> tuple[str, str, str]:
     """
     Preprocessa um arquivo Excel convertendo-o para Markdown.
 
+    O arquivo é lido uma única vez e as linhas são gravadas no Markdown conforme são lidas
+    (ver `write_excel_markdown`), então a memória usada não cresce com o tamanho das planilhas.
+
     Args:
         excel_path (str): Caminho do arquivo Excel original
 
@@ -55,19 +317,8 @@ def preprocess_excel(excel_path: str) -> tuple[str, str, str]:
         with tempfile.NamedTemporaryFile(suffix=".md", delete=False, mode="w", encoding="utf-8") as tmp_md:
             temp_md_path = tmp_md.name
 
-        # Lê todas as planilhas do Excel
-        excel_file = pd.ExcelFile(excel_path)
-
         with open(temp_md_path, "w", encoding="utf-8") as f:
-            for sheet_name in excel_file.sheet_names:
-                df = pd.read_excel(excel_path, sheet_name=sheet_name)
-
-                # Cabeçalho da planilha
-                f.write(f"\n# 📋 Planilha: {sheet_name}\n\n")
-
-                # Converte para markdown usando tabulate
-                f.write(tabulate(df, headers="keys", tablefmt="pipe", showindex=False))
-                f.write("\n\n")
+            write_excel_markdown(excel_path, f)
 
         # Prepara os novos valores
         new_file_name = os.path.splitext(os.path.basename(excel_path))[0] + ".md"
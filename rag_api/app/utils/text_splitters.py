@@ -0,0 +1,279 @@
+# app/utils/text_splitters.py
+import itertools
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter, TextSplitter
+
+from app.config import RAG_CHUNK_SIZE_UNIT, RAG_TEXT_SPLITTER, RAG_TIKTOKEN_ENCODING, logger
+
+# Sheet headings written by `preprocess_excel`
+SHEET_HEADING = re.compile(r"^#\s+📋 Planilha:\s*(.*)$")
+TABLE_SEPARATOR = re.compile(r"^\|(\s*:?-{3,}:?\s*\|)+\s*$")
+
+
+def _table_row(cells: Iterable[str]) -> str:
+    escaped = (cell.replace("|", "\\|").replace("\n", " ").strip() for cell in cells)
+    return "| " + " | ".join(escaped) + " |"
+
+
+def _parse_csv_row(content: str) -> Tuple[Tuple[str, ...], List[str]]:
+    """Columns and values of a `CSVLoader` row, whose content is `column: value` lines."""
+    columns, values = [], []
+    for line in content.split("\n"):
+        column, separator, value = line.partition(": ")
+        if (separator and column) or not columns:
+            columns.append(column if separator else "")
+            values.append(value if separator else line)
+        else:
+            # A line break inside the previous value
+            values[-1] += " " + line
+    return tuple(columns), values
+
+
+class TableTextSplitter(TextSplitter):
+    """
+    Splits tables by groups of whole rows, repeating the column header in every chunk.
+
+    Understands the Markdown tables written by `preprocess_excel` (one `# 📋 Planilha:` section
+    per sheet, possibly split into header-repeating blocks) and the one-row-per-document output
+    of `CSVLoader`, which is rendered as Markdown tables. Chunks get `sheet` (spreadsheets) and
+    `row_start` / `row_end` metadata, counting data rows from 0 like `CSVLoader`'s `row`. Text
+    outside tables is split by a `RecursiveCharacterTextSplitter` with the same settings.
+    """
+
+    def __init__(self, chunk_size: int = 4000, chunk_overlap: int = 200, **kwargs: Any):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self._text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs
+        )
+
+    def _row_groups(self, prefix: str, rows: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, int]]:
+        """`(text, row_start, row_end)` chunks of `prefix` (title and header lines) plus as many rows as fit."""
+        group: List[Tuple[int, str]] = []
+
+        def text_of(candidate):
+            return prefix + "\n".join(row for _, row in candidate)
+
+        for row in rows:
+            if group and self._length_function(text_of(group + [row])) > self._chunk_size:
+                yield text_of(group), group[0][0], group[-1][0]
+                group = []
+            if not group and self._length_function(text_of([row])) > self._chunk_size:
+                # A single row longer than a chunk: split the row, keeping the header on every piece
+                room = max(self._chunk_size - self._length_function(prefix), 1)
+                for piece in RecursiveCharacterTextSplitter(
+                    chunk_size=room,
+                    chunk_overlap=min(self._chunk_overlap, room // 2),
+                    length_function=self._length_function,
+                ).split_text(row[1]):
+                    yield prefix + piece, row[0], row[0]
+                continue
+            group.append(row)
+        if group:
+            yield text_of(group), group[0][0], group[-1][0]
+
+    def _split_markdown(self, text: str) -> Iterator[Tuple[str, dict]]:
+        lines = text.split("\n")
+        paragraph: List[str] = []
+        sheet: Optional[str] = None
+        title = ""
+        header = None
+        next_row = 0
+
+        def flush_paragraph():
+            content = "\n".join(paragraph).strip()
+            paragraph.clear()
+            metadata = {"sheet": sheet} if sheet is not None else {}
+            return [(piece, dict(metadata)) for piece in self._text_splitter.split_text(content)] if content else []
+
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            heading = SHEET_HEADING.match(line.strip())
+            if heading:
+                yield from flush_paragraph()
+                sheet, title, header, next_row = heading.group(1).strip(), line.strip() + "\n\n", None, 0
+                index += 1
+                continue
+            if line.startswith("|") and index + 1 < len(lines) and TABLE_SEPARATOR.match(lines[index + 1].strip()):
+                yield from flush_paragraph()
+                table_header = line.rstrip() + "\n" + lines[index + 1].strip() + "\n"
+                if table_header != header:
+                    # A new table; blocks repeating the previous header continue its row numbering
+                    header, next_row = table_header, 0
+                index += 2
+                rows = []
+                while index < len(lines) and lines[index].startswith("|"):
+                    rows.append((next_row, lines[index].rstrip()))
+                    next_row += 1
+                    index += 1
+                for content, row_start, row_end in self._row_groups(title + header, rows):
+                    metadata = {"row_start": row_start, "row_end": row_end}
+                    if sheet is not None:
+                        metadata["sheet"] = sheet
+                    yield content, metadata
+                continue
+            paragraph.append(line)
+            index += 1
+        yield from flush_paragraph()
+
+    def _split_csv_rows(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Render consecutive `CSVLoader` rows with the same columns as Markdown tables."""
+        parsed = ((document, *_parse_csv_row(document.page_content)) for document in documents)
+        for columns, group in itertools.groupby(parsed, key=lambda item: item[1]):
+            first = next(group)
+            metadata = {key: value for key, value in first[0].metadata.items() if key != "row"}
+            header = _table_row(columns) + "\n" + _table_row(["---"] * len(columns)) + "\n"
+            rows = (
+                (document.metadata.get("row", 0), _table_row(values))
+                for document, _, values in itertools.chain([first], group)
+            )
+            for content, row_start, row_end in self._row_groups(header, rows):
+                yield Document(page_content=content, metadata={**metadata, "row_start": row_start, "row_end": row_end})
+
+    def iter_split_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Split documents as they arrive; runs of `CSVLoader` rows are grouped across documents."""
+        for is_csv_row, group in itertools.groupby(documents, key=lambda document: "row" in document.metadata):
+            if is_csv_row:
+                yield from self._split_csv_rows(group)
+                continue
+            for document in group:
+                for content, metadata in self._split_markdown(document.page_content):
+                    yield Document(page_content=content, metadata={**document.metadata, **metadata})
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return list(self.iter_split_documents(documents))
+
+    def split_text(self, text: str) -> List[str]:
+        return [content for content, _ in self._split_markdown(text)]
+
+
+# Languages of `known_source_ext` that LangChain has code separators for
+CODE_LANGUAGES = {
+    "c": Language.C,
+    "cpp": Language.CPP,
+    "cs": Language.CSHARP,
+    "go": Language.GO,
+    "h": Language.CPP,
+    "hpp": Language.CPP,
+    "java": Language.JAVA,
+    "js": Language.JS,
+    "pl": Language.PERL,
+    "pm": Language.PERL,
+    "ps1": Language.POWERSHELL,
+    "py": Language.PYTHON,
+    "ts": Language.TS,
+}
+
+# File types whose content is tabular
+TABLE_FILE_TYPES = {"csv", "xls", "xlsx"}
+MARKDOWN_FILE_TYPES = {"md", "markdown"}
+
+
+@lru_cache(maxsize=None)
+def get_token_encoding(name: str = RAG_TIKTOKEN_ENCODING):
+    """The tiktoken encoding, loaded once per process; None when it can't be loaded (e.g. offline)."""
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {name} not available, estimating 4 characters per token: {e}")
+        return None
+
+
+def token_length(text: str) -> int:
+    encoding = get_token_encoding()
+    if encoding is None:
+        return -(-len(text) // 4)
+    return len(encoding.encode_ordinary(text))
+
+
+SplitterFactory = Callable[[Optional[str], int, int, Callable[[str], int]], TextSplitter]
+
+# Splitters selectable with `RAG_TEXT_SPLITTER` or per upload, by name
+TEXT_SPLITTERS: Dict[str, SplitterFactory] = {}
+
+
+def register_text_splitter(name: str):
+    """
+    Register a splitter factory, called as `factory(file_ext, chunk_size, chunk_overlap, length_function)`.
+    """
+
+    def register(factory: SplitterFactory) -> SplitterFactory:
+        TEXT_SPLITTERS[name] = factory
+        return factory
+
+    return register
+
+
+@register_text_splitter("recursive")
+def recursive_splitter(file_ext, chunk_size, chunk_overlap, length_function) -> TextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function
+    )
+
+
+@register_text_splitter("token")
+def token_splitter(file_ext, chunk_size, chunk_overlap, length_function) -> TextSplitter:
+    """Like "recursive", but always measured in tokens."""
+    return recursive_splitter(file_ext, chunk_size, chunk_overlap, token_length)
+
+
+@register_text_splitter("markdown")
+def markdown_splitter(file_ext, chunk_size, chunk_overlap, length_function) -> TextSplitter:
+    """Splits at headings first, then code fences, rules, paragraphs and lines."""
+    return RecursiveCharacterTextSplitter.from_language(
+        Language.MARKDOWN, chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function
+    )
+
+
+@register_text_splitter("code")
+def code_splitter(file_ext, chunk_size, chunk_overlap, length_function) -> TextSplitter:
+    """Splits at class and function definitions of the file's language."""
+    language = CODE_LANGUAGES.get(file_ext)
+    if language is None:
+        return recursive_splitter(file_ext, chunk_size, chunk_overlap, length_function)
+    return RecursiveCharacterTextSplitter.from_language(
+        language, chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function
+    )
+
+
+@register_text_splitter("table")
+def table_splitter(file_ext, chunk_size, chunk_overlap, length_function) -> TextSplitter:
+    return TableTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function)
+
+
+def auto_splitter_name(file_ext: Optional[str]) -> str:
+    """The splitter "auto" picks for a file type."""
+    if file_ext in TABLE_FILE_TYPES:
+        return "table"
+    if file_ext in MARKDOWN_FILE_TYPES:
+        return "markdown"
+    if file_ext in CODE_LANGUAGES:
+        return "code"
+    return "recursive"
+
+
+def get_text_splitter(
+    file_ext: Optional[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    name: Optional[str] = None,
+    unit: str = RAG_CHUNK_SIZE_UNIT,
+) -> TextSplitter:
+    """
+    The splitter called `name` (default `RAG_TEXT_SPLITTER`) for a file type. With "auto", it is
+    chosen from `file_ext`: whole-row tables for spreadsheets and CSVs, headings for Markdown,
+    definitions for source code and characters otherwise. `chunk_size` and `chunk_overlap` are
+    measured in `unit`: "characters" or "tokens" (of `RAG_TIKTOKEN_ENCODING`).
+    """
+    name = name or RAG_TEXT_SPLITTER
+    if name == "auto":
+        name = auto_splitter_name(file_ext)
+    if name not in TEXT_SPLITTERS:
+        raise ValueError(f"Unknown text splitter: {name}. Choose 'auto' or one of {', '.join(TEXT_SPLITTERS)}.")
+    length_function = token_length if unit == "tokens" else len
+    return TEXT_SPLITTERS[name](file_ext, chunk_size, chunk_overlap, length_function)
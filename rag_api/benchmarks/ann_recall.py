@@ -0,0 +1,77 @@
+# benchmarks/ann_recall.py
+"""
+Recall-vs-latency sweep for the managed HNSW / IVFFlat index.
+
+Seeds random embeddings, builds the index with `ensure_ann_index`, takes exact
+search results as ground truth and reports recall@k and latency for each `ef_search`
+(HNSW) or `probes` (IVFFlat) value. Run it against a scratch database: the index is built
+on the whole `langchain_pg_embedding` table and dropped again afterwards.
+
+    python -m benchmarks.ann_recall --index hnsw --rows 100000 --dim 768 --values 10,20,40,80,160
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from app.services.database import PSQLDatabase, ensure_ann_index
+from benchmarks.common import make_store, seed_store
+
+
+async def main(args):
+    store = make_store(args.collection, args.dim)
+    file_ids = await seed_store(store, args.rows, args.dim, args.files)
+    rng = np.random.default_rng(2)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32).tolist()
+
+    async def search_all(**settings):
+        results, latencies = [], []
+        for query in queries:
+            started = time.perf_counter()
+            documents = await store.asimilarity_search_with_score_by_vector(query, k=args.k, **settings)
+            latencies.append(time.perf_counter() - started)
+            results.append({document.page_content for document, _ in documents})
+        return results, sorted(latencies)
+
+    try:
+        exact, exact_latencies = await search_all()
+        report = [{"setting": "exact", "recall": 1.0, "p50_ms": round(exact_latencies[len(exact_latencies) // 2] * 1000, 2)}]
+
+        dimensions = await ensure_ann_index(
+            args.index, store.ann_operator_class, dimensions=args.dim, m=args.m, ef_construction=args.ef_construction
+        )
+        store.configure_ann_search(args.index, dimensions)
+        setting = "ef_search" if args.index == "hnsw" else "probes"
+        for value in (int(value) for value in args.values.split(",")):
+            approximate, latencies = await search_all(**{setting: value})
+            recall = np.mean([len(found & truth) / len(truth) for found, truth in zip(approximate, exact) if truth])
+            report.append(
+                {
+                    "setting": f"{setting}={value}",
+                    "recall": round(float(recall), 4),
+                    "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+                    "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+                }
+            )
+        print(json.dumps(report, indent=2))
+    finally:
+        await ensure_ann_index("none", store.ann_operator_class)
+        await store.delete(ids=file_ids)
+        await PSQLDatabase.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--index", choices=("hnsw", "ivfflat"), default="hnsw")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--values", default="10,20,40,80,160", help="ef_search or probes values to sweep")
+    asyncio.run(main(parser.parse_args()))
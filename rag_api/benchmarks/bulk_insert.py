@@ -0,0 +1,75 @@
+# benchmarks/bulk_insert.py
+"""
+Compare chunk insert throughput (rows/s) for one large file:
+LangChain's `add_embeddings` (SQLAlchemy ORM), asyncpg `executemany` and binary `COPY`.
+
+    python -m benchmarks.bulk_insert --rows 5000 --dim 1536
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from langchain_core.runnables.config import run_in_executor
+
+from app.services.database import PSQLDatabase
+from app.services.vector_store.async_pg_vector import EMBEDDING_TABLE
+from benchmarks.common import make_store, random_vectors
+
+
+async def main(args):
+    store = make_store(args.collection, args.dim)
+    embeddings = random_vectors(args.rows, args.dim).tolist()
+    texts = [f"chunk {row}" for row in range(args.rows)]
+
+    def metadatas(file_id):
+        return [{"file_id": file_id, "user_id": "bench", "chunk_index": row} for row in range(args.rows)]
+
+    async def orm(file_id):
+        await run_in_executor(
+            None, store.add_embeddings, texts, embeddings, metadatas(file_id), ids=[file_id] * args.rows
+        )
+
+    async def executemany(file_id):
+        pool = await PSQLDatabase.get_pool()
+        async with pool.acquire() as conn:
+            collection_uuid = await store._get_collection_uuid(conn)
+            async with conn.transaction():
+                await conn.executemany(
+                    f"""
+                    INSERT INTO {EMBEDDING_TABLE} (uuid, collection_id, embedding, document, cmetadata, custom_id)
+                    VALUES ($1, $2, $3, $4, $5::json, $6)
+                    """,
+                    [
+                        (uuid.uuid4(), collection_uuid, embedding, text, json.dumps(metadata), file_id)
+                        for text, embedding, metadata in zip(texts, embeddings, metadatas(file_id))
+                    ],
+                )
+
+    async def copy(file_id):
+        await store.acopy_embeddings(
+            zip([file_id] * args.rows, texts, metadatas(file_id), embeddings), batch_size=args.batch_size
+        )
+
+    results = {}
+    try:
+        for name, insert in (("orm", orm), ("executemany", executemany), ("copy", copy)):
+            file_id = f"bench-insert-{name}"
+            started = time.perf_counter()
+            await insert(file_id)
+            elapsed = time.perf_counter() - started
+            results[name] = {"seconds": round(elapsed, 3), "rows_per_second": round(args.rows / elapsed, 1)}
+        print(json.dumps(results, indent=2))
+    finally:
+        await store.delete(ids=[f"bench-insert-{name}" for name in ("orm", "executemany", "copy")])
+        await PSQLDatabase.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
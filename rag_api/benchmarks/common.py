@@ -0,0 +1,72 @@
+# benchmarks/common.py
+"""Helpers shared by the benchmark scripts. They run against the Postgres configured in `.env`."""
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable, List
+
+import numpy as np
+from langchain_core.embeddings import FakeEmbeddings
+
+from app.config import CONNECTION_STRING
+from app.services.database import ensure_metadata_columns, ensure_vector_indexes
+from app.services.vector_store.factory import get_vector_store
+
+
+def make_store(collection_name: str, dim: int):
+    return get_vector_store(
+        connection_string=CONNECTION_STRING,
+        embeddings=FakeEmbeddings(size=dim),
+        collection_name=collection_name,
+        mode="async",
+    )
+
+
+def random_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+async def seed_store(
+    store, rows: int, dim: int, files: int, batch_size: int = 1000, prefix: str = "bench-file"
+) -> List[str]:
+    """Insert `rows` random chunks spread over `files` file ids; returns the file ids."""
+    await ensure_metadata_columns()
+    await ensure_vector_indexes()
+    file_ids = [f"{prefix}-{index}" for index in range(files)]
+    vectors = random_vectors(rows, dim)
+    for start in range(0, rows, batch_size):
+        stop = min(start + batch_size, rows)
+        batch_file_ids = [file_ids[row % files] for row in range(start, stop)]
+        await store.aadd_embeddings(
+            texts=[f"chunk {row}" for row in range(start, stop)],
+            embeddings=vectors[start:stop].tolist(),
+            metadatas=[
+                {"file_id": file_id, "user_id": "bench", "chunk_index": row}
+                for row, file_id in zip(range(start, stop), batch_file_ids)
+            ],
+            ids=batch_file_ids,
+        )
+    return file_ids
+
+
+async def run_concurrently(call: Callable[[int], Awaitable], requests: int, concurrency: int) -> dict:
+    """Run `call(i)` for `requests` iterations with at most `concurrency` in flight and summarize latency."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def timed(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(index)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
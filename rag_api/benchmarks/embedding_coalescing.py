@@ -0,0 +1,75 @@
+# benchmarks/embedding_coalescing.py
+"""
+Provider calls made by many concurrent small uploads, with embedding calls sent as they come
+versus merged by `EmbeddingCoalescer` at several wait times. The provider is simulated, with a
+fixed latency per request plus a cost per text, behind the same `EmbeddingDispatcher` the app
+uses; no database or network is needed.
+
+    python -m benchmarks.embedding_coalescing --uploaders 10 --files 20 --chunks 3
+    python -m benchmarks.embedding_coalescing --waits 2 5 10 --request-ms 80
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.services.embedding_dispatcher import EmbeddingCoalescer, EmbeddingDispatcher
+
+
+class SimulatedProvider:
+    def __init__(self, request_ms: float, text_ms: float):
+        self.request_ms = request_ms
+        self.text_ms = text_ms
+        self.calls = 0
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        await asyncio.sleep((self.request_ms + self.text_ms * len(texts)) / 1000)
+        return [[0.0] for _ in texts]
+
+
+async def run(args, wait_ms: float) -> dict:
+    provider = SimulatedProvider(args.request_ms, args.text_ms)
+    embeddings = EmbeddingDispatcher(provider, provider="simulated", concurrency=args.concurrency, length_function=len)
+    if wait_ms > 0:
+        embeddings = EmbeddingCoalescer(embeddings, max_wait_ms=wait_ms, length_function=len)
+    latencies = []
+
+    async def uploader(index: int):
+        for file in range(args.files):
+            texts = [f"uploader {index} file {file} chunk {chunk} " * 20 for chunk in range(args.chunks)]
+            started = time.perf_counter()
+            await embeddings.aembed_documents(texts)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(uploader(index) for index in range(args.uploaders)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "provider_calls": provider.calls,
+        "provider_calls_per_second": round(provider.calls / elapsed, 1),
+        "files_per_second": round(args.uploaders * args.files / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+async def main(args):
+    results = {"direct": await run(args, 0)}
+    for wait_ms in args.waits:
+        results[f"coalesced_{wait_ms:g}ms"] = await run(args, wait_ms)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploaders", type=int, default=10, help="Concurrent uploads")
+    parser.add_argument("--files", type=int, default=20, help="Files each uploader sends, one after the other")
+    parser.add_argument("--chunks", type=int, default=3, help="Chunks per file")
+    parser.add_argument("--waits", type=float, nargs="+", default=[2, 5, 10], help="Coalescing waits to try, in ms")
+    parser.add_argument("--request-ms", type=float, default=50, help="Simulated latency per provider request")
+    parser.add_argument("--text-ms", type=float, default=0.2, help="Simulated latency per embedded text")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent provider requests")
+    asyncio.run(main(parser.parse_args()))
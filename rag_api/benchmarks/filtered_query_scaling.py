@@ -0,0 +1,62 @@
+# benchmarks/filtered_query_scaling.py
+"""
+Per-file top-k latency as the corpus grows.
+
+Keeps one file of `--file-rows` chunks fixed and adds unrelated files in steps, timing a
+`/query`-style search filtered on that file after each step. With `file_id` filtered on its
+indexed column, latency should stay flat across steps.
+
+    python -m benchmarks.filtered_query_scaling --file-rows 500 --steps 10000,100000,500000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.services.database import PSQLDatabase
+from benchmarks.common import make_store, random_vectors, seed_store
+
+
+async def main(args):
+    store = make_store(args.collection, args.dim)
+    [target] = await seed_store(store, args.file_rows, args.dim, files=1, prefix="bench-target")
+    queries = random_vectors(args.queries, args.dim, seed=1).tolist()
+    file_ids = [target]
+    corpus = args.file_rows
+
+    report = []
+    try:
+        for step, size in enumerate(int(size) for size in args.steps.split(",")):
+            if size > corpus:
+                file_ids += await seed_store(
+                    store, size - corpus, args.dim, files=max(1, (size - corpus) // 500), prefix=f"bench-noise-{step}"
+                )
+                corpus = size
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                await store.asimilarity_search_with_score_by_vector(query, k=args.k, filter={"file_id": target})
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            report.append(
+                {
+                    "corpus_rows": corpus,
+                    "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+                    "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+                }
+            )
+        print(json.dumps(report, indent=2))
+    finally:
+        await store.delete(ids=file_ids)
+        await PSQLDatabase.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--file-rows", type=int, default=500)
+    parser.add_argument("--steps", default="10000,50000,200000")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,143 @@
+# benchmarks/hybrid_recall.py
+"""
+Recall@k and latency of hybrid (full-text + vector, fused by reciprocal rank) versus vector-only
+search, for questions that name a document code such as "TI.AG.00.002".
+
+Every chunk mentions its own code alongside words of one of a few topics. Embeddings are
+built from the topic words only, the way dense embeddings blur identifiers together, so
+vector search has to tell apart many near-identical chunks of the same topic, while the
+full-text search matches the code exactly. A question is the code plus a few of its chunk's words.
+
+    python -m benchmarks.hybrid_recall --rows 20000 --files 20 --queries 500 --k 4
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import time
+
+import numpy as np
+
+from app.config import RAG_TEXT_SEARCH_CONFIG
+from app.services.database import (
+    PSQLDatabase,
+    ensure_metadata_columns,
+    ensure_text_search_column,
+    ensure_vector_indexes,
+)
+from benchmarks.common import make_store
+
+WORD = re.compile(r"^[a-z]+$")
+
+
+class TopicEmbeddings:
+    """Sum of fixed random vectors of the alphabetic words of a text, normalized; codes don't count."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.vectors = {}
+
+    def embed(self, text: str) -> list:
+        total = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            if WORD.match(word):
+                if word not in self.vectors:
+                    rng = np.random.default_rng(list(word.encode()))
+                    self.vectors[word] = rng.standard_normal(self.dim).astype(np.float32)
+                total += self.vectors[word]
+        return (total / (np.linalg.norm(total) or 1.0)).tolist()
+
+
+def make_chunks(rows: int, topics: int, rng: random.Random):
+    vocabulary = [["".join(rng.choices("aeioukmnrst", k=7)) for _ in range(30)] for _ in range(topics)]
+    chunks = []
+    for row in range(rows):
+        code = f"TI.{chr(65 + row % 26)}{chr(65 + row // 26 % 26)}.{row // 676 % 100:02d}.{row % 1000:03d}"
+        words = rng.sample(vocabulary[row % topics], 12)
+        chunks.append((code, f"Procedure {code}: " + " ".join(words)))
+    return chunks
+
+
+async def search_all(search, questions, k):
+    latencies, hits = [], 0
+    for embedding, question, expected in questions:
+        started = time.perf_counter()
+        results = await search(embedding, question, k)
+        latencies.append(time.perf_counter() - started)
+        hits += any(document.page_content == expected for document, _ in results)
+    latencies.sort()
+    return {
+        f"recall_at_{k}": round(hits / len(questions), 4),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    embeddings = TopicEmbeddings(args.dim)
+    store = make_store(args.collection, args.dim)
+    await ensure_metadata_columns()
+    await ensure_vector_indexes()
+    await ensure_text_search_column(RAG_TEXT_SEARCH_CONFIG)
+    store.configure_text_search(RAG_TEXT_SEARCH_CONFIG)
+
+    chunks = make_chunks(args.rows, args.topics, rng)
+    file_ids = [f"bench-hybrid-{index}" for index in range(args.files)]
+    for start in range(0, len(chunks), 1000):
+        batch = chunks[start : start + 1000]
+        await store.aadd_embeddings(
+            texts=[text for _, text in batch],
+            embeddings=[embeddings.embed(text) for _, text in batch],
+            metadatas=[
+                {"file_id": file_ids[row % args.files], "user_id": "bench", "chunk_index": row}
+                for row in range(start, start + len(batch))
+            ],
+            ids=[file_ids[row % args.files] for row in range(start, start + len(batch))],
+        )
+
+    questions = []
+    for code, text in rng.sample(chunks, args.queries):
+        words = rng.sample(text.split()[2:], 4)
+        question = f"What does {code} say about " + " ".join(words)
+        questions.append((embeddings.embed(question), question, text))
+
+    async def vector(embedding, question, k):
+        return await store.asimilarity_search_with_score_by_vector(embedding, k=k, filter={"file_id": {"$in": file_ids}})
+
+    async def hybrid(embedding, question, k):
+        return await store.ahybrid_search_with_score_by_vector(
+            embedding,
+            question,
+            k=k,
+            filter={"file_id": {"$in": file_ids}},
+            candidates=args.candidates,
+            rrf_k=args.rrf_k,
+        )
+
+    try:
+        results = {}
+        for k in sorted({args.k, args.k * 5}):
+            results[f"vector_k{k}"] = await search_all(vector, questions, k)
+            results[f"hybrid_k{k}"] = await search_all(hybrid, questions, k)
+        print(json.dumps(results, indent=2))
+    finally:
+        await store.delete(ids=file_ids)
+        await PSQLDatabase.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--topics", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=40)
+    parser.add_argument("--rrf-k", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
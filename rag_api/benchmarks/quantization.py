@@ -0,0 +1,120 @@
+# benchmarks/quantization.py
+"""
+Table size, ANN index size, latency and recall@k of each embedding storage mode: "vector"
+(32-bit floats), "halfvec" (16-bit floats) and "binary" (Hamming search on binary-quantized
+embeddings, re-ranked by exact distance).
+
+Seeds random embeddings, takes exact "vector" search results as ground truth, then for each
+mode converts the column with `ensure_embedding_storage`, builds the index with
+`ensure_ann_index` and runs the queries. Run it against a scratch database: the whole
+`langchain_pg_embedding` table is converted, and put back to "vector" afterwards (precision
+dropped by "halfvec" is not restored, so it runs last by default).
+
+    python -m benchmarks.quantization --rows 100000 --dim 1536 --index hnsw
+    python -m benchmarks.quantization --modes vector binary --rerank-factors 2 5 10 20
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from app.services.database import (
+    ANN_INDEX_PREFIX,
+    PSQLDatabase,
+    ensure_ann_index,
+    ensure_embedding_storage,
+)
+from app.services.vector_store.async_pg_vector import EMBEDDING_TABLE
+from benchmarks.common import make_store, seed_store
+
+
+async def relation_sizes() -> dict:
+    pool = await PSQLDatabase.get_pool()
+    async with pool.acquire() as conn:
+        table = await conn.fetchval("SELECT pg_table_size($1::regclass)", EMBEDDING_TABLE)
+        index = await conn.fetchval(
+            """
+            SELECT coalesce(sum(pg_relation_size(i.indexrelid)), 0)
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = $1::regclass AND starts_with(c.relname, $2)
+            """,
+            EMBEDDING_TABLE,
+            ANN_INDEX_PREFIX,
+        )
+    return {"table_mb": round(table / 1024 / 1024, 1), "ann_index_mb": round(index / 1024 / 1024, 1)}
+
+
+async def main(args):
+    store = make_store(args.collection, args.dim)
+    file_ids = await seed_store(store, args.rows, args.dim, args.files)
+    rng = np.random.default_rng(2)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32).tolist()
+
+    async def search_all():
+        results, latencies = [], []
+        for query in queries:
+            started = time.perf_counter()
+            documents = await store.asimilarity_search_with_score_by_vector(query, k=args.k, ef_search=args.ef_search)
+            latencies.append(time.perf_counter() - started)
+            results.append({document.page_content for document, _ in documents})
+        return results, sorted(latencies)
+
+    def summarize(found, latencies):
+        recall = np.mean([len(result & truth) / len(truth) for result, truth in zip(found, exact) if truth])
+        return {
+            "recall": round(float(recall), 4),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        }
+
+    try:
+        store.configure_embedding_storage("vector")
+        exact, _ = await search_all()
+
+        report = {}
+        for mode in args.modes:
+            await ensure_embedding_storage(mode)
+            # Converting the column invalidates statements prepared on the pooled connections
+            await PSQLDatabase.close_pool()
+            store.configure_embedding_storage(mode)
+            dimensions = await ensure_ann_index(
+                args.index,
+                store.ann_operator_class,
+                dimensions=args.dim,
+                m=args.m,
+                ef_construction=args.ef_construction,
+                storage=mode,
+            )
+            store.configure_ann_search(args.index, dimensions)
+            sizes = await relation_sizes()
+            for factor in args.rerank_factors if mode == "binary" else [None]:
+                if factor is not None:
+                    store.configure_embedding_storage(mode, rerank_factor=factor)
+                name = mode if factor is None else f"{mode}_rerank{factor}"
+                report[name] = {**sizes, **summarize(*await search_all())}
+        print(json.dumps(report, indent=2))
+    finally:
+        await ensure_ann_index("none", store.ann_operator_class)
+        await ensure_embedding_storage("vector")
+        await PSQLDatabase.close_pool()
+        await store.delete(ids=file_ids)
+        await PSQLDatabase.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--modes", nargs="+", choices=("vector", "halfvec", "binary"), default=["vector", "binary", "halfvec"])
+    parser.add_argument("--index", choices=("hnsw", "ivfflat", "none"), default="hnsw")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, default=100)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[4, 10])
+    asyncio.run(main(parser.parse_args()))
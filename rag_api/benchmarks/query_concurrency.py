@@ -0,0 +1,57 @@
+# benchmarks/query_concurrency.py
+"""
+Compare `/query`-style similarity search throughput under concurrency:
+the thread-pool wrapped SQLAlchemy path versus the native asyncpg path.
+
+    python -m benchmarks.query_concurrency --rows 50000 --files 50 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+
+from langchain_core.runnables.config import run_in_executor
+
+from app.services.database import PSQLDatabase
+from benchmarks.common import make_store, random_vectors, run_concurrently, seed_store
+
+
+async def main(args):
+    store = make_store(args.collection, args.dim)
+    file_ids = await seed_store(store, args.rows, args.dim, args.files)
+    queries = random_vectors(args.requests, args.dim, seed=1).tolist()
+
+    async def threaded(index):
+        await run_in_executor(
+            None,
+            store.similarity_search_with_score_by_vector,
+            queries[index],
+            k=args.k,
+            filter={"file_id": file_ids[index % len(file_ids)]},
+        )
+
+    async def native(index):
+        await store.asimilarity_search_with_score_by_vector(
+            queries[index], k=args.k, filter={"file_id": file_ids[index % len(file_ids)]}
+        )
+
+    try:
+        results = {
+            "thread_pool": await run_concurrently(threaded, args.requests, args.concurrency),
+            "asyncpg": await run_concurrently(native, args.requests, args.concurrency),
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        await store.delete(ids=file_ids)
+        await PSQLDatabase.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,118 @@
+# benchmarks/split_throughput.py
+"""
+Split throughput (MB/s, chunks/s) of the registered text splitters on large generated inputs,
+with the size spread of the chunks they produce, in characters and in tokens. Only splitting
+is timed; no rows are written to the database.
+
+    python -m benchmarks.split_throughput --megabytes 20 --chunk-size 1500 --chunk-overlap 100
+    python -m benchmarks.split_throughput --unit tokens --chunk-size 400 --chunk-overlap 50
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from langchain_core.documents import Document
+
+from app.services.ingestion import split_with_positions
+from app.utils.text_splitters import get_text_splitter, token_length
+
+WORDS = "the quarterly revenue grew while operating costs fell across all regional business units".split()
+
+
+def prose(size: int, rng: random.Random) -> str:
+    paragraphs, length = [], 0
+    while length < size:
+        paragraph = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 160))) + "."
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def markdown(size: int, rng: random.Random) -> str:
+    sections, length, number = [], 0, 0
+    while length < size:
+        number += 1
+        section = f"## Section {number}\n\n" + prose(rng.randint(500, 4000), rng)
+        sections.append(section)
+        length += len(section) + 2
+    return "\n\n".join(sections)
+
+
+def python_code(size: int, rng: random.Random) -> str:
+    functions, length, number = [], 0, 0
+    while length < size:
+        number += 1
+        body = "\n".join(
+            f"    total += {rng.randint(0, 999)} * value  # {rng.choice(WORDS)}" for _ in range(rng.randint(5, 60))
+        )
+        function = f"def function_{number}(value):\n    total = 0\n{body}\n    return total\n"
+        functions.append(function)
+        length += len(function) + 2
+    return "\n\n".join(functions)
+
+
+def spreadsheet(size: int, rng: random.Random) -> str:
+    lines = ["# 📋 Planilha: Ledger", "", "| Account | Region | Amount | Note |", "| --- | --- | --- | --- |"]
+    length, row = 0, 0
+    while length < size:
+        row += 1
+        note = " ".join(rng.choices(WORDS, k=6))
+        line = f"| acct-{row} | {rng.choice(WORDS)} | {rng.uniform(0, 1e6):.2f} | {note} |"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+INPUTS = {
+    "txt": ("prose", prose, ["recursive", "token"]),
+    "md": ("markdown", markdown, ["recursive", "markdown"]),
+    "py": ("python", python_code, ["recursive", "code"]),
+    "xlsx": ("spreadsheet", spreadsheet, ["recursive", "table"]),
+}
+
+
+def summarize(sizes):
+    """Mean, p95 and max of sorted chunk sizes."""
+    return {
+        "mean": round(statistics.mean(sizes)),
+        "p95": sizes[min(len(sizes) - 1, int(len(sizes) * 0.95))],
+        "max": sizes[-1],
+    }
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    size = int(args.megabytes * 1024 * 1024)
+    results = {}
+    for file_ext, (label, generate, splitters) in INPUTS.items():
+        # One document per file, as `TextLoader` produces for Markdown, code and converted spreadsheets
+        text = generate(size, rng)
+        pages = [Document(page_content=text, metadata={})]
+        for name in splitters:
+            unit = "tokens" if name == "token" else args.unit
+            splitter = get_text_splitter(file_ext, args.chunk_size, args.chunk_overlap, name=name, unit=unit)
+            started = time.perf_counter()
+            chunks = list(split_with_positions(pages, splitter))
+            elapsed = time.perf_counter() - started
+            characters = sorted(len(chunk.page_content) for chunk in chunks)
+            tokens = sorted(token_length(chunk.page_content) for chunk in chunks)
+            results[f"{label}/{name}"] = {
+                "chunks": len(chunks),
+                "mb_per_second": round(len(text) / 1024 / 1024 / elapsed, 2),
+                "chunks_per_second": round(len(chunks) / elapsed, 1),
+                "characters": summarize(characters),
+                "tokens": summarize(tokens),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=5)
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--unit", choices=["characters", "tokens"], default="characters")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
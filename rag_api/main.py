@@ -1,94 +1,26 @@
 # main.py
-import os
-from concurrent.futures import ThreadPoolExecutor
-from contextlib import asynccontextmanager
+"""
+Entry point: `python main.py`, or `uvicorn main:app`.
 
-import uvicorn
-from fastapi import FastAPI, Request
-from fastapi.exceptions import RequestValidationError
-from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+The PDF page workers are started with `spawn`, which re-imports this script in each of them, so
+nothing is imported here at module level: `app` (see `app.server`) is only loaded when asked for.
+"""
 
-from app.config import (
-    CHUNK_OVERLAP,
-    CHUNK_SIZE,
-    PDF_EXTRACT_IMAGES,
-    RAG_HOST,
-    RAG_PORT,
-    VECTOR_DB_TYPE,
-    LogMiddleware,
-    VectorDBType,
-    debug_mode,
-    logger,
-)
-from app.middleware import security_middleware, timeout_middleware
-from app.routes import document_routes, pgvector_routes
-from app.services.database import PSQLDatabase, ensure_vector_indexes
 
+def __getattr__(name):
+    if name == "app":
+        from app.server import app
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup logic goes here
-    # Create bounded thread pool executor based on CPU cores
-    max_workers = min(int(os.getenv("RAG_THREAD_POOL_SIZE", str(os.cpu_count()))), 8)  # Cap at 8
-    app.state.thread_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-worker")
-    logger.info(f"Initialized thread pool with {max_workers} workers (CPU cores: {os.cpu_count()})")
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    if VECTOR_DB_TYPE == VectorDBType.PGVECTOR:
-        await PSQLDatabase.get_pool()  # Initialize the pool
-        await ensure_vector_indexes()
 
-    yield
-
-    # Cleanup logic
-    logger.info("Shutting down thread pool")
-    app.state.thread_pool.shutdown(wait=True)
-    logger.info("Thread pool shutdown complete")
-
-
-app = FastAPI(lifespan=lifespan, debug=debug_mode)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.add_middleware(LogMiddleware)
-
-app.middleware("http")(timeout_middleware)
-app.middleware("http")(security_middleware)
-
-# Set state variables for use in routes
-app.state.CHUNK_SIZE = CHUNK_SIZE
-app.state.CHUNK_OVERLAP = CHUNK_OVERLAP
-app.state.PDF_EXTRACT_IMAGES = PDF_EXTRACT_IMAGES
-
-# Include routers
-app.include_router(document_routes.router)
-if debug_mode:
-    app.include_router(router=pgvector_routes.router)
-
-
-@app.exception_handler(RequestValidationError)
-async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    body = await request.body()
-    logger.debug("Validation error occurred")
-    logger.debug(f"Raw request body: {body.decode()}")
-    logger.debug(f"Validation errors: {exc.errors()}")
-    return JSONResponse(
-        status_code=422,
-        content={
-            "detail": exc.errors(),
-            "body": body.decode(),
-            "message": "Request validation failed",
-        },
-    )
+if __name__ == "__main__":
+    import uvicorn
 
+    from app.config import RAG_HOST, RAG_PORT
+    from app.server import app
 
-if __name__ == "__main__":
     uvicorn.run(
         app,
         host=RAG_HOST,
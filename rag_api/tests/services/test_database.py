@@ -1,39 +1,262 @@
 import pytest
-from app.services.database import ensure_custom_id_index_on_embedding, PSQLDatabase
+from app.services.database import (
+    _halfvec_from_db,
+    _ann_index_name,
+    _halfvec_to_db,
+    ensure_ann_index,
+    ensure_embedding_storage,
+    ensure_metadata_columns,
+    ensure_text_search_column,
+    ensure_vector_indexes,
+    ivfflat_lists,
+    PSQLDatabase,
+    schema_lock,
+)
 
 # Create dummy classes to simulate a database connection and pool
 class DummyConnection:
-    async def fetchval(self, query, index_name):
-        # Simulate that the index does not exist
-        return False
-    async def execute(self, query):
+    def __init__(self, existing_indexes=(), dimensions=1536, rows=50000):
+        self.existing_indexes = list(existing_indexes)
+        self.columns = []
+        self.dimensions = dimensions
+        self.rows = rows
+        self.executed = []
+        self.text_search_expression = None
+        self.text_search_index_valid = None
+        self.embedding_type = "vector"
+        self.pgvector_version = "0.8.0"
+
+    async def fetch(self, query, *args):
+        if "information_schema.columns" in query:
+            return [{"column_name": column} for column in self.columns]
+        return self.existing_indexes
+
+    async def fetchval(self, query, *args):
+        if "extversion" in query:
+            return self.pgvector_version
+        if "udt_name" in query:
+            return self.embedding_type
+        if "generation_expression" in query:
+            return self.text_search_expression
+        if "indisvalid" in query:
+            return self.text_search_index_valid
+        if "count(*)" in query:
+            return self.rows
+        return self.dimensions
+
+    async def execute(self, query, *args):
+        self.executed.append(" ".join(query.split()))
         return "Executed"
 
 class DummyAcquire:
+    def __init__(self, conn):
+        self.conn = conn
     async def __aenter__(self):
-        return DummyConnection()
+        return self.conn
     async def __aexit__(self, exc_type, exc, tb):
         pass
 
 class DummyPool:
+    def __init__(self, conn):
+        self.conn = conn
     def acquire(self):
-        return DummyAcquire()
+        return DummyAcquire(self.conn)
 
-class DummyDatabase:
-    pool = DummyPool()
+@pytest.fixture
+def dummy_conn(monkeypatch):
+    conn = DummyConnection()
 
-    @classmethod
-    async def get_pool(cls):
-        return cls.pool
+    async def get_pool():
+        return DummyPool(conn)
 
-@pytest.fixture
-def dummy_pool(monkeypatch):
-    monkeypatch.setattr(PSQLDatabase, "get_pool", DummyDatabase.get_pool)
-    return DummyPool()
+    monkeypatch.setattr(PSQLDatabase, "get_pool", get_pool)
+    return conn
 
-import asyncio
 @pytest.mark.asyncio
-async def test_ensure_custom_id_index_on_embedding(monkeypatch, dummy_pool):
-    result = await ensure_custom_id_index_on_embedding()
+async def test_ensure_vector_indexes(dummy_conn):
+    result = await ensure_vector_indexes()
     # If no exceptions are raised, the function worked as expected.
-    assert result is None
\ No newline at end of file
+    assert result is None
+    assert dummy_conn.executed[1:] == [
+        "DROP INDEX IF EXISTS idx_langchain_pg_embedding_file_id",
+        "CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_file_id_chunk_index "
+        "ON langchain_pg_embedding (file_id, chunk_index);",
+        "CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_user_id ON langchain_pg_embedding (user_id);",
+    ]
+
+@pytest.mark.asyncio
+async def test_ensure_metadata_columns_backfills_missing_columns(dummy_conn):
+    dummy_conn.columns = ["uuid", "cmetadata", "file_id"]
+    await ensure_metadata_columns()
+    assert dummy_conn.executed == [
+        "ALTER TABLE langchain_pg_embedding "
+        "ADD COLUMN IF NOT EXISTS user_id TEXT GENERATED ALWAYS AS ((cmetadata->>'user_id')::text) STORED, "
+        "ADD COLUMN IF NOT EXISTS chunk_index INTEGER "
+        "GENERATED ALWAYS AS ((cmetadata->>'chunk_index')::integer) STORED"
+    ]
+
+    dummy_conn.executed.clear()
+    dummy_conn.columns.extend(["user_id", "chunk_index"])
+    await ensure_metadata_columns()
+    assert dummy_conn.executed == []
+
+@pytest.mark.asyncio
+async def test_ensure_ann_index_builds_hnsw_expression_index(dummy_conn):
+    dimensions = await ensure_ann_index("hnsw", "vector_cosine_ops", m=16, ef_construction=64)
+
+    assert dimensions == 1536
+    [statement] = dummy_conn.executed
+    assert statement.startswith(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_langchain_pg_embedding_ann_hnsw_cosine_1536_m16_ef64"
+    )
+    assert "USING hnsw ((embedding::vector(1536)) vector_cosine_ops)" in statement
+    assert "WITH (m = 16, ef_construction = 64)" in statement
+    assert statement.endswith("WHERE vector_dims(embedding) = 1536")
+
+@pytest.mark.asyncio
+async def test_ensure_ann_index_replaces_indexes_built_with_other_settings(dummy_conn):
+    dummy_conn.existing_indexes = [
+        {"name": "idx_langchain_pg_embedding_ann_hnsw_cosine_1536_m16_ef64", "valid": True},
+        {"name": "idx_langchain_pg_embedding_ann_ivfflat_cosine_1536_auto", "valid": False},
+    ]
+
+    assert await ensure_ann_index("hnsw", "vector_cosine_ops", m=16, ef_construction=64) == 1536
+    assert dummy_conn.executed == [
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_langchain_pg_embedding_ann_ivfflat_cosine_1536_auto"
+    ]
+
+    dummy_conn.executed.clear()
+    assert await ensure_ann_index("ivfflat", "vector_l2_ops") == 1536
+    assert dummy_conn.executed[0].startswith("DROP INDEX CONCURRENTLY IF EXISTS idx_langchain_pg_embedding_ann_hnsw")
+    assert "WITH (lists = 50)" in dummy_conn.executed[-1]
+
+    dummy_conn.executed.clear()
+    assert await ensure_ann_index("none", "vector_cosine_ops") is None
+    assert len(dummy_conn.executed) == 2
+
+@pytest.mark.asyncio
+async def test_ensure_ann_index_skips_unindexable_dimensions(dummy_conn):
+    dummy_conn.dimensions = 3072
+    assert await ensure_ann_index("hnsw", "vector_cosine_ops") is None
+    dummy_conn.dimensions = None
+    assert await ensure_ann_index("hnsw", "vector_cosine_ops") is None
+    assert dummy_conn.executed == []
+
+@pytest.mark.asyncio
+async def test_ensure_ann_index_on_quantized_storage(dummy_conn):
+    dummy_conn.dimensions = 3072
+    assert await ensure_ann_index("hnsw", "bit_hamming_ops", storage="binary") == 3072
+    [statement] = dummy_conn.executed
+    assert "idx_langchain_pg_embedding_ann_hnsw_bit_hamming_3072_m16_ef64" in statement
+    assert "USING hnsw ((binary_quantize(embedding)::bit(3072)) bit_hamming_ops)" in statement
+
+    dummy_conn.executed.clear()
+    assert await ensure_ann_index("hnsw", "halfvec_cosine_ops", storage="halfvec") == 3072
+    assert "USING hnsw ((embedding::halfvec(3072)) halfvec_cosine_ops)" in dummy_conn.executed[-1]
+
+def test_ann_index_names_fit_in_a_postgres_identifier():
+    # Short enough names stay readable
+    assert _ann_index_name("hnsw", "cosine", 1536, "m16_ef64") == "idx_langchain_pg_embedding_ann_hnsw_cosine_1536_m16_ef64"
+
+    longest = _ann_index_name("ivfflat", "halfvec_cosine", 3072, "lists10000")
+    assert len(longest) <= 63
+    assert longest.startswith("idx_langchain_pg_embedding_ann_ivfflat_halfvec_cosine_")
+    assert _ann_index_name("hnsw", "halfvec_cosine", 3072, "m16_ef64") != _ann_index_name(
+        "hnsw", "halfvec_cosine", 3072, "m32_ef64"
+    )
+    for index_type in ("hnsw", "ivfflat"):
+        for distance in ("cosine", "l2", "ip", "halfvec_cosine", "halfvec_l2", "halfvec_ip", "bit_hamming"):
+            assert len(_ann_index_name(index_type, distance, 64000, "m100_ef1000")) <= 63
+
+@pytest.mark.asyncio
+async def test_existing_halfvec_index_is_not_rebuilt(dummy_conn):
+    dummy_conn.dimensions = 3072
+    await ensure_ann_index("hnsw", "halfvec_cosine_ops", storage="halfvec")
+    [statement] = dummy_conn.executed
+    index_name = statement.split()[6]
+    assert len(index_name) <= 63
+
+    dummy_conn.executed.clear()
+    dummy_conn.existing_indexes = [{"name": index_name, "valid": True}]
+    assert await ensure_ann_index("hnsw", "halfvec_cosine_ops", storage="halfvec") == 3072
+    assert dummy_conn.executed == []
+
+@pytest.mark.asyncio
+async def test_ensure_embedding_storage_converts_existing_rows(dummy_conn):
+    dummy_conn.existing_indexes = [{"name": "idx_langchain_pg_embedding_ann_hnsw_cosine_1536_m16_ef64", "valid": True}]
+
+    # Binary quantization only happens in the index, full-precision vectors stay
+    await ensure_embedding_storage("binary")
+    assert dummy_conn.executed == []
+
+    await ensure_embedding_storage("halfvec")
+    assert dummy_conn.executed == [
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_langchain_pg_embedding_ann_hnsw_cosine_1536_m16_ef64",
+        "ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE halfvec USING embedding::halfvec",
+    ]
+
+    dummy_conn.executed.clear()
+    dummy_conn.embedding_type = "halfvec"
+    await ensure_embedding_storage("vector")
+    assert dummy_conn.executed[-1] == (
+        "ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector USING embedding::vector"
+    )
+
+    dummy_conn.pgvector_version = "0.6.2"
+    with pytest.raises(ValueError):
+        await ensure_embedding_storage("halfvec")
+    with pytest.raises(ValueError):
+        await ensure_embedding_storage("int8")
+
+def test_halfvec_codec_round_trip():
+    data = _halfvec_to_db([0.5, -1.25, 3.0])
+    assert data[:4] == b"\x00\x03\x00\x00" and len(data) == 10
+    assert _halfvec_from_db(data).tolist() == [0.5, -1.25, 3.0]
+
+@pytest.mark.asyncio
+async def test_ensure_text_search_column(dummy_conn):
+    await ensure_text_search_column("simple")
+    assert dummy_conn.executed == [
+        "ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS document_tsv tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, coalesce(document, ''))) STORED",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_langchain_pg_embedding_document_tsv "
+        "ON langchain_pg_embedding USING gin (document_tsv)",
+    ]
+
+    # Up to date
+    dummy_conn.executed.clear()
+    dummy_conn.text_search_expression = "to_tsvector('simple'::regconfig, COALESCE(document, ''::character varying))"
+    dummy_conn.text_search_index_valid = True
+    await ensure_text_search_column("simple")
+    assert dummy_conn.executed == []
+
+    # Another configuration, and an index left invalid by an interrupted build
+    dummy_conn.text_search_index_valid = False
+    await ensure_text_search_column("portuguese")
+    assert dummy_conn.executed[0] == "ALTER TABLE langchain_pg_embedding DROP COLUMN document_tsv"
+    assert "to_tsvector('portuguese'::regconfig" in dummy_conn.executed[1]
+    assert dummy_conn.executed[2:] == [
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_langchain_pg_embedding_document_tsv",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_langchain_pg_embedding_document_tsv "
+        "ON langchain_pg_embedding USING gin (document_tsv)",
+    ]
+
+    with pytest.raises(ValueError):
+        await ensure_text_search_column("simple'; DROP TABLE x; --")
+
+def test_ivfflat_lists():
+    assert ivfflat_lists(10) == 1
+    assert ivfflat_lists(500_000) == 500
+    assert ivfflat_lists(4_000_000) == 2000
+
+
+@pytest.mark.asyncio
+async def test_schema_lock_is_released_when_the_block_raises(dummy_conn):
+    with pytest.raises(RuntimeError):
+        async with schema_lock("langchain_pg_embedding"):
+            assert dummy_conn.executed == ["SELECT pg_advisory_lock(hashtext($1))"]
+            raise RuntimeError("index build failed")
+    assert dummy_conn.executed == [
+        "SELECT pg_advisory_lock(hashtext($1))",
+        "SELECT pg_advisory_unlock(hashtext($1))",
+    ]
@@ -0,0 +1,158 @@
+import pytest
+
+from app.services.embedding_cache import ChunkEmbeddingCache
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    async def aembed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ChunkEmbeddingCache(model="test:model", max_entries=10, ttl_seconds=60)
+    stored = {}
+
+    async def get_many(digests):
+        return {digest: stored[digest] for digest in digests if digest in stored}
+
+    async def put_many(embeddings):
+        stored.update(embeddings)
+
+    monkeypatch.setattr(cache, "get_many", get_many)
+    monkeypatch.setattr(cache, "put_many", put_many)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_only_unseen_digests_are_embedded(cache):
+    embeddings = CountingEmbeddings()
+
+    first = await cache.aembed_documents(embeddings, ["a", "bb", "a"], ["d1", "d2", "d1"])
+    second = await cache.aembed_documents(embeddings, ["bb", "ccc"], ["d2", "d3"])
+
+    assert first == [[1.0], [2.0], [1.0]]
+    assert second == [[2.0], [3.0]]
+    assert embeddings.calls == [["a", "bb"], ["ccc"]]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+
+
+@pytest.mark.asyncio
+async def test_lookup_errors_fall_back_to_provider(cache, monkeypatch):
+    async def broken_get_many(digests):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(cache, "get_many", broken_get_many)
+    embeddings = CountingEmbeddings()
+
+    assert await cache.aembed_documents(embeddings, ["a"], ["d1"]) == [[1.0]]
+    assert cache.stats()["errors"] == 1
+
+
+class CacheTableConnection:
+    """Rows of `rag_embedding_cache` by model; applies the eviction DELETEs to them."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def execute(self, query, *args):
+        query = " ".join(query.split())
+        # Without a model filter, the statements apply to every model in the table
+        candidates = [row for row in self.rows if "model = $1" not in query or row["model"] == args[0]]
+        if "make_interval" in query:
+            doomed = [row for row in candidates if row["idle_seconds"] > args[-1]]
+        else:
+            doomed = sorted(candidates, key=lambda row: row["idle_seconds"])[args[-1] :]
+        self.rows = [row for row in self.rows if row not in doomed]
+        return f"DELETE {len(doomed)}"
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_eviction_only_touches_its_own_model(monkeypatch):
+    hour = 3600
+    conn = CacheTableConnection(
+        [{"model": "test:model", "digest": f"chunk{i}", "idle_seconds": 2 * hour} for i in range(3)]
+        + [{"model": "test:model:query", "digest": "stale", "idle_seconds": 2 * hour}]
+        + [{"model": "test:model:query", "digest": f"query{i}", "idle_seconds": i} for i in range(3)]
+    )
+    chunks = ChunkEmbeddingCache(model="test:model", max_entries=100, ttl_seconds=30 * 24 * hour)
+    queries = ChunkEmbeddingCache(model="test:model:query", max_entries=2, ttl_seconds=hour)
+
+    async def pool():
+        return conn
+
+    monkeypatch.setattr(chunks, "_pool", pool)
+    monkeypatch.setattr(queries, "_pool", pool)
+
+    assert await queries.evict() == 2
+    assert sorted(row["digest"] for row in conn.rows) == ["chunk0", "chunk1", "chunk2", "query0", "query1"]
+
+    assert await chunks.evict() == 0
+    assert len(conn.rows) == 5
+
+
+class CacheLookupConnection:
+    """Rows of `rag_embedding_cache` with their idle time; records the statements run against them."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.updated = []
+
+    async def fetch(self, query, model, digests, ttl_seconds, touch_interval_seconds):
+        assert query.split()[0] == "SELECT"
+        return [
+            {"digest": row["digest"], "embedding": row["embedding"], "stale": row["idle_seconds"] > touch_interval_seconds}
+            for row in self.rows
+            if row["model"] == model and row["digest"] in digests and row["idle_seconds"] < ttl_seconds
+        ]
+
+    async def execute(self, query, model, digests):
+        assert query.split()[0] == "UPDATE"
+        self.updated.append(sorted(digests))
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_lookups_only_refresh_entries_not_used_recently(monkeypatch):
+    conn = CacheLookupConnection(
+        [
+            {"model": "test:model", "digest": "fresh", "embedding": [1.0], "idle_seconds": 10},
+            {"model": "test:model", "digest": "idle", "embedding": [2.0], "idle_seconds": 600},
+            {"model": "test:model", "digest": "expired", "embedding": [3.0], "idle_seconds": 7200},
+        ]
+    )
+    cache = ChunkEmbeddingCache(model="test:model", max_entries=10, ttl_seconds=3600, ingestion=False)
+    assert cache.touch_interval_seconds == 360
+
+    async def pool():
+        return conn
+
+    monkeypatch.setattr(cache, "_pool", pool)
+
+    assert await cache.get_many(["fresh", "idle", "expired"]) == {"fresh": [1.0], "idle": [2.0]}
+    assert conn.updated == [["idle"]]
+
+    assert await cache.get_many(["fresh"]) == {"fresh": [1.0]}
+    assert conn.updated == [["idle"]]
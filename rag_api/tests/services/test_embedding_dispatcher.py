@@ -0,0 +1,242 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain_openai import OpenAIEmbeddings
+
+from app.services.embedding_dispatcher import EmbeddingCoalescer, EmbeddingDispatcher, is_rate_limit_error
+
+
+class FakeEmbeddingsServer(ThreadingHTTPServer):
+    """
+    OpenAI-compatible `/v1/embeddings` endpoint that answers 429 to requests with more than
+    `max_inputs` texts, or while more than `max_concurrent` requests are in flight.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, max_inputs=1000, max_concurrent=1000, delay=0.0):
+        super().__init__(("127.0.0.1", 0), FakeEmbeddingsHandler)
+        self.max_inputs = max_inputs
+        self.max_concurrent = max_concurrent
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.served = []
+        self.throttled = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"]
+        with server.lock:
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+            throttled = len(texts) > server.max_inputs or server.in_flight > server.max_concurrent
+        try:
+            time.sleep(server.delay)
+            if throttled:
+                with server.lock:
+                    server.throttled += 1
+                self.reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "0"})
+                return
+            with server.lock:
+                server.served.append(len(texts))
+            data = []
+            for index, text in enumerate(texts):
+                vector = [float(len(text)), float(index)]
+                if body.get("encoding_format") == "base64":
+                    vector = base64.b64encode(array("f", vector).tobytes()).decode()
+                data.append({"object": "embedding", "index": index, "embedding": vector})
+            usage = {"prompt_tokens": len(texts), "total_tokens": len(texts)}
+            self.reply(200, {"object": "list", "model": body["model"], "data": data, "usage": usage})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def reply(self, status, payload, headers=None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def fake_server():
+    servers = []
+
+    def start(**kwargs):
+        server = FakeEmbeddingsServer(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def openai_client(server):
+    return OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        api_key="test",
+        base_url=server.url,
+        max_retries=0,
+        chunk_size=1000,
+        check_embedding_ctx_length=False,
+    )
+
+
+def dispatcher(server, **kwargs):
+    return EmbeddingDispatcher(openai_client(server), provider="openai", length_function=len, **kwargs)
+
+
+def test_batches_by_tokens_concurrently_in_order(fake_server):
+    server = fake_server(delay=0.05)
+    embeddings = dispatcher(server, concurrency=4, batch_tokens=20, max_batch_size=3)
+    texts = [f"text {i:02d}" for i in range(24)]
+
+    vectors = asyncio.run(embeddings.aembed_documents(texts))
+
+    # 7-character texts: two per 20-token batch, returned in input order
+    assert server.served == [2] * 12
+    assert [vector[1] for vector in vectors] == [0.0, 1.0] * 12
+    assert server.peak == 4
+    stats = embeddings.stats()
+    assert stats["requests"] == 12 and stats["texts"] == 24 and stats["tokens"] == 24 * 7
+    assert stats["retries"] == 0 and stats["texts_per_second"] > 0
+
+
+def test_rate_limits_shrink_batches_then_grow_back(fake_server):
+    server = fake_server(max_inputs=4)
+    embeddings = dispatcher(server, concurrency=2, batch_tokens=100, max_batch_tokens=100, grow_after=5)
+    texts = [f"chunk {i:03d}" for i in range(40)]
+
+    vectors = asyncio.run(embeddings.aembed_documents(texts))
+
+    assert len(vectors) == 40 and [vector[0] for vector in vectors] == [9.0] * 40
+    assert server.throttled > 0 and max(server.served) <= 4
+    stats = embeddings.stats()
+    assert stats["rate_limited"] == server.throttled and stats["retries"] == server.throttled
+    assert stats["errors"] == 0
+    # Halved on the 429s down to 2 texts per request, then grown by a quarter per 5 successful requests
+    assert max(server.served) == 2
+    assert 25 < stats["batch_tokens"] < 100
+
+    served = len(server.served)
+    asyncio.run(embeddings.aembed_documents(texts))
+    assert max(server.served[served:]) > 2
+
+
+def test_concurrency_throttling_and_retry_exhaustion(fake_server):
+    server = fake_server(max_concurrent=1, delay=0.05)
+    embeddings = dispatcher(server, concurrency=3, batch_tokens=10, max_retries=8, backoff_seconds=0.01)
+
+    vectors = asyncio.run(embeddings.aembed_documents([f"text {i}" for i in range(6)]))
+    assert len(vectors) == 6
+    assert embeddings.stats()["rate_limited"] > 0
+
+    always_throttled = fake_server(max_inputs=0)
+    embeddings = dispatcher(always_throttled, max_retries=2)
+    with pytest.raises(Exception) as error:
+        asyncio.run(embeddings.aembed_documents(["a", "b"]))
+    assert is_rate_limit_error(error.value)
+    assert embeddings.stats()["errors"] == 1 and embeddings.stats()["retries"] == 2
+
+
+def test_query_and_sync_calls_reach_the_provider(fake_server):
+    server = fake_server()
+    embeddings = dispatcher(server)
+
+    assert asyncio.run(embeddings.aembed_query("hello")) == [5.0, 0.0]
+    assert embeddings.embed_documents(["hi", "there"]) == [[2.0, 0.0], [5.0, 1.0]]
+    assert embeddings.model == "text-embedding-3-small"
+    assert embeddings.stats()["requests"] == 1
+
+
+class RecordingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    async def aembed_documents(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(0.01)
+        if "bad" in texts:
+            raise ValueError("input too long")
+        return [[float(len(text))] for text in texts]
+
+
+def test_coalescer_merges_concurrent_calls_and_scatters_vectors():
+    provider = RecordingEmbeddings()
+    coalescer = EmbeddingCoalescer(provider, max_wait_ms=20, max_batch_size=100, length_function=len)
+    uploads = [[f"file {upload} chunk {chunk}" * (upload + 1) for chunk in range(3)] for upload in range(10)]
+
+    async def run():
+        return await asyncio.gather(*(coalescer.aembed_documents(texts) for texts in uploads))
+
+    results = asyncio.run(run())
+
+    assert len(provider.calls) == 1 and len(provider.calls[0]) == 30
+    assert results == [[[float(len(text))] for text in texts] for texts in uploads]
+    assert coalescer.stats()["coalescing"]["calls_per_merged_call"] == 10
+
+
+def test_coalescer_flushes_when_full_and_isolates_failures():
+    provider = RecordingEmbeddings()
+    coalescer = EmbeddingCoalescer(provider, max_wait_ms=1000, max_batch_size=4, length_function=len)
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            coalescer.aembed_documents(["a", "bb"]),
+            coalescer.aembed_documents(["bad", "c"]),
+            return_exceptions=True,
+        )
+        return results, time.perf_counter() - started
+
+    (good, bad), elapsed = asyncio.run(run())
+
+    # Four pending texts send the merged call without waiting out max_wait_ms
+    assert elapsed < 0.5
+    assert good == [[1.0], [2.0]] and isinstance(bad, ValueError)
+    assert provider.calls == [["a", "bb", "bad", "c"], ["a", "bb"], ["bad", "c"]]
+    assert coalescer.stats()["coalescing"]["split_retries"] == 1
+
+
+def test_coalescer_counts_tokens_once_for_the_dispatcher():
+    counted = []
+
+    def length(text):
+        counted.append(text)
+        return len(text)
+
+    dispatcher = EmbeddingDispatcher(RecordingEmbeddings(), provider="openai", batch_tokens=10, length_function=length)
+    coalescer = EmbeddingCoalescer(dispatcher, max_wait_ms=5)
+
+    async def run():
+        return await asyncio.gather(coalescer.aembed_documents(["aaaa", "bbbb"]), coalescer.aembed_documents(["cccc"]))
+
+    assert asyncio.run(run()) == [[[4.0], [4.0]], [[4.0]]]
+    assert counted == ["aaaa", "bbbb", "cccc"]
+    # The dispatcher still batched by the counts it was handed
+    assert dispatcher.embeddings.calls == [["aaaa", "bbbb"], ["cccc"]]
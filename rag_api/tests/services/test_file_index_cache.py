@@ -0,0 +1,176 @@
+import threading
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores.pgvector import DistanceStrategy
+
+from app.services.file_index_cache import FileIndex, FileIndexCache
+
+
+class DummyStore:
+    def __init__(self, files, distance_strategy=DistanceStrategy.COSINE):
+        self.files = files
+        self.distance_strategy_type = distance_strategy
+        self.loads = []
+
+    async def aget_file_embeddings(self, file_id):
+        self.loads.append(file_id)
+        return [
+            {"document": f"{file_id} chunk {row}", "cmetadata": {"file_id": file_id}, "embedding": embedding}
+            for row, embedding in enumerate(self.files.get(file_id, []))
+        ]
+
+
+def make_files(count, rows, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f"file{index}": rng.standard_normal((rows, dim)).astype(np.float32) for index in range(count)}
+
+
+def exact_top_k(files, file_ids, query, k, distance_strategy):
+    """Reference results, computed the way pgvector scores `<=>`, `<->` and `<#>`."""
+    scored = []
+    for file_id in file_ids:
+        for row, embedding in enumerate(files[file_id].astype(np.float64)):
+            if distance_strategy == DistanceStrategy.COSINE:
+                distance = 1 - embedding @ query / (np.linalg.norm(embedding) * np.linalg.norm(query))
+            elif distance_strategy == DistanceStrategy.EUCLIDEAN:
+                distance = np.linalg.norm(embedding - query)
+            else:
+                distance = -(embedding @ query)
+            scored.append((distance, f"{file_id} chunk {row}"))
+    return sorted(scored)[:k]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "distance_strategy",
+    [DistanceStrategy.COSINE, DistanceStrategy.EUCLIDEAN, DistanceStrategy.MAX_INNER_PRODUCT],
+)
+async def test_results_match_exact_search(distance_strategy):
+    files = make_files(3, rows=50)
+    store = DummyStore(files, distance_strategy)
+    cache = FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60)
+    query = np.random.default_rng(1).standard_normal(8)
+
+    results = await cache.asimilarity_search(store, query.tolist(), ["file0", "file2"], k=5)
+    expected = exact_top_k(files, ["file0", "file2"], query, 5, distance_strategy)
+
+    assert [document.page_content for document, _ in results] == [content for _, content in expected]
+    assert [score for _, score in results] == pytest.approx([distance for distance, _ in expected], abs=1e-5)
+
+    await cache.asimilarity_search(store, query.tolist(), ["file0"], k=5)
+    assert store.loads == ["file0", "file2"]
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_respects_memory_budget():
+    files = make_files(3, rows=100)
+    store = DummyStore(files)
+    # Files are the same size; the budget fits two of them
+    file_nbytes = (await FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60).get(store, "file0")).nbytes
+    store.loads.clear()
+    cache = FileIndexCache(max_bytes=2 * file_nbytes + file_nbytes // 2, ttl_seconds=60)
+
+    for file_id in ["file0", "file1", "file0", "file2"]:
+        await cache.asimilarity_search(store, [1.0] * 8, [file_id], k=1)
+
+    stats = cache.stats()
+    assert stats["files"] == 2
+    assert stats["bytes"] <= cache.max_bytes
+    assert stats["evictions"] == 1
+    # file1 was the least recently used
+    await cache.asimilarity_search(store, [1.0] * 8, ["file0"], k=1)
+    assert store.loads == ["file0", "file1", "file2"]
+
+
+@pytest.mark.asyncio
+async def test_invalidation_and_oversized_files():
+    files = make_files(1, rows=100)
+    store = DummyStore(files)
+    cache = FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60)
+
+    await cache.asimilarity_search(store, [1.0] * 8, ["file0"], k=1)
+    cache.invalidate("file0")
+    await cache.asimilarity_search(store, [1.0] * 8, ["file0"], k=1)
+    assert store.loads == ["file0", "file0"]
+    assert cache.stats()["invalidations"] == 1
+
+    small = FileIndexCache(max_bytes=100, ttl_seconds=60)
+    assert await small.asimilarity_search(store, [1.0] * 8, ["file0"], k=1) is None
+    assert await small.asimilarity_search(store, [1.0] * 8, ["file0"], k=1) is None
+    assert store.loads == ["file0", "file0", "file0"]
+    assert small.stats()["files"] == 0
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_a_load_is_not_cached_and_leaves_no_state():
+    files = make_files(1, rows=10)
+    cache = FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60)
+
+    class RacingStore(DummyStore):
+        async def aget_file_embeddings(self, file_id):
+            # A write lands while the embeddings are read
+            cache.invalidate(file_id)
+            return await super().aget_file_embeddings(file_id)
+
+    assert await cache.asimilarity_search(RacingStore(files), [1.0] * 8, ["file0"], k=1) is not None
+    assert cache.stats()["files"] == 0
+
+    for index in range(1000):
+        cache.invalidate(f"file{index}")
+    assert cache._generations == {}
+
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_counts_page_content_and_metadata():
+    files = make_files(1, rows=10)
+    cache = FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60)
+
+    class VerboseStore(DummyStore):
+        async def aget_file_embeddings(self, file_id):
+            records = await super().aget_file_embeddings(file_id)
+            for record in records:
+                record["document"] *= 1000
+            return records
+
+    plain = await cache.get(DummyStore(files), "file0")
+    verbose = await FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60).get(VerboseStore(files), "file0")
+
+    embeddings_nbytes = plain.matrix.nbytes + plain.squared_norms.nbytes
+    assert plain.nbytes > embeddings_nbytes
+    assert verbose.nbytes - embeddings_nbytes > 10 * len("file0 chunk 0") * 1000
+    assert cache.stats()["bytes"] == plain.nbytes
+
+
+@pytest.mark.asyncio
+async def test_large_files_are_built_and_searched_off_the_event_loop(monkeypatch):
+    files = make_files(2, rows=50)
+    store = DummyStore(files)
+    threads = []
+    from_records, distances = FileIndex.from_records.__func__, FileIndex.distances
+
+    def recording_from_records(cls, records, expires_at):
+        threads.append(("build", threading.get_ident()))
+        return from_records(cls, records, expires_at)
+
+    def recording_distances(self, query, distance_strategy):
+        threads.append(("search", threading.get_ident()))
+        return distances(self, query, distance_strategy)
+
+    monkeypatch.setattr(FileIndex, "from_records", classmethod(recording_from_records))
+    monkeypatch.setattr(FileIndex, "distances", recording_distances)
+    query = [1.0] * 8
+
+    small = FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60)
+    assert len(await small.asimilarity_search(store, query, ["file0"], k=3)) == 3
+    assert {thread for _, thread in threads} == {threading.get_ident()}
+
+    threads.clear()
+    cache = FileIndexCache(max_bytes=10 * 1024 * 1024, ttl_seconds=60, offload_min_bytes=1)
+    large = await cache.asimilarity_search(store, query, ["file0", "file1"], k=3)
+    assert [stage for stage, _ in threads] == ["build", "build", "search", "search"]
+    assert threading.get_ident() not in {thread for _, thread in threads}
+    expected = exact_top_k(files, ["file0", "file1"], np.asarray(query), 3, DistanceStrategy.COSINE)
+    assert [document.page_content for document, _ in large] == [content for _, content in expected]
@@ -0,0 +1,198 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.models import CleanupMethod
+from app.services.ingestion import generate_digest, run_ingestion_pipeline, split_with_positions, store_documents
+
+
+class DummyEmbeddings:
+    def __init__(self):
+        self.batches = []
+
+    async def aembed_documents(self, texts):
+        self.batches.append(len(texts))
+        await asyncio.sleep(0)
+        return [[float(len(text))] for text in texts]
+
+
+class DummyStore:
+    def __init__(self, fail_on_insert=False):
+        self.embedding_function = DummyEmbeddings()
+        self.rows = []
+        self.deleted = []
+        self.fail_on_insert = fail_on_insert
+
+    async def get_filtered_ids(self, ids, executor=None):
+        return []
+
+    async def aadd_embeddings(self, texts, embeddings, metadatas=None, ids=None, executor=None):
+        if self.fail_on_insert:
+            raise RuntimeError("insert failed")
+        self.rows.extend(zip(texts, embeddings, metadatas))
+        return ids
+
+    async def delete(self, ids=None, executor=None):
+        self.deleted.extend(ids)
+
+
+class DummyCopyStore(DummyStore):
+    def __init__(self):
+        super().__init__()
+        self.copy_calls = 0
+
+    async def acopy_embeddings(self, rows, batch_size=None):
+        self.copy_calls += 1
+        async for custom_id, text, metadata, embedding in rows:
+            self.rows.append((text, embedding, metadata))
+        return len(self.rows)
+
+
+class DummyTableStore(DummyStore):
+    """Keeps rows by uuid like `langchain_pg_embedding`, for replacing a stored file."""
+
+    def __init__(self):
+        super().__init__()
+        self.table = {}
+
+    async def aget_file_chunks(self, file_id):
+        rows = [(row_uuid, metadata) for row_uuid, (_, metadata) in self.table.items() if metadata["file_id"] == file_id]
+        return sorted(rows, key=lambda row: row[1]["chunk_index"])
+
+    async def acopy_embeddings(self, rows, batch_size=None, changes=None):
+        async for custom_id, text, metadata, embedding in rows:
+            self.table[f"uuid-{len(self.table)}-{text}"] = (text, metadata)
+        if changes is not None:
+            chunk_changes = changes()
+            for row_uuid in chunk_changes.delete:
+                del self.table[row_uuid]
+            for row_uuid, metadata in chunk_changes.metadata.items():
+                self.table[row_uuid] = (self.table[row_uuid][0], metadata)
+
+
+def generate_pages(count):
+    for page in range(count):
+        yield Document(page_content=f"page {page} " + "lorem ipsum " * 20, metadata={"page": page})
+
+
+@pytest.mark.asyncio
+async def test_pipeline_streams_chunks_in_batches():
+    store = DummyStore()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=0)
+    ids = await run_ingestion_pipeline(
+        generate_pages(10), store, splitter, file_id="file1", user_id="user1", batch_size=8, queue_size=1
+    )
+
+    assert len(ids) == len(store.rows) > 10
+    assert ids == ["file1"] * len(ids)
+    assert max(store.embedding_function.batches) <= 8
+    text, embedding, metadata = store.rows[0]
+    assert metadata["file_id"] == "file1"
+    assert metadata["user_id"] == "user1"
+    assert metadata["digest"] == generate_digest(text)
+    assert metadata["page"] == 0
+    assert embedding == [float(len(text))]
+
+
+@pytest.mark.asyncio
+async def test_store_documents_rolls_back_new_file_on_failure():
+    store = DummyStore(fail_on_insert=True)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=0)
+
+    with pytest.raises(RuntimeError):
+        await store_documents(generate_pages(3), store, splitter, file_id="file1")
+
+    assert store.deleted == ["file1"]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_streams_all_chunks_into_one_bulk_insert():
+    store = DummyCopyStore()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=0)
+    progress = []
+
+    async def report(stage, **counters):
+        progress.append(counters["chunks_stored"])
+
+    ids = await run_ingestion_pipeline(
+        generate_pages(10), store, splitter, file_id="file1", batch_size=8, queue_size=1, progress=report
+    )
+
+    assert store.copy_calls == 1
+    assert len(ids) == len(store.rows) > 10
+    assert progress == sorted(progress) and progress[-1] == len(ids)
+
+
+def test_split_with_positions_numbers_chunks_and_records_offsets():
+    pages = list(generate_pages(3))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=60, chunk_overlap=20)
+    chunks = list(split_with_positions(pages, splitter))
+    full_text = "".join(page.page_content for page in pages)
+
+    assert [chunk.metadata["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert full_text[chunk.metadata["start_index"] : chunk.metadata["end_index"]] == chunk.page_content
+    # Overlapping chunks within a page, none across pages
+    assert any(b.metadata["start_index"] < a.metadata["end_index"] for a, b in zip(chunks, chunks[1:]))
+    starts = [chunk.metadata["start_index"] for chunk in chunks]
+    assert starts == sorted(starts)
+
+
+@pytest.mark.asyncio
+async def test_incremental_update_only_embeds_changed_chunks():
+    store = DummyTableStore()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=0)
+    pages = list(generate_pages(5))
+    await store_documents(pages, store, splitter, file_id="file1", cleanup=CleanupMethod.incremental)
+    original_chunks = len(store.table)
+
+    # Insert a page at the start and drop the last one
+    edited = [Document(page_content="a brand new introduction", metadata={"page": 0})] + pages[:4]
+    counters = {}
+    ids = await store_documents(
+        edited, store, splitter, file_id="file1", cleanup=CleanupMethod.incremental, counters=counters
+    )
+
+    expected = list(split_with_positions(edited, splitter))
+    stored = sorted(store.table.values(), key=lambda row: row[1]["chunk_index"])
+    assert [text for text, _ in stored] == [chunk.page_content for chunk in expected]
+    assert [metadata["chunk_index"] for _, metadata in stored] == list(range(len(expected)))
+    assert len(ids) == len(expected)
+    assert counters["chunks_embedded"] == 1
+    assert counters["chunks_reused"] == len(expected) - 1
+    assert counters["chunks_deleted"] == original_chunks - counters["chunks_reused"]
+
+    counters = {}
+    await store_documents(edited, store, splitter, file_id="file1", cleanup=CleanupMethod.full, counters=counters)
+    assert counters["chunks_reused"] == 0
+    assert counters["chunks_deleted"] == counters["chunks_embedded"] == len(expected) == len(store.table)
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_are_not_counted_as_embedded(monkeypatch):
+    from app.services.embedding_cache import ChunkEmbeddingCache
+
+    cache = ChunkEmbeddingCache(model="test:model", max_entries=100, ttl_seconds=60)
+    stored = {}
+
+    async def get_many(digests):
+        return {digest: stored[digest] for digest in digests if digest in stored}
+
+    async def put_many(embeddings):
+        stored.update(embeddings)
+
+    monkeypatch.setattr(cache, "get_many", get_many)
+    monkeypatch.setattr(cache, "put_many", put_many)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=0)
+
+    for file_id, pages in (("file1", 2), ("file2", 3)):
+        store, counters = DummyStore(), {}
+        await run_ingestion_pipeline(
+            generate_pages(pages), store, splitter, file_id=file_id, embedding_cache=cache, counters=counters
+        )
+        # Only chunks sent to the provider are embedded; repeated and already cached ones are not
+        assert counters["chunks_embedded"] == sum(store.embedding_function.batches)
+        assert counters["chunks_embedded"] + counters["chunks_cached"] == counters["chunks_stored"]
+        assert counters["chunks_cached"] > 0
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from app.models import IngestionJob, JobStatus
+from app.services.jobs import InMemoryJobStore, JobManager, new_job_id
+
+
+def make_job():
+    return IngestionJob(job_id=new_job_id(), file_id="file1", user_id="user1", filename="test.txt")
+
+
+async def wait_for_status(store, job_id, expected):
+    for _ in range(100):
+        job = await store.get(job_id)
+        if job.status == expected:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} never reached {expected}")
+
+
+@pytest.mark.asyncio
+async def test_job_manager_reports_progress_and_result():
+    async def handler(job, report):
+        await report(stage="embedding", chunks_stored=3)
+        return {"file_id": job.file_id, "chunks": 3}
+
+    manager = JobManager(InMemoryJobStore(), handler=handler, workers=1)
+    await manager.start()
+    try:
+        job = await manager.submit(make_job())
+        finished = await wait_for_status(manager.store, job.job_id, JobStatus.completed)
+    finally:
+        await manager.stop()
+
+    assert finished.stage == "completed"
+    assert finished.progress == {"chunks_stored": 3}
+    assert finished.result == {"file_id": "file1", "chunks": 3}
+
+
+@pytest.mark.asyncio
+async def test_job_manager_records_failures():
+    async def handler(job, report):
+        raise RuntimeError("embedding provider unavailable")
+
+    manager = JobManager(InMemoryJobStore(), handler=handler, workers=1)
+    await manager.start()
+    try:
+        job = await manager.submit(make_job())
+        failed = await wait_for_status(manager.store, job.job_id, JobStatus.failed)
+    finally:
+        await manager.stop()
+
+    assert failed.error == "embedding provider unavailable"
+
+
+@pytest.mark.asyncio
+async def test_in_memory_store_prunes_only_old_finished_jobs():
+    store = InMemoryJobStore()
+    finished, running = make_job(), make_job()
+    await store.create(finished)
+    await store.create(running)
+    await store.update(finished.job_id, status=JobStatus.completed)
+    await store.update(running.job_id, status=JobStatus.running)
+
+    assert await store.prune(retention_seconds=3600) == 0
+    assert await store.prune(retention_seconds=0) == 1
+    assert await store.get(finished.job_id) is None
+    assert (await store.get(running.job_id)).status == JobStatus.running
+
+
+@pytest.mark.asyncio
+async def test_job_that_cannot_start_is_discarded():
+    class BrokenStore(InMemoryJobStore):
+        async def update(self, job_id, **fields):
+            raise ConnectionError("database unavailable")
+
+    handled, discarded = [], []
+
+    async def handler(job, report):
+        handled.append(job.job_id)
+
+    async def discard(job):
+        discarded.append(job.job_id)
+
+    store = BrokenStore()
+    manager = JobManager(store, handler=handler, workers=1, discard=discard)
+    await manager.start()
+    try:
+        job = await manager.submit(make_job())
+        assert [job.job_id for job in await store.unfinished()] == [job.job_id]
+        for _ in range(100):
+            if discarded:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await manager.stop()
+
+    assert discarded == [job.job_id] and handled == []
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from prometheus_client import REGISTRY
+
+from app.services.metrics import timed_stage, track_db_pool, track_thread_pool
+
+
+class FakePool:
+    def get_size(self):
+        return 5
+
+    def get_idle_size(self):
+        return 2
+
+    def get_max_size(self):
+        return 10
+
+
+def test_pool_gauges_are_read_on_scrape():
+    pool = None
+    track_db_pool(lambda: pool)
+    assert REGISTRY.get_sample_value("rag_db_pool_connections", {"state": "in_use"}) == 0
+
+    pool = FakePool()
+    assert REGISTRY.get_sample_value("rag_db_pool_connections", {"state": "in_use"}) == 3
+    assert REGISTRY.get_sample_value("rag_db_pool_connections", {"state": "idle"}) == 2
+    assert REGISTRY.get_sample_value("rag_db_pool_max_connections") == 10
+
+    release = Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        track_thread_pool(executor)
+        for _ in range(3):
+            executor.submit(release.wait)
+        assert REGISTRY.get_sample_value("rag_thread_pool_queue_depth") == 2
+        release.set()
+
+
+def test_timed_stage_observes_failures():
+    before = REGISTRY.get_sample_value("rag_stage_duration_seconds_count", {"stage": "preprocess"}) or 0
+    try:
+        with timed_stage("preprocess"):
+            raise ValueError("bad file")
+    except ValueError:
+        pass
+    assert REGISTRY.get_sample_value("rag_stage_duration_seconds_count", {"stage": "preprocess"}) == before + 1
@@ -0,0 +1,96 @@
+import asyncio
+import sys
+
+import pytest
+
+from app.services.query_cache import QueryEmbeddingCache, get_query_cache_backend
+
+
+class SlowEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    async def aembed_query(self, query):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return [float(len(query))]
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        self.batches = getattr(self, "batches", []) + [list(texts)]
+        await asyncio.sleep(0.01)
+        return [[float(len(text))] for text in texts]
+
+
+class DictBackend:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, embedding, ttl_seconds):
+        self.values[key] = embedding
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_provider_call():
+    cache = QueryEmbeddingCache(model="test", max_size=8, ttl_seconds=60)
+    embeddings = SlowEmbeddings()
+
+    results = await asyncio.gather(*(cache.aembed_query(embeddings, "hello") for _ in range(5)))
+
+    assert results == [[5.0]] * 5
+    assert embeddings.calls == 1
+    assert cache.stats()["coalesced"] == 4
+    assert await cache.aembed_query(embeddings, "hello") == [5.0]
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_size_ttl_and_shared_backend():
+    backend = DictBackend()
+    cache = QueryEmbeddingCache(model="test", max_size=1, ttl_seconds=60, backend=backend)
+    embeddings = SlowEmbeddings()
+
+    await cache.aembed_query(embeddings, "a")
+    await cache.aembed_query(embeddings, "bb")
+    assert cache.stats()["size"] == 1
+
+    # "a" was evicted locally, but another worker's cache (the backend) still has it
+    assert await cache.aembed_query(embeddings, "a") == [1.0]
+    assert embeddings.calls == 2
+    assert cache.stats()["shared_hits"] == 1
+
+    expired = QueryEmbeddingCache(model="test", max_size=8, ttl_seconds=-1)
+    await expired.aembed_query(embeddings, "a")
+    await expired.aembed_query(embeddings, "a")
+    assert expired.stats()["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_embeds_all_misses_in_one_call():
+    embeddings = SlowEmbeddings()
+    backend = DictBackend()
+    cache = QueryEmbeddingCache(model="m", max_size=10, ttl_seconds=60, backend=backend, batch_queries=True)
+    await cache.aembed_query(embeddings, "a")
+    embeddings.calls = 0
+
+    in_flight = asyncio.ensure_future(cache.aembed_query(embeddings, "cccc"))
+    await asyncio.sleep(0)
+    results = await cache.aembed_queries(embeddings, ["a", "bb", "cccc", "bb", "ddd"])
+    await in_flight
+
+    assert results == [[1.0], [2.0], [4.0], [2.0], [3.0]]
+    # "a" is cached and "cccc" joins the in-flight call, so only "bb" and "ddd" are sent, together
+    assert embeddings.batches == [["bb", "ddd"]]
+    assert embeddings.calls == 2
+    assert len(backend.values) == 4
+
+
+def test_redis_backend_without_the_redis_package_fails_with_a_config_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", None)
+
+    with pytest.raises(ValueError, match="RAG_QUERY_CACHE_BACKEND=redis requires the `redis` package"):
+        get_query_cache_backend("redis", "test")
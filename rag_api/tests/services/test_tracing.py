@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services.tracing import (
+    SPAN_EXPORTERS,
+    SpanExporter,
+    current_span,
+    get_span_exporter,
+    parse_trace_header,
+    register_span_exporter,
+    span,
+    traced,
+    tracer,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+class RecordingExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter():
+    recording = RecordingExporter()
+    tracer.start(recording, interval=60)
+    yield recording
+    tracer.shutdown()
+
+
+def test_parse_trace_header():
+    assert parse_trace_header(f"00-{TRACE_ID}-00f067aa0ba902b7-01") == (TRACE_ID, "00f067aa0ba902b7")
+    assert parse_trace_header(None, TRACE_ID.upper()) == (TRACE_ID, None)
+    assert parse_trace_header(f"00-{'0' * 32}-00f067aa0ba902b7-01") == (None, None)
+    assert parse_trace_header("garbage", "not-a-trace-id") == (None, None)
+
+
+def test_spans_nest_across_tasks_and_record_errors(exporter):
+    @traced("store.search")
+    async def search():
+        await asyncio.sleep(0)
+        return current_span().name
+
+    async def run():
+        with span("request", trace_id=TRACE_ID, parent_id="00f067aa0ba902b7"):
+            names = await asyncio.gather(search(), search())
+            with pytest.raises(ValueError):
+                with span("preprocess", pages=3):
+                    raise ValueError("bad page")
+        return names
+
+    assert asyncio.run(run()) == ["store.search", "store.search"]
+    assert current_span() is None
+    tracer.flush()
+
+    request = next(item for item in exporter.spans if item.name == "request")
+    assert request.parent_id == "00f067aa0ba902b7"
+    assert all(item.trace_id == TRACE_ID for item in exporter.spans)
+    assert [item.parent_id for item in exporter.spans if item.name == "store.search"] == [request.span_id] * 2
+    failed = next(item for item in exporter.spans if item.name == "preprocess")
+    assert failed.error == "ValueError: bad page"
+    assert failed.to_otlp()["status"] == {"code": 2, "message": "ValueError: bad page"}
+    assert failed.to_otlp()["attributes"] == [{"key": "pages", "value": {"intValue": "3"}}]
+
+
+def test_file_exporter_writes_otlp_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer.start(get_span_exporter("file", file_path=str(path), otlp_endpoint="unused"), interval=60)
+    with span("embed", chunks=64):
+        pass
+    tracer.shutdown()
+
+    [line] = path.read_text().splitlines()
+    [resource_spans] = json.loads(line)["resourceSpans"]
+    [exported] = resource_spans["scopeSpans"][0]["spans"]
+    assert exported["name"] == "embed" and len(exported["traceId"]) == 32 and len(exported["spanId"]) == 16
+    assert int(exported["endTimeUnixNano"]) >= int(exported["startTimeUnixNano"])
+    assert tracer.stats()["exported"] >= 1
+
+
+def test_custom_exporters_and_unknown_names():
+    @register_span_exporter("recording")
+    def recording_exporter(**options):
+        return RecordingExporter()
+
+    try:
+        assert isinstance(get_span_exporter("recording", file_path="unused"), RecordingExporter)
+        assert get_span_exporter("none") is None
+        with pytest.raises(ValueError):
+            get_span_exporter("zipkin")
+    finally:
+        del SPAN_EXPORTERS["recording"]
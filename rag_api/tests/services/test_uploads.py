@@ -0,0 +1,175 @@
+import io
+import os
+import tempfile
+
+import pytest
+from starlette import formparsers
+from starlette.datastructures import UploadFile
+
+from app.services import uploads
+from app.services.uploads import (
+    SpooledUpload,
+    UploadBudget,
+    UploadBudgetExceeded,
+    UploadSpoolFile,
+    spool_uploads_in_upload_dir,
+    sweep_uploads,
+)
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "RAG_UPLOAD_DIR", str(tmp_path))
+    return tmp_path
+
+
+def upload_file(content: bytes, filename: str = "report.pdf") -> UploadFile:
+    return UploadFile(io.BytesIO(content), size=len(content), filename=filename)
+
+
+@pytest.mark.asyncio
+async def test_small_upload_stays_in_memory_until_a_path_is_needed(upload_dir):
+    budget = UploadBudget(memory_bytes=1024, disk_bytes=1024)
+    async with SpooledUpload("notes.txt", "user", budget) as upload:
+        await upload.receive(upload_file(b"hello", "notes.txt"), memory_max=100)
+        assert upload.buffer == b"hello"
+        assert upload.path is None
+        assert budget.in_use == {"memory": 5, "disk": 0}
+
+        path = upload.ensure_file()
+        assert upload.ensure_file() == path
+        assert os.path.basename(path) == "notes.txt"
+        with open(path, "rb") as spooled:
+            assert spooled.read() == b"hello"
+
+    assert not os.path.exists(path)
+    assert os.listdir(upload_dir / "user") == []
+    assert budget.in_use == {"memory": 0, "disk": 0}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_of_the_same_file_do_not_collide():
+    budget = UploadBudget(memory_bytes=0, disk_bytes=1024)
+    async with SpooledUpload("report.pdf", "user", budget) as first, SpooledUpload("report.pdf", "user", budget) as second:
+        await first.receive(upload_file(b"first"))
+        await second.receive(upload_file(b"second"))
+        assert first.path != second.path
+        with open(first.path, "rb") as spooled:
+            assert spooled.read() == b"first"
+        assert budget.stats()["spooled"] == 2
+        assert budget.in_use["disk"] == 11
+    assert budget.in_use["disk"] == 0
+
+
+@pytest.mark.asyncio
+async def test_upload_over_the_disk_budget_is_refused_and_cleaned_up(upload_dir):
+    budget = UploadBudget(memory_bytes=0, disk_bytes=10)
+    with pytest.raises(UploadBudgetExceeded):
+        async with SpooledUpload("big.bin", "user", budget) as upload:
+            await upload.receive(upload_file(b"x" * 11, "big.bin"))
+    assert budget.stats()["rejected"] == 1
+    assert budget.in_use["disk"] == 0
+    # A known size is refused before anything is written
+    assert not (upload_dir / "user").exists()
+
+    # Without a known size, the stream is cut off once it outgrows the budget
+    stream = UploadFile(io.BytesIO(b"x" * 200_000), filename="big.bin")
+    with pytest.raises(UploadBudgetExceeded):
+        async with SpooledUpload("big.bin", "user", UploadBudget(memory_bytes=0, disk_bytes=100_000)) as upload:
+            await upload.receive(stream)
+    assert os.listdir(upload_dir / "user") == []
+
+
+@pytest.mark.asyncio
+async def test_detached_upload_stays_reserved_until_the_job_that_adopts_it_ends(upload_dir):
+    budget = UploadBudget(memory_bytes=1024, disk_bytes=10)
+    async with SpooledUpload("notes.txt", "user", budget) as upload:
+        await upload.receive(upload_file(b"queued", "notes.txt"), memory_max=100)
+        path = await upload.detach()
+    assert os.path.exists(path)
+    assert budget.in_use == {"memory": 0, "disk": 6}
+    assert budget.stats()["queued"] == 1
+
+    # While it waits for its job, the queued upload leaves no room for another one
+    with pytest.raises(UploadBudgetExceeded):
+        async with SpooledUpload("other.bin", "user", budget) as other:
+            await other.receive(upload_file(b"x" * 5, "other.bin"), memory_max=0)
+
+    async with SpooledUpload("notes.txt", "user", budget) as job_upload:
+        job_upload.adopt(path)
+        assert budget.in_use["disk"] == 6
+        assert budget.stats()["queued"] == 0
+    assert not os.path.exists(path)
+    assert os.listdir(upload_dir / "user") == []
+    assert budget.in_use["disk"] == 0
+
+
+@pytest.mark.asyncio
+async def test_upload_spooled_by_starlette_is_moved_not_copied(upload_dir):
+    spool = UploadSpoolFile(max_size=4)
+    spool.write(b"spooled by starlette")
+    spool.seek(0)
+    incoming = spool.path
+    assert os.path.dirname(incoming) == str(upload_dir)
+
+    budget = UploadBudget(memory_bytes=0, disk_bytes=1024)
+    async with SpooledUpload("report.pdf", "user", budget) as upload:
+        await upload.receive(UploadFile(spool, size=20, filename="report.pdf"))
+        assert not os.path.exists(incoming)
+        assert os.stat(upload.path).st_ino == os.fstat(spool.fileno()).st_ino
+        with open(upload.path, "rb") as spooled:
+            assert spooled.read() == b"spooled by starlette"
+        assert budget.in_use["disk"] == 20
+        # Closing Starlette's file leaves the moved upload alone
+        spool.close()
+        assert os.path.exists(upload.path)
+    assert os.listdir(upload_dir / "user") == []
+
+    # An upload that was never received is removed with Starlette's file
+    unread = UploadSpoolFile(max_size=4)
+    unread.write(b"not received")
+    incoming = unread.path
+    unread.close()
+    assert not os.path.exists(incoming)
+
+
+def test_starlette_is_only_patched_when_its_parser_looks_as_expected(monkeypatch):
+    monkeypatch.setattr(formparsers, "SpooledTemporaryFile", tempfile.SpooledTemporaryFile)
+    assert spool_uploads_in_upload_dir()
+    assert formparsers.SpooledTemporaryFile is UploadSpoolFile
+
+    class OtherSpool(tempfile.SpooledTemporaryFile):
+        pass
+
+    monkeypatch.setattr(formparsers, "SpooledTemporaryFile", OtherSpool)
+    assert not spool_uploads_in_upload_dir()
+    assert formparsers.SpooledTemporaryFile is OtherSpool
+
+    # A Python whose SpooledTemporaryFile keeps its rollover arguments elsewhere
+    def init(self, max_size=0, **kwargs):
+        self._file, self._rolled, self._max_size = io.BytesIO(), False, max_size
+
+    monkeypatch.setattr(formparsers, "SpooledTemporaryFile", tempfile.SpooledTemporaryFile)
+    monkeypatch.setattr(tempfile.SpooledTemporaryFile, "__init__", init)
+    assert not spool_uploads_in_upload_dir()
+    assert formparsers.SpooledTemporaryFile is tempfile.SpooledTemporaryFile
+
+
+@pytest.mark.asyncio
+async def test_sweep_removes_uploads_left_behind_except_those_of_unfinished_jobs(upload_dir):
+    budget = UploadBudget(memory_bytes=0, disk_bytes=1024)
+    paths = []
+    for name in ("lost.txt", "queued.txt", "fresh.txt"):
+        upload = SpooledUpload(name, "user", budget)
+        await upload.receive(upload_file(b"left behind", name))
+        paths.append(await upload.detach())
+    lost, queued, fresh = paths
+    incoming = upload_dir / "incoming-abc"
+    incoming.write_bytes(b"partial")
+    old = os.path.getmtime(lost) - 3600
+    for path in (lost, queued, os.path.dirname(lost), os.path.dirname(queued), incoming):
+        os.utime(path, (old, old))
+
+    assert sweep_uploads(keep=[queued], min_age_seconds=60) == 2
+    assert not os.path.exists(os.path.dirname(lost)) and not incoming.exists()
+    assert os.path.exists(queued) and os.path.exists(fresh)
@@ -1,3 +1,5 @@
+import pytest
+
 from app.services.vector_store.extended_pg_vector import ExtendedPgVector
 
 # Create a dummy subclass that simulates DB responses.
@@ -12,4 +14,322 @@ class DummyPgVector(ExtendedPgVector):
 def test_extended_pgvector_get_all_ids():
     dummy_vector = DummyPgVector()
     ids = dummy_vector.get_all_ids()
-    assert ids == ["id1", "id2"]
\ No newline at end of file
+    assert ids == ["id1", "id2"]
+
+def test_async_pgvector_translates_route_filters():
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    assert AsyncPgVector._filter_clause({"file_id": "f1"}, first_param=4) == (
+        " AND file_id = $4",
+        ["f1"],
+    )
+    assert AsyncPgVector._filter_clause({"file_id": {"$in": ["f1", "f2"]}}, first_param=4) == (
+        " AND file_id = ANY($4::text[])",
+        [["f1", "f2"]],
+    )
+    assert AsyncPgVector._filter_clause({"user_id": "u1", "page": "2"}, first_param=4) == (
+        " AND user_id = $4 AND cmetadata->>'page' = $5",
+        ["u1", "2"],
+    )
+    assert AsyncPgVector._filter_clause(None, first_param=4) == ("", [])
+    # Unsupported shapes fall back to LangChain's filtering
+    assert AsyncPgVector._filter_clause({"page": {"$gt": 1}}, first_param=4) is None
+    assert AsyncPgVector._filter_clause({"file_id'; --": "f1"}, first_param=4) is None
+
+
+class FakeTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        self.conn.transactions += 1
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self):
+        self.transactions = 0
+        self.acquired = 0
+        self.copies = []
+        self.statements = []
+
+    async def execute(self, query, *args):
+        self.statements.append((" ".join(query.split()), args))
+
+    async def fetch(self, query, *args):
+        self.statements.append((" ".join(query.split()), args))
+        return []
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        self.copies.append((table_name, list(records), columns))
+
+
+class FakeAcquire:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        self.conn.acquired += 1
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        self.conn.acquired -= 1
+        return False
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return FakeAcquire(self.conn)
+
+
+def test_async_pgvector_copies_each_batch_in_its_own_transaction(monkeypatch):
+    import asyncio
+    import json
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    conn = FakeConnection()
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store.copy_batch_size = 2
+    store._collection_uuid = "collection"
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(AsyncPgVector, "_get_pool", staticmethod(get_pool))
+
+    ids = asyncio.run(
+        store.aadd_embeddings(
+            texts=["a", "b", "c"],
+            embeddings=[[1.0], [2.0], [3.0]],
+            metadatas=[{"file_id": "f1"}] * 3,
+            ids=["f1"] * 3,
+        )
+    )
+
+    assert ids == ["f1"] * 3
+    assert conn.transactions == 2
+    assert [len(records) for _, records, _ in conn.copies] == [2, 1]
+    table, records, columns = conn.copies[0]
+    assert table == "langchain_pg_embedding"
+    row = dict(zip(columns, records[0]))
+    assert row["collection_id"] == "collection"
+    assert row["embedding"] == [1.0]
+    assert row["document"] == "a"
+    assert json.loads(row["cmetadata"]) == {"file_id": "f1"}
+    assert row["custom_id"] == "f1"
+
+
+def test_async_pgvector_applies_chunk_changes_after_the_copy(monkeypatch):
+    import asyncio
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector, ChunkChanges
+
+    conn = FakeConnection()
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store.copy_batch_size = 10
+    store._collection_uuid = "collection"
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(AsyncPgVector, "_get_pool", staticmethod(get_pool))
+
+    def changes():
+        # Called once every row is copied
+        assert len(conn.copies) == 1
+        return ChunkChanges(delete=["u1"], metadata={"u2": {"chunk_index": 1}})
+
+    asyncio.run(store.acopy_embeddings([("f1", "a", {"chunk_index": 0}, [1.0])], changes=changes))
+
+    assert conn.transactions == 1
+    (delete, delete_args), (update, update_args) = conn.statements
+    assert delete == "DELETE FROM langchain_pg_embedding WHERE uuid = ANY($1::uuid[])"
+    assert delete_args == (["u1"],)
+    assert update.startswith("UPDATE langchain_pg_embedding AS e SET cmetadata")
+    assert update_args == (["u2"], ['{"chunk_index": 1}'])
+
+
+def test_async_pgvector_holds_no_connection_while_rows_are_embedded(monkeypatch):
+    import asyncio
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    conn = FakeConnection()
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store.copy_batch_size = 2
+    store._collection_uuid = "collection"
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(AsyncPgVector, "_get_pool", staticmethod(get_pool))
+    held_while_embedding = []
+
+    async def rows():
+        for index in range(5):
+            # Stands for the embeddings call producing the next row
+            held_while_embedding.append(conn.acquired)
+            await asyncio.sleep(0)
+            if index == 4:
+                raise RuntimeError("embeddings provider unavailable")
+            yield "f1", f"text {index}", {"file_id": "f1"}, [float(index)]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(store.acopy_embeddings(rows()))
+
+    assert held_while_embedding == [0] * 5
+    # The two committed batches are removed again
+    copied = [record[0] for _, records, _ in conn.copies for record in records]
+    assert len(copied) == 4
+    assert conn.statements[-1] == ("DELETE FROM langchain_pg_embedding WHERE uuid = ANY($1::uuid[])", (copied,))
+
+
+def test_async_pgvector_searches_through_the_ann_index(monkeypatch):
+    import asyncio
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    conn = FakeConnection()
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store._distance_strategy = "cosine"
+    store._collection_uuid = "collection"
+    store.configure_ann_search("hnsw", 1536, default=40)
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(AsyncPgVector, "_get_pool", staticmethod(get_pool))
+
+    asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=4, filter={"file_id": "f1"}, ef_search=100))
+
+    (setting, setting_args), (query, query_args) = conn.statements
+    assert setting_args == ("hnsw.ef_search", "100")
+    assert conn.transactions == 1
+    assert "(embedding::vector(1536)) <=> $1 AS distance" in query
+    assert "vector_dims(embedding) = 1536 AND file_id = $4" in query
+    assert query_args == ([0.1], "collection", 4, "f1")
+
+    # pgvector 0.8+: filtered searches scan the index until k rows match
+    conn.statements.clear()
+    store.configure_ann_search("ivfflat", 1536, default=4, iterative_scan=True)
+    asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=4, filter={"file_id": "f1"}))
+
+    (setting, setting_args), (query, query_args) = conn.statements
+    assert setting_args == ("ivfflat.probes", "4", "ivfflat.iterative_scan", "relaxed_order")
+    assert query.startswith("WITH results AS MATERIALIZED (")
+    assert query.endswith("SELECT * FROM results ORDER BY distance")
+
+
+def test_async_pgvector_reranks_binary_quantized_candidates(monkeypatch):
+    import asyncio
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    conn = FakeConnection()
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store._distance_strategy = "cosine"
+    store._collection_uuid = "collection"
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(AsyncPgVector, "_get_pool", staticmethod(get_pool))
+
+    store.configure_embedding_storage("halfvec")
+    assert store.ann_operator_class == "halfvec_cosine_ops"
+    store.configure_ann_search("hnsw", 3072)
+    asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=4))
+    [(query, _)] = conn.statements
+    assert "(embedding::halfvec(3072)) <=> $1 AS distance" in query
+
+    conn.statements.clear()
+    store.configure_embedding_storage("binary", rerank_factor=25)
+    assert store.ann_operator_class == "bit_hamming_ops"
+    asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=8, filter={"file_id": "f1"}))
+    (setting, setting_args), (query, query_args) = conn.statements
+    # ef_search covers the 200 candidates re-ranked by exact distance
+    assert setting_args == ("hnsw.ef_search", "200")
+    assert "ORDER BY (binary_quantize(embedding)::bit(3072)) <~> binary_quantize($1::vector) LIMIT $3 * 25" in query
+    assert query.startswith("SELECT document, cmetadata, embedding <=> $1 AS distance FROM ( SELECT")
+    assert query.endswith(") candidates ORDER BY distance LIMIT $3")
+    assert query_args == ([0.1], "collection", 8, "f1")
+
+    # Without an index, rows of other dimensions are skipped before comparing bits
+    conn.statements.clear()
+    store.configure_ann_search(None, None)
+    asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=4))
+    [(query, _)] = conn.statements
+    assert "vector_dims(embedding) = vector_dims($1::vector)" in query
+    assert "ORDER BY binary_quantize(embedding) <~> binary_quantize($1::vector)" in query
+
+    with pytest.raises(ValueError):
+        store.configure_embedding_storage("int8")
+
+
+def test_async_pgvector_refuses_untranslated_filters_on_halfvec(monkeypatch):
+    import asyncio
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store._distance_strategy = "cosine"
+    store._thread_pool = None
+    fallback = []
+    monkeypatch.setattr(
+        ExtendedPgVector, "similarity_search_with_score_by_vector", lambda self, *args: fallback.append(args) or []
+    )
+
+    # Binary storage keeps `vector` embeddings, so LangChain's search can still compare them
+    store.configure_embedding_storage("binary")
+    asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=4, filter={"page": {"$gt": 1}}))
+    assert len(fallback) == 1
+
+    store.configure_embedding_storage("halfvec")
+    with pytest.raises(ValueError, match="halfvec"):
+        asyncio.run(store.asimilarity_search_with_score_by_vector([0.1], k=4, filter={"page": {"$gt": 1}}))
+    assert len(fallback) == 1
+
+
+def test_async_pgvector_hybrid_search_fuses_in_one_query(monkeypatch):
+    import asyncio
+
+    from app.services.vector_store.async_pg_vector import AsyncPgVector
+
+    conn = FakeConnection()
+    store = AsyncPgVector.__new__(AsyncPgVector)
+    store._distance_strategy = "cosine"
+    store._collection_uuid = "collection"
+    store.configure_ann_search(None, None)
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(AsyncPgVector, "_get_pool", staticmethod(get_pool))
+
+    # Without the full-text column it is a vector search
+    store.configure_text_search(None)
+    asyncio.run(store.ahybrid_search_with_score_by_vector([0.1], "TI.AG.00.002", k=4, filter={"file_id": "f1"}))
+    [(query, query_args)] = conn.statements
+    assert "document_tsv" not in query and query_args == ([0.1], "collection", 4, "f1")
+
+    conn.statements.clear()
+    store.configure_text_search("simple")
+    asyncio.run(
+        store.ahybrid_search_with_score_by_vector(
+            [0.1], "TI.AG.00.002", k=4, filter={"file_id": {"$in": ["f1", "f2"]}}, candidates=20, rrf_k=60
+        )
+    )
+    [(query, query_args)] = conn.statements
+    assert query_args == ([0.1], "collection", 60, 20, "TI.AG.00.002", "simple", 4, ["f1", "f2"])
+    assert query.count("file_id = ANY($8::text[])") == 2
+    assert "document_tsv @@ terms" in query and "FULL OUTER JOIN lexical" in query
+    assert "SELECT e.document, e.cmetadata, e.embedding <=> $1 AS distance" in query
@@ -1,3 +1,4 @@
+import json
 import os
 import jwt
 import datetime
@@ -43,10 +44,21 @@ def override_vector_store(monkeypatch):
         ]
     monkeypatch.setattr(vector_store, "get_documents_by_ids", dummy_get_documents_by_ids)
 
+    async def dummy_aiter_documents(file_id, prefetch=200):
+        for doc in await dummy_get_documents_by_ids([file_id]):
+            yield doc
+    monkeypatch.setattr(vector_store, "aiter_documents", dummy_aiter_documents)
+
     # Override embedding_function.
     class DummyEmbedding:
         def embed_query(self, query):
             return [0.1, 0.2, 0.3]
+
+        async def aembed_query(self, query):
+            return [0.1, 0.2, 0.3]
+
+        async def aembed_documents(self, texts):
+            return [[0.1, 0.2, 0.3] for _ in texts]
     vector_store.embedding_function = DummyEmbedding()
 
     # Override similarity search to return a tuple (Document, score).
@@ -62,6 +74,14 @@ def override_vector_store(monkeypatch):
         dummy_similarity_search_with_score_by_vector,
     )
 
+    async def dummy_asimilarity_search_with_score_by_vector(embedding, k, filter, executor=None, ef_search=None, probes=None):
+        return dummy_similarity_search_with_score_by_vector(embedding, k, filter)
+    monkeypatch.setattr(
+        vector_store,
+        "asimilarity_search_with_score_by_vector",
+        dummy_asimilarity_search_with_score_by_vector,
+    )
+
     # Override document addition functions.
     def dummy_add_documents(docs, ids):
         return ids
@@ -70,8 +90,20 @@ def override_vector_store(monkeypatch):
     monkeypatch.setattr(vector_store, "add_documents", dummy_add_documents)
     monkeypatch.setattr(vector_store, "aadd_documents", dummy_aadd_documents)
 
+    async def dummy_aadd_embeddings(texts, embeddings, metadatas=None, ids=None, executor=None):
+        return ids
+    monkeypatch.setattr(vector_store, "aadd_embeddings", dummy_aadd_embeddings)
+
+    async def dummy_acopy_embeddings(rows, batch_size=None):
+        return len([row async for row in rows])
+    monkeypatch.setattr(vector_store, "acopy_embeddings", dummy_acopy_embeddings)
+
+    # Disable the Postgres-backed chunk embedding cache.
+    from app.routes import document_routes
+    monkeypatch.setattr(document_routes, "chunk_embedding_cache", None)
+
     # Override delete function.
-    async def dummy_delete(ids=None, collection_only=False):
+    async def dummy_delete(ids=None, collection_only=False, executor=None):
         return None
     monkeypatch.setattr(vector_store, "delete", dummy_delete)
 
@@ -155,12 +187,39 @@ def test_embed_file(tmp_path, auth_headers):
     assert json_data["status"] is True
     assert json_data["file_id"] == "testid1"
 
+def test_embed_file_unknown_splitter(tmp_path, auth_headers):
+    test_file = tmp_path / "test_embed.txt"
+    test_file.write_text("This is a test file for the embed endpoint.")
+    with test_file.open("rb") as f:
+        response = client.post(
+            "/embed",
+            data={"file_id": "testid1", "entity_id": "testuser", "splitter": "semantic"},
+            files={"file": ("test_embed.txt", f, "text/plain")},
+            headers=auth_headers,
+        )
+    assert response.status_code == 400
+    assert "semantic" in response.json()["detail"]
+
 def test_load_document_context(auth_headers):
     response = client.get("/documents/testid1/context", headers=auth_headers)
     assert response.status_code == 200, f"Response: {response.text}"
     content = response.text
     assert "testid1" in content or "Test content" in content
 
+def test_stream_document_text(auth_headers):
+    response = client.get("/documents/testid1/context?stream=text", headers=auth_headers)
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.text == "Test content"
+
+    response = client.get("/text/testid1?stream=ndjson", headers=auth_headers)
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [{"text": "Test content"}]
+
+    assert client.get("/text/missing?stream=text", headers=auth_headers).status_code == 404
+    assert client.get("/text/testid1?stream=xml", headers=auth_headers).status_code == 422
+
 def test_embed_file_upload(tmp_path, auth_headers, monkeypatch):
     file_content = "Test content for embed upload."
     test_file = tmp_path / "upload_test.txt"
@@ -200,4 +259,101 @@ def test_query_multiple(auth_headers):
     assert isinstance(json_data, list)
     if json_data:
         doc = json_data[0][0]
-        assert doc["page_content"] == "Queried content"
\ No newline at end of file
+        assert doc["page_content"] == "Queried content"
+def test_query_batch(auth_headers):
+    data = {
+        "queries": [
+            {"query": "First query", "file_ids": ["testid1"], "k": 2},
+            {"query": "Second query", "file_ids": ["testid2"]},
+        ],
+        "entity_id": "testuser",
+    }
+    response = client.post("/query_batch", json=data, headers=auth_headers)
+    assert response.status_code == 200, f"Response: {response.text}"
+    json_data = response.json()
+    assert len(json_data) == 2
+    assert [results[0][0]["metadata"]["file_id"] for results in json_data] == ["testid1", "testid2"]
+
+    response = client.post("/query_batch", json={"queries": []}, headers=auth_headers)
+    assert response.status_code == 422
+
+def test_metrics(tmp_path, auth_headers):
+    test_file = tmp_path / "metrics.txt"
+    test_file.write_text("Counted by the metrics endpoint.")
+    with test_file.open("rb") as f:
+        client.post(
+            "/embed",
+            data={"file_id": "testid1", "entity_id": "testuser"},
+            files={"file": ("metrics.txt", f, "text/plain")},
+            headers=auth_headers,
+        )
+    client.post("/query", json={"file_id": "testid1", "query": "metrics", "k": 4}, headers=auth_headers)
+
+    response = client.get("/metrics", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'rag_http_request_duration_seconds_count{method="POST",route="/embed",status="200"}' in text
+    assert 'rag_http_request_duration_seconds_count{method="POST",route="/query",status="200"}' in text
+    for stage in ("load", "split", "embed", "insert", "search"):
+        assert f'rag_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert "rag_upload_bytes_total" in text and 'rag_chunks_total{outcome="stored"}' in text
+    assert "# TYPE rag_db_pool_connections gauge" in text
+
+def test_trace_id_propagates_from_request_header(auth_headers):
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    headers = {**auth_headers, "traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"}
+    response = client.post("/query", json={"file_id": "testid1", "query": "trace", "k": 4}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["traceparent"].startswith(f"00-{trace_id}-")
+
+    response = client.get("/ids", headers=auth_headers)
+    assert len(response.headers["traceparent"].split("-")[1]) == 32
+
+def test_upload_over_budget_is_rejected(tmp_path, auth_headers, monkeypatch):
+    from app.services.uploads import upload_budget
+
+    monkeypatch.setitem(upload_budget.limits, "memory", 0)
+    monkeypatch.setitem(upload_budget.limits, "disk", 0)
+    test_file = tmp_path / "rejected.txt"
+    test_file.write_text("No room for this upload.")
+    with test_file.open("rb") as f:
+        response = client.post(
+            "/text",
+            data={"file_id": "testid1", "entity_id": "testuser"},
+            files={"file": ("rejected.txt", f, "text/plain")},
+            headers=auth_headers,
+        )
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+    stats = client.get("/stats", headers=auth_headers).json()["uploads"]
+    assert stats["rejected"] >= 1 and stats["disk_bytes"] == 0
+
+def test_recovered_embed_job_replaces_the_chunks_of_the_interrupted_run(tmp_path, monkeypatch):
+    import asyncio
+
+    from app.models import CleanupMethod, IngestionJob
+    from app.routes import document_routes
+
+    calls = []
+
+    async def dummy_embed_uploaded_file(upload, filename, content_type, file_id, user_id, executor, **kwargs):
+        calls.append(kwargs["cleanup"])
+        return True, {"ids": ["id1"], "counters": {}}
+
+    monkeypatch.setattr(document_routes, "embed_uploaded_file", dummy_embed_uploaded_file)
+
+    async def report(**progress):
+        pass
+
+    for payload in ({}, {"recovered": True}, {"recovered": True, "cleanup": "incremental"}):
+        path = tmp_path / "queued.txt"
+        path.write_text("Queued before the worker stopped.")
+        job = IngestionJob(
+            job_id="job1", file_id="testid1", user_id="testuser", filename="queued.txt",
+            payload={"filepath": str(path), **payload},
+        )
+        asyncio.run(document_routes.run_embed_job(job, report))
+
+    assert calls == [None, CleanupMethod.full, "incremental"]
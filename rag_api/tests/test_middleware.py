@@ -37,4 +37,12 @@ async def test_security_middleware_valid(valid_jwt_header):
 async def test_security_middleware_invalid(invalid_jwt_header):
     request = DummyRequest("/protected", invalid_jwt_header)
     response = await security_middleware(request, dummy_call_next)
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("metrics_public, status_code", [(False, 401), (True, 200)])
+async def test_security_middleware_metrics_requires_jwt_unless_public(monkeypatch, metrics_public, status_code):
+    monkeypatch.setenv("JWT_SECRET", "testsecret")
+    monkeypatch.setattr("app.middleware.RAG_METRICS_PUBLIC", metrics_public)
+    response = await security_middleware(DummyRequest("/metrics", {}), dummy_call_next)
+    assert response.status_code == status_code
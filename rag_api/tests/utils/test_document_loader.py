@@ -27,4 +27,122 @@ def test_process_documents():
     processed = process_documents(docs)
     assert "dummy.txt" in processed
     assert "# PAGE 1" in processed
-    assert "# PAGE 2" in processed
\ No newline at end of file
+    assert "# PAGE 2" in processed
+def reference_process_documents(documents, overlap):
+    # The original, whole-string implementation
+    processed_text = ""
+    last_page = None
+    doc_basename = ""
+    for doc in documents:
+        if "source" in doc.metadata:
+            doc_basename = doc.metadata["source"].split("/")[-1]
+            break
+    processed_text += f"{doc_basename}\n"
+    for doc in documents:
+        current_page = doc.metadata.get("page")
+        if current_page and current_page != last_page:
+            processed_text += f"\n# PAGE {doc.metadata['page']}\n\n"
+            last_page = current_page
+        new_content = doc.page_content
+        if processed_text.endswith(new_content[:overlap]):
+            processed_text += new_content[overlap:]
+        else:
+            processed_text += new_content
+    return processed_text.strip()
+
+def test_document_text_assembler_matches_process_documents():
+    from app.utils.document_loader import DocumentTextAssembler
+
+    text = "Lorem ipsum dolor sit amet,  \n\n consectetur adipiscing elit " * 20
+    for overlap in (0, 5, 40):
+        chunks = [text[start : start + 100] for start in range(0, len(text), 100 - overlap)] + ["  \n"]
+        for metadata in ({"source": "/tmp/a.txt"}, {}):
+            docs = [
+                Document(page_content=chunk, metadata={**metadata, "page": index // 4})
+                for index, chunk in enumerate(chunks)
+            ]
+            assembler = DocumentTextAssembler(overlap=overlap)
+            streamed = assembler.start("a.txt" if metadata else "") + "".join(assembler.add(doc) for doc in docs)
+            assert streamed == reference_process_documents(docs, overlap)
+
+def test_document_text_assembler_cuts_overlap_from_offsets():
+    from app.utils.document_loader import DocumentTextAssembler
+
+    # Repetitive text defeats the string comparison, the stored offsets don't
+    text = "ab" * 50
+    docs = [
+        Document(
+            page_content=text[start : start + 30],
+            metadata={"file_id": "f", "start_index": start, "end_index": min(start + 30, len(text))},
+        )
+        for start in range(0, len(text), 23)
+    ]
+    assembler = DocumentTextAssembler(overlap=4)
+    assert assembler.start("") + "".join(assembler.add(doc) for doc in docs) == text
+
+def make_pdf(path, pages):
+    import fitz
+
+    pdf = fitz.open()
+    for number in range(pages):
+        pdf.new_page().insert_text((72, 72), f"Text of page {number + 1}")
+    pdf.save(path)
+    pdf.close()
+
+def test_parallel_pdf_loader_yields_pages_in_order(tmp_path):
+    from app.utils.document_loader import ParallelPdfLoader
+    from app.utils.pdf_pages import shutdown_process_pool
+
+    path = str(tmp_path / "manual.pdf")
+    make_pdf(path, 23)
+    try:
+        docs = list(ParallelPdfLoader(path, workers=2, pages_per_shard=4).lazy_load())
+    finally:
+        shutdown_process_pool()
+
+    assert [doc.metadata["page"] for doc in docs] == list(range(23))
+    assert [doc.page_content.strip() for doc in docs] == [f"Text of page {number + 1}" for number in range(23)]
+    assert docs[0].metadata["total_pages"] == 23
+
+def test_pdf_page_extraction_keeps_text_when_images_fail(tmp_path, monkeypatch):
+    from app.utils import pdf_pages
+
+    path = str(tmp_path / "scanned.pdf")
+    make_pdf(path, 3)
+
+    def broken_image_text(pdf, page):
+        raise KeyError("/Filter")
+
+    monkeypatch.setattr(pdf_pages, "_image_text", broken_image_text)
+    pages = pdf_pages.extract_page_range(path, 1, 10, extract_images=True)
+
+    assert [(number, text.strip()) for number, text, _ in pages] == [(1, "Text of page 2"), (2, "Text of page 3")]
+    assert all("/Filter" in error for _, _, error in pages)
+
+def test_pdf_page_workers_do_not_import_app_config():
+    import subprocess
+    import sys
+
+    # Spawned workers re-import the parent's main script, so run the pool as `python main.py` does
+    script = """
+import sys
+sys.modules["__main__"].__file__ = "main.py"
+from app.utils.pdf_pages import get_process_pool, shutdown_process_pool
+try:
+    print(get_process_pool(1).submit(eval, "sorted(__import__('sys').modules)").result())
+finally:
+    shutdown_process_pool()
+"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=root, capture_output=True, text=True, timeout=120, check=True
+    )
+    modules = eval(result.stdout)
+    assert "app.config" not in modules and "app.server" not in modules
+
+def test_get_loader_decodes_text_from_buffer():
+    loader, known_type, _ = get_loader("notes.txt", "text/plain", "uploads/user/notes.txt", buffer="Olá".encode("latin-1"))
+    assert known_type is True
+    [document] = loader.load()
+    assert document.page_content == "Olá"
+    assert document.metadata == {"source": "uploads/user/notes.txt"}
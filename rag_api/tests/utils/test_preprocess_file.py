@@ -0,0 +1,140 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import pytest
+
+from app.utils import preprocess_file
+from app.utils.preprocess_file import classify_pdf_page, pdf_policy_snapshot, preprocess_pdf
+
+
+def add_text_page(pdf, text):
+    page = pdf.new_page()
+    page.insert_textbox(fitz.Rect(72, 72, 540, 720), text)
+    return page
+
+
+def add_scanned_page(pdf):
+    page = pdf.new_page()
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 40), False)
+    pixmap.clear_with(200)
+    page.insert_image(fitz.Rect(36, 36, 560, 800), pixmap=pixmap)
+    return page
+
+
+def add_table_page(pdf):
+    page = pdf.new_page()
+    for row in range(12):
+        for column in range(4):
+            cell = fitz.Rect(72 + column * 110, 72 + row * 40, 182 + column * 110, 112 + row * 40)
+            page.draw_rect(cell, color=(0, 0, 0), width=1)
+            page.insert_text(cell.tl + (5, 20), f"r{row}c{column}")
+    return page
+
+
+def test_classify_pdf_page():
+    pdf = fitz.open()
+    add_text_page(pdf, "Born-digital paragraph with a real text layer. " * 20)
+    add_scanned_page(pdf)
+    add_table_page(pdf)
+    pdf.new_page()
+    text, scanned, table, blank = list(pdf)
+
+    assert (classify_pdf_page(text).route, classify_pdf_page(text).reason) == ("text", "text_layer")
+    decision = classify_pdf_page(scanned)
+    assert (decision.route, decision.reason) == ("vision", "scanned")
+    assert decision.image_coverage > 0.7 and not decision.has_fonts
+    decision = classify_pdf_page(table)
+    assert (decision.route, decision.reason) == ("vision", "tables")
+    assert decision.table_coverage > 0.3
+    assert classify_pdf_page(blank).route == "text"
+
+
+def test_preprocess_pdf_only_sends_vision_pages_to_the_llm(tmp_path, monkeypatch):
+    pdf = fitz.open()
+    add_text_page(pdf, "First page text. " * 10)
+    add_scanned_page(pdf)
+    add_scanned_page(pdf)
+    add_text_page(pdf, "Last page text. " * 10)
+    pdf_path = str(tmp_path / "mixed.pdf")
+    pdf.save(pdf_path)
+    pdf.close()
+
+    converted = []
+
+    def fake_pdf_to_markdown(source, target):
+        with fitz.open(source) as part:
+            converted.append(part.page_count)
+        with open(target, "w", encoding="utf-8") as f:
+            f.write("VISION MARKDOWN")
+
+    monkeypatch.setattr(preprocess_file, "pdf_to_markdown", fake_pdf_to_markdown)
+    monkeypatch.setattr(preprocess_file, "RAG_PDF_VISION_POLICY", "auto")
+    report = {}
+    _, content_type, md_path = preprocess_pdf(pdf_path, report)
+
+    with open(md_path, encoding="utf-8") as f:
+        markdown = f.read()
+    assert content_type == "text/markdown"
+    assert converted == [2]
+    assert markdown.index("First page") < markdown.index("VISION MARKDOWN") < markdown.index("Last page")
+    assert [page["route"] for page in report["pages"]] == ["text", "vision", "vision", "text"]
+    assert (report["text_pages"], report["vision_pages"]) == (2, 2)
+    assert report["estimated_cost_saved"] == pytest.approx(2 * preprocess_file.RAG_PDF_VISION_COST_PER_PAGE)
+
+
+
+def test_pdf_policy_stats_add_up_across_executor_threads(tmp_path, monkeypatch):
+    page_report = {"text_pages": 3, "vision_pages": 1, "estimated_seconds_saved": 0.5, "estimated_cost_saved": 0.25}
+    monkeypatch.setattr(preprocess_file, "_convert_pdf_pages", lambda pdf_path, md_path: dict(page_report))
+    monkeypatch.setattr(preprocess_file, "pdf_policy_stats", dict.fromkeys(["files", *page_report], 0))
+    paths = []
+    for index in range(200):
+        paths.append(str(tmp_path / f"file{index}.pdf"))
+        open(paths[-1], "wb").close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _, _, md_path in executor.map(preprocess_pdf, paths):
+            os.unlink(md_path)
+
+    assert pdf_policy_snapshot() == {
+        "files": 200,
+        "text_pages": 600,
+        "vision_pages": 200,
+        "estimated_seconds_saved": 100.0,
+        "estimated_cost_saved": 50.0,
+    }
+
+
+def test_preprocess_excel_streams_header_repeating_blocks(tmp_path):
+    import openpyxl
+
+    from app.utils.preprocess_file import preprocess_excel, write_excel_markdown
+
+    workbook = openpyxl.Workbook()
+    ledger = workbook.active
+    ledger.title = "Ledger"
+    ledger.append(["Account", None, "Amount"])
+    for row in range(1, 8):
+        ledger.append([f"acct|{row}", "note\nline", float(row * 10)])
+    ledger.append([None, None, None])
+    workbook.create_sheet("Empty").append(["Only", "Header"])
+    excel_path = tmp_path / "finance.xlsx"
+    workbook.save(excel_path)
+
+    with open(tmp_path / "blocks.md", "w", encoding="utf-8") as f:
+        assert write_excel_markdown(str(excel_path), f, block_rows=3) == 7
+    markdown = (tmp_path / "blocks.md").read_text(encoding="utf-8")
+
+    header = "| Account | Unnamed: 1 | Amount |\n| --- | --- | --- |\n"
+    ledger_part, empty_part = markdown.split("# 📋 Planilha: Empty")
+    assert "# 📋 Planilha: Ledger" in ledger_part
+    assert ledger_part.count(header) == 3
+    assert "| acct\\|1 | note line | 10 |" in ledger_part
+    assert "| Only | Header |" in empty_part
+
+    _, content_type, md_path = preprocess_excel(str(excel_path))
+    assert content_type == "text/markdown"
+    assert not excel_path.exists()
+    with open(md_path, encoding="utf-8") as f:
+        assert f.read().count("| acct") == 7
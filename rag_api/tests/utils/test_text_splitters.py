@@ -0,0 +1,101 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.services.ingestion import split_with_positions
+from app.utils.text_splitters import (
+    TEXT_SPLITTERS,
+    TableTextSplitter,
+    auto_splitter_name,
+    get_text_splitter,
+    register_text_splitter,
+    token_length,
+)
+
+HEADER = "| Account | Amount |\n| --- | --- |\n"
+
+
+def spreadsheet_markdown(rows, block_rows=4):
+    lines = ["", "# 📋 Planilha: Ledger", ""]
+    for start in range(0, rows, block_rows):
+        lines.append(HEADER.rstrip("\n"))
+        lines.extend(f"| acct {row} | {row * 10} |" for row in range(start, min(start + block_rows, rows)))
+        lines.append("")
+    lines += ["# 📋 Planilha: Notes", "", "Free text under the second sheet."]
+    return "\n".join(lines)
+
+
+def test_table_splitter_keeps_whole_rows_with_headers():
+    splitter = TableTextSplitter(chunk_size=120, chunk_overlap=20)
+    chunks = splitter.split_documents([Document(page_content=spreadsheet_markdown(10), metadata={"source": "f.md"})])
+
+    table_chunks = [chunk for chunk in chunks if "row_start" in chunk.metadata]
+    assert len(table_chunks) > 1
+    covered = []
+    for chunk in table_chunks:
+        assert chunk.page_content.startswith("# 📋 Planilha: Ledger\n\n" + HEADER)
+        assert chunk.metadata["sheet"] == "Ledger" and chunk.metadata["source"] == "f.md"
+        rows = chunk.page_content.split(HEADER)[1].split("\n")
+        assert rows == [f"| acct {row} | {row * 10} |" for row in range(chunk.metadata["row_start"], chunk.metadata["row_end"] + 1)]
+        covered.extend(range(chunk.metadata["row_start"], chunk.metadata["row_end"] + 1))
+    # Header-repeating blocks continue the row numbering
+    assert covered == list(range(10))
+    assert chunks[-1].page_content == "Free text under the second sheet."
+    assert chunks[-1].metadata["sheet"] == "Notes"
+
+
+def test_table_splitter_groups_csv_rows_across_documents():
+    rows = [
+        Document(page_content=f"name: item {row}\nnote: line one\nline two", metadata={"source": "f.csv", "row": row})
+        for row in range(6)
+    ]
+    splitter = get_text_splitter("csv", chunk_size=100, chunk_overlap=0)
+    chunks = list(split_with_positions(rows, splitter))
+
+    assert isinstance(splitter, TableTextSplitter)
+    assert len(chunks) == 3
+    assert chunks[0].page_content == (
+        "| name | note |\n| --- | --- |\n| item 0 | line one line two |\n| item 1 | line one line two |"
+    )
+    assert [(c.metadata["row_start"], c.metadata["row_end"], c.metadata["chunk_index"]) for c in chunks] == [
+        (0, 1, 0),
+        (2, 3, 1),
+        (4, 5, 2),
+    ]
+    assert all("row" not in chunk.metadata for chunk in chunks)
+    assert isinstance(get_text_splitter("pdf", 100, 10), RecursiveCharacterTextSplitter)
+
+
+def test_auto_splitter_by_file_type():
+    assert [auto_splitter_name(ext) for ext in ("md", "py", "ts", "csv", "xlsx", "pdf", None)] == [
+        "markdown",
+        "code",
+        "code",
+        "table",
+        "table",
+        "recursive",
+        "recursive",
+    ]
+
+    code = "def first():\n    return 1\n\n\ndef second():\n    return 2\n"
+    chunks = get_text_splitter("py", chunk_size=40, chunk_overlap=0, name="auto").split_text(code)
+    assert chunks == ["def first():\n    return 1", "def second():\n    return 2"]
+
+    with pytest.raises(ValueError, match="Unknown text splitter"):
+        get_text_splitter("txt", 100, 10, name="semantic")
+
+
+def test_token_unit_and_registered_splitters():
+    words = " ".join(f"word{i}" for i in range(200))
+    by_tokens = get_text_splitter("txt", chunk_size=50, chunk_overlap=0, unit="tokens").split_text(words)
+    assert all(token_length(chunk) <= 50 for chunk in by_tokens)
+    assert max(len(chunk) for chunk in by_tokens) > 50
+
+    @register_text_splitter("lines")
+    def lines_splitter(file_ext, chunk_size, chunk_overlap, length_function):
+        return RecursiveCharacterTextSplitter(separators=["\n"], chunk_size=1, chunk_overlap=0, keep_separator=False)
+
+    try:
+        assert get_text_splitter("txt", 5, 0, name="lines").split_text("one\ntwo\nthree") == ["one", "two", "three"]
+    finally:
+        TEXT_SPLITTERS.pop("lines")